@@ -3,12 +3,49 @@ from __future__ import annotations
 import numpy as np
 import xarray as xr
 
+from ..methods.common.rolling import group_mean, rolling_mean
+
 
 def weighted_mean(ds, *args, **kwargs):
     weights = ds.time.dt.days_in_month
     return ds.weighted(weights).mean(dim='time')
 
 
+def daily_climatology(ds: xr.Dataset, window: int = 31) -> xr.Dataset:
+    """Climatology of each day of year, smoothed with a centered rolling mean across days of year
+    (wrapping around the end of the year)
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Daily dataset
+    window : int, optional
+        Number of days of year in the (odd) smoothing window, by default 31
+
+    Returns
+    -------
+    xr.Dataset
+        Smoothed climatology with a dayofyear dimension instead of time
+    """
+    doy = ds.time.dt.dayofyear.values
+    days = np.unique(doy)
+
+    def _climatology(values):
+        _, mean = group_mean(np.moveaxis(values, -1, 0), doy)
+        return np.moveaxis(rolling_mean(mean, window, pad='wrap'), 0, -1)
+
+    climatology = xr.apply_ufunc(
+        _climatology,
+        ds,
+        input_core_dims=[['time']],
+        output_core_dims=[['dayofyear']],
+        dask='parallelized',
+        dask_gufunc_kwargs={'output_sizes': {'dayofyear': len(days)}},
+        output_dtypes=[float],
+    )
+    return climatology.assign_coords(dayofyear=days)
+
+
 def days_temperature_threshold(
     ds: xr.Dataset, threshold_direction: str, value: float
 ) -> xr.Dataset:
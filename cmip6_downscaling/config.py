@@ -40,18 +40,59 @@ _defaults = {
         "cmip": {
             'uri': "https://cmip6downscaling.blob.core.windows.net/cmip6/pangeo-cmip6.json",
             'storage_options': {"account_name": "cmip6downscaling"},
+            'cache_dir': '/tmp/cmip6_downscaling/cmip_catalog',
+            'ttl': 3600,
         },
         "era5": {
             'uri': "https://cmip6downscaling.blob.core.windows.net/cmip6/ERA5_daily/",
             'storage_options': {"account_name": "cmip6downscaling"},
+            'metadata_cache': '/tmp/cmip6_downscaling/era5_metadata',
+            'open_workers': 16,
         },
     },
     'weights': {
         'gcm_pyramid_weights': {'uri': 'az://static/xesmf_weights/cmip6_pyramids/weights.csv'},
         'downscaled_pyramid_weights': {
-            'uri': 'az://static/xesmf_weights/downscaled_pyramid/weights.csv'
+            'uri': 'az://static/xesmf_weights/downscaled_pyramid/weights.csv',
+            'mirror': '/tmp/cmip6_downscaling/weights_catalogs/downscaled_pyramid_weights.csv',
         },
-        'gcm_obs_weights': {'uri': 'az://static/xesmf_weights/gcm_obs/weights.csv'},
+        'gcm_obs_weights': {
+            'uri': 'az://static/xesmf_weights/gcm_obs/weights.csv',
+            'mirror': '/tmp/cmip6_downscaling/weights_catalogs/gcm_obs_weights.csv',
+        },
+        'ttl': 3600,
+    },
+    'regridding': {
+        'cache_dir': '/tmp/cmip6_downscaling/xesmf_weights',
+        'memory_cache_size': 8,
+        'disk_cache_size': '20GB',
+    },
+    'scrf': {
+        'uri': 'az://static/scrf/ERA5_{variable}_1981_1990.zarr',
+    },
+    'land_mask': {
+        'polygons': 'https://cmip6downscaling.blob.core.windows.net/static/1deg_buffer_gdf.gpkg',
+        'uri': 'az://static/land_masks',
+        'cache_dir': '/tmp/cmip6_downscaling/land_masks',
+        'memory_cache_size': 16,
+        'disk_cache_size': '1GB',
+    },
+    'region_masks': {
+        'uri': 'az://static/region_masks',
+        'memory_cache_size': 16,
+    },
+    'write_zarr_once': {
+        # seconds after which a store left incomplete by a writer is deleted and written again
+        'grace_period': 3600,
+    },
+    'maca_bias_correction': {
+        'n_workers': 1,
+    },
+    'combine_regions': {
+        'n_workers': 8,
+        'max_open_stores': 32,
+        # runs over mostly ocean domains can set this to False to skip writing empty chunks
+        'write_empty_chunks': True,
     },
     'run_options': {
         'runtime': "pangeo",
@@ -59,6 +100,11 @@ _defaults = {
         'generate_pyramids': False,
         'construct_analogs': True,
         'combine_regions': False,
+        'lazy_region_split': True,
+        'fuse_epoch_replacement': True,
+        'skip_ocean_chunks': False,
+        'gard_thresh_fixes': False,
+        'gard_approximate_icdf': False,
     },
     "runtime": {
         "cloud": {
@@ -1,14 +1,160 @@
 from __future__ import annotations
 
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+
 import dask
+import fsspec
 import pandas as pd
 import xarray as xr
 
+from .. import config
+from ..utils import str_to_hash, version_tag
 from . import cat
 from .utils import lon_to_180, to_standard_calendar as convert_to_standard_calendar
 
 xr.set_options(keep_attrs=True)
 
+SEARCH_FACETS = [
+    'activity_id',
+    'experiment_id',
+    'member_id',
+    'source_id',
+    'table_id',
+    'grid_label',
+    'variable_id',
+]
+
+_catalogs: dict = {}
+_catalogs_lock = threading.Lock()
+
+
+def _cached_download(url: str, cache_dir: str) -> str:
+    """Keep a local snapshot of `url`, revalidated against the remote ETag.
+
+    The remote is only downloaded when its ETag (or modification time) differs from the one
+    recorded for the snapshot. If the remote can't be reached, an existing snapshot is used.
+
+    Returns
+    -------
+    path : str
+        Path to the local snapshot
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    local_path = os.path.join(cache_dir, f'{str_to_hash(url)}_{os.path.basename(url)}')
+    tag_path = f'{local_path}.etag'
+    fs, path = fsspec.core.url_to_fs(url)
+    try:
+        remote_tag = version_tag(fs.info(path))
+    except Exception as e:
+        if os.path.exists(local_path):
+            print(f'failed to revalidate {url} ({e!r}), using local snapshot {local_path}')
+            return local_path
+        raise
+
+    if remote_tag is not None and os.path.exists(local_path) and os.path.exists(tag_path):
+        with open(tag_path) as f:
+            if f.read() == remote_tag:
+                return local_path
+
+    print(f'downloading catalog snapshot {url}')
+    tmp_path = f'{local_path}.{uuid.uuid4().hex}.tmp'
+    fs.get_file(path, tmp_path)
+    os.replace(tmp_path, local_path)
+    if remote_tag is not None:
+        with open(tag_path, 'w') as f:
+            f.write(remote_tag)
+    return local_path
+
+
+def load_cmip_catalog(url: str = None) -> dict:
+    """Load the CMIP6 intake-esm catalog from a local snapshot, memoized in process.
+
+    The catalog JSON and CSV are kept under ``data_catalog.cmip.cache_dir`` and revalidated
+    against their remote ETags at most every ``data_catalog.cmip.ttl`` seconds. The parsed
+    catalog is indexed by `SEARCH_FACETS`.
+
+    Parameters
+    ----------
+    url : str, optional
+        Catalog JSON url, by default the one of the ``cmip6`` entry in the intake catalog
+
+    Returns
+    -------
+    catalog : dict
+        ``esmcat`` (the catalog JSON), ``df`` (the catalog DataFrame) and ``index`` (mapping of
+        facet values to row positions in ``df``)
+    """
+    url = url or cat.cmip6.describe()['args']['esmcol_obj']
+    ttl = config.get('data_catalog.cmip.ttl')
+    with _catalogs_lock:
+        checked_at, catalog = _catalogs.get(url, (None, None))
+        if checked_at is not None and time.time() - checked_at < ttl:
+            return catalog
+
+    cache_dir = config.get('data_catalog.cmip.cache_dir')
+    json_path = _cached_download(url, cache_dir)
+    with open(json_path) as f:
+        esmcat = json.load(f)
+    csv_url = esmcat['catalog_file']
+    if '://' not in csv_url and not os.path.isabs(csv_url):
+        csv_url = f'{os.path.dirname(url)}/{csv_url}'
+    csv_path = _cached_download(csv_url, cache_dir)
+
+    # skip parsing when neither snapshot changed since the catalog was last loaded
+    snapshot = (os.path.getmtime(json_path), os.path.getmtime(csv_path))
+    if catalog is None or catalog['snapshot'] != snapshot:
+        compression = 'gzip' if csv_url.endswith('.gz') else 'infer'
+        df = pd.read_csv(csv_path, compression=compression)
+        catalog = {
+            'esmcat': esmcat,
+            'df': df,
+            'index': df.groupby(SEARCH_FACETS, sort=False).indices,
+            'snapshot': snapshot,
+        }
+    with _catalogs_lock:
+        _catalogs[url] = (time.time(), catalog)
+    return catalog
+
+
+def search_cmip_catalog(catalog: dict, **facets):
+    """Search the CMIP6 catalog through its facet index
+
+    Parameters
+    ----------
+    catalog : dict
+        Catalog loaded with `load_cmip_catalog`
+    **facets
+        Facet values (str or list of str) keyed by facet name. Facets that are not given or None
+        match everything.
+
+    Returns
+    -------
+    col_subset : intake_esm.esm_datastore
+    """
+    from intake_esm import esm_datastore
+
+    values = []
+    for facet in SEARCH_FACETS:
+        value = facets.get(facet)
+        if value is None:
+            values.append(None)
+        else:
+            values.append({value} if isinstance(value, str) else set(value))
+
+    index = catalog['index']
+    if all(v is not None for v in values):
+        keys = [key for key in itertools.product(*values) if key in index]
+    else:
+        keys = [key for key in index if all(v is None or k in v for k, v in zip(key, values))]
+    rows = sorted(itertools.chain.from_iterable(index[key] for key in keys))
+    df = catalog['df'].iloc[rows].reset_index(drop=True)
+    return esm_datastore({'esmcat': dict(catalog['esmcat']), 'df': df})
+
 
 def postprocess(ds: xr.Dataset, to_standard_calendar: bool = True) -> xr.Dataset:
     """Post process input experiment
@@ -110,8 +256,8 @@ def load_cmip(
     """
     with dask.config.set(**{'array.slicing.split_large_chunks': False}):
 
-        col = cat.cmip6()
-        col_subset = col.search(
+        col_subset = search_cmip_catalog(
+            load_cmip_catalog(),
             activity_id=activity_ids,
             experiment_id=experiment_ids,
             member_id=member_ids,
@@ -1,7 +1,16 @@
 from __future__ import annotations
 
+import json
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 import xarray as xr
+from zarr.storage import FSStore
 
+from .. import config
+from ..utils import str_to_hash, version_tag
 from . import cat
 from .utils import lon_to_180
 
@@ -14,6 +23,131 @@ variable_name_dict = {
 }
 
 
+class MetadataCachingFSStore(FSStore):
+    """Read-only ``FSStore`` that keeps a store's metadata in a local directory.
+
+    The consolidated metadata (``.zmetadata``, built from the individual ``.zarray``/``.zattrs``
+    keys when the remote store isn't consolidated) and the chunks of dimension coordinates are
+    read from `cache_dir`, and fetched from the remote store only on the first open. Data chunks
+    are always read from the remote store.
+
+    On every open, the cache is revalidated against the version tag (ETag or modification time)
+    of the remote ``.zmetadata`` (``.zgroup`` when the remote store isn't consolidated), and
+    emptied when it changed. If the remote can't be reached, the cached keys are used.
+
+    Parameters
+    ----------
+    url : str
+        Remote store url
+    cache_dir : str
+        Local directory holding the cached keys
+    **storage_options
+        Passed on to ``fsspec``
+    """
+
+    def __init__(self, url: str, cache_dir: str, **storage_options):
+        super().__init__(url, mode='r', **storage_options)
+        self.cache_dir = cache_dir
+        self._revalidate()
+        self._coords = set()
+        metadata = json.loads(self['.zmetadata'])['metadata']
+        for key, attrs in metadata.items():
+            name, _, suffix = key.rpartition('/')
+            if suffix == '.zattrs' and attrs.get('_ARRAY_DIMENSIONS') == [name]:
+                self._coords.add(name)
+
+    def _remote_tag(self) -> str | None:
+        for key in ['.zmetadata', '.zgroup']:
+            try:
+                return version_tag(self.fs.info(f'{self.path}/{key}'))
+            except FileNotFoundError:
+                pass
+        return None
+
+    def _revalidate(self):
+        """Empty the cache when the remote metadata changed since it was cached"""
+        try:
+            remote_tag = self._remote_tag()
+        except Exception as e:
+            print(f'failed to revalidate {self.path} ({e!r}), using cached metadata')
+            return
+        if remote_tag is None:
+            return
+        tag_path = os.path.join(self.cache_dir, '.zmetadata.etag')
+        try:
+            with open(tag_path) as f:
+                if f.read() == remote_tag:
+                    return
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{tag_path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(remote_tag)
+        os.replace(tmp_path, tag_path)
+
+    def _is_cached(self, key: str) -> bool:
+        return key == '.zmetadata' or key.split('/')[0] in self._coords
+
+    def _fetch(self, key: str) -> bytes:
+        if key != '.zmetadata':
+            return super().__getitem__(key)
+        try:
+            return super().__getitem__(key)
+        except KeyError:
+            pass
+        # remote store isn't consolidated, consolidate its metadata here
+        metadata = {}
+        for prefix in [''] + [f'{name}/' for name in self.listdir()]:
+            for meta_key in ['.zgroup', '.zarray', '.zattrs']:
+                try:
+                    metadata[prefix + meta_key] = json.loads(super().__getitem__(prefix + meta_key))
+                except KeyError:
+                    pass
+        return json.dumps({'zarr_consolidated_format': 1, 'metadata': metadata}).encode()
+
+    def __getitem__(self, key):
+        if not self._is_cached(key):
+            return super().__getitem__(key)
+        path = os.path.join(self.cache_dir, *key.split('/'))
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        value = self._fetch(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        return value
+
+    def getitems(self, keys, **kwargs):
+        remote_keys = [key for key in keys if not self._is_cached(key)]
+        results = super().getitems(remote_keys, **kwargs) if remote_keys else {}
+        for key in filter(self._is_cached, keys):
+            try:
+                results[key] = self[key]
+            except KeyError:
+                pass
+        return results
+
+
+def _open_era5_year(year: int) -> xr.Dataset:
+    """Lazily open one year of ERA5, with metadata cached locally (keyed on the store url)"""
+    source = cat.era5(year=year)
+    store = MetadataCachingFSStore(
+        source.urlpath,
+        cache_dir=os.path.join(
+            config.get('data_catalog.era5.metadata_cache'), str_to_hash(source.urlpath)
+        ),
+        **source.storage_options,
+    )
+    return xr.open_dataset(store, engine='zarr', chunks={}, consolidated=True)
+
+
 def open_era5(variables: str | list[str], time_period: slice) -> xr.Dataset:
     """Open ERA5 daily data for one or more variables for period 1979-2021
 
@@ -28,6 +162,12 @@ def open_era5(variables: str | list[str], time_period: slice) -> xr.Dataset:
     -------
     xarray.Dataset
         A daily dataset for one variable.
+
+    Notes
+    -----
+    Yearly stores are opened concurrently, each from metadata cached under
+    ``data_catalog.era5.metadata_cache``, and combined lazily: no data or coordinates are
+    compared or loaded when concatenating the years.
     """
     if isinstance(variables, str):
         variables = [variables]
@@ -39,7 +179,18 @@ def open_era5(variables: str | list[str], time_period: slice) -> xr.Dataset:
             wind_vars.append(variable)
         else:
             non_wind_vars.append(variable)
-    ds = xr.concat([cat.era5(year=year).to_dask()[non_wind_vars] for year in years], dim='time')
+    with ThreadPoolExecutor(
+        max_workers=min(len(years), config.get('data_catalog.era5.open_workers'))
+    ) as pool:
+        yearly = list(pool.map(_open_era5_year, years))
+    ds = xr.concat(
+        [year_ds[non_wind_vars] for year_ds in yearly],
+        dim='time',
+        data_vars='minimal',
+        coords='minimal',
+        compat='override',
+        join='override',
+    )
     for wind_var in wind_vars:
         era5_winds = xr.open_zarr('az://training/ERA5_daily_winds').rename(
             {'latitude': 'lat', 'longitude': 'lon'}
@@ -12,7 +12,7 @@ from upath import UPath
 
 from ... import __version__ as version, config
 from ...constants import ABSOLUTE_VARS, RELATIVE_VARS
-from ...utils import str_to_hash
+from ..common.cache import cache_target
 from ..common.containers import RunParameters
 from ..common.utils import apply_land_mask, zmetadata_exists
 from .utils import reconstruct_finescale
@@ -63,8 +63,12 @@ def spatial_anomalies(obs_full_time_path: UPath, interpolated_obs_full_time_path
         Path to spatial anomalies dataset.  (shape (nlat, nlon, 12))
     """
 
-    ds_hash = str_to_hash(str(obs_full_time_path) + str(interpolated_obs_full_time_path))
-    target = intermediate_dir / 'bcsd_spatial_anomalies' / ds_hash
+    target = cache_target(
+        intermediate_dir,
+        'bcsd_spatial_anomalies',
+        obs_full_time_path=obs_full_time_path,
+        interpolated_obs_full_time_path=interpolated_obs_full_time_path,
+    )
 
     if use_cache and zmetadata_exists(target):
         print(f"found existing target: {target}")
@@ -164,14 +168,15 @@ def fit_and_predict(
     """
 
     title = "bcsd_predictions"
-    ds_hash = str_to_hash(
-        str(experiment_train_full_time_path)
-        + str(experiment_predict_full_time_path)
-        + str(coarse_obs_full_time_path)
+    target = cache_target(
+        intermediate_dir,
+        'bcsd_fit_and_predict',
+        experiment_train_full_time_path=experiment_train_full_time_path,
+        experiment_predict_full_time_path=experiment_predict_full_time_path,
+        coarse_obs_full_time_path=coarse_obs_full_time_path,
+        variable=run_parameters.variable,
     )
 
-    target = intermediate_dir / 'bcsd_fit_and_predict' / ds_hash
-
     if use_cache and zmetadata_exists(target):
         print(f"found existing target: {target}")
         return target
@@ -224,8 +229,12 @@ def postprocess_bcsd(
 
     title = "bcsd_postprocess"
 
-    ds_hash = str_to_hash(str(bias_corrected_fine_full_time_path) + str(spatial_anomalies_path))
-    target = results_dir / title / ds_hash
+    target = cache_target(
+        results_dir,
+        title,
+        bias_corrected_fine_full_time_path=bias_corrected_fine_full_time_path,
+        spatial_anomalies_path=spatial_anomalies_path,
+    )
     print(target)
     if use_cache and zmetadata_exists(target):
         print(f"found existing target: {target}")
@@ -247,10 +256,13 @@ def postprocess_bcsd(
         args=[spatial_anomalies_ds],
         template=bias_corrected_fine_full_time_ds,
     )
-    # masking out ocean regions
-    bcsd_results_ds = apply_land_mask(bcsd_results_ds)
+    # masking out ocean regions, chunks that are entirely ocean are neither computed nor written
+    skip_ocean_chunks = config.get('run_options.skip_ocean_chunks')
+    bcsd_results_ds = apply_land_mask(bcsd_results_ds, skip_ocean_chunks=skip_ocean_chunks)
 
     bcsd_results_ds.attrs.update({'title': title}, **get_cf_global_attrs(version=version))
+    for variable in bcsd_results_ds.data_vars:
+        bcsd_results_ds[variable].encoding['write_empty_chunks'] = not skip_ocean_chunks
     bcsd_results_ds.to_zarr(target, mode='w')
 
     return target
@@ -11,6 +11,8 @@ from skdownscale.pointwise_models import (
 )
 from sklearn.preprocessing import QuantileTransformer, StandardScaler
 
+from .quantile_mapping import apply_quantile_mapping
+
 xr.set_options(keep_attrs=True)
 
 VALID_CORRECTIONS = ['absolute', 'relative']
@@ -35,7 +37,7 @@ def bias_correct_obs_by_method(
         sc.fit(da_obs)
         return sc.transform(da_obs)
 
-    elif method in {'quantile_map', 'detrended_quantile_map', 'none'}:
+    elif method in {'quantile_map', 'detrended_quantile_map', 'equidistant_cdf_matching', 'none'}:
         return da_obs
 
     else:
@@ -44,6 +46,7 @@ def bias_correct_obs_by_method(
             'z_score',
             'quantile_map',
             'detrended_quantile_map',
+            'equidistant_cdf_matching',
             'none',
         ]
         raise NotImplementedError(f'bias correction method must be one of {available_methods}')
@@ -69,6 +72,14 @@ def bias_correct_gcm_by_method(
         qm.fit(obs)
         return qm.transform(gcm_pred)
 
+    # without tail extrapolation, quantile mapping runs on the whole grid at once
+    elif method in {'quantile_map', 'detrended_quantile_map'} and not bc_kwargs.get('extrapolate'):
+        kwargs = {k: v for k, v in bc_kwargs.items() if k != 'extrapolate'}
+        return apply_quantile_mapping(gcm_pred, gcm_hist, obs, method=method, **kwargs)
+
+    elif method == 'equidistant_cdf_matching':
+        return apply_quantile_mapping(gcm_pred, gcm_hist, obs, method=method, **bc_kwargs)
+
     # TODO: test to see QuantileMappingReressor and TrendAwareQuantileMappingRegressor
     # can handle multiple variables at once
     elif method == 'quantile_map':
@@ -103,5 +114,6 @@ def bias_correct_gcm_by_method(
             'none',
             'quantile_mapper',
             'cunnane_transform',
+            'equidistant_cdf_matching',
         ]
         raise NotImplementedError(f'bias correction method must be one of {available_methods}')
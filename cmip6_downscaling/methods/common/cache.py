@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+import re
+from typing import Any
+
+import fsspec
+import numpy as np
+from upath import UPath
+
+from ...utils import str_to_hash, version_tag
+
+_NUMERIC_STRING = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+
+
+def store_fingerprint(path: UPath | str) -> str:
+    """Fingerprint a zarr store from its consolidated metadata.
+
+    The fingerprint depends on the content of the store's ``.zmetadata`` (schema, chunking and
+    attributes) and on the version tag of that object (ETag or modification time), not on how the
+    path to the store is spelled. Rewriting an upstream store therefore produces a new fingerprint,
+    even when its metadata is unchanged. Paths that don't point at a consolidated zarr store fall
+    back to the normalized path string.
+
+    Parameters
+    ----------
+    path : UPath or str
+        Path to zarr store
+
+    Returns
+    -------
+    fingerprint : str
+    """
+    mapper = fsspec.get_mapper(str(path))
+    try:
+        zmetadata = json.loads(mapper['.zmetadata'])
+        info = mapper.fs.info(f"{mapper.root}/.zmetadata")
+    except (KeyError, OSError, ValueError):
+        return str(path).rstrip('/')
+    return str_to_hash(json.dumps([zmetadata, version_tag(info)], sort_keys=True))
+
+
+def _normalize(obj: Any) -> Any:
+    """Convert task inputs into a canonical, JSON serializable form"""
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return _normalize(dataclasses.asdict(obj))
+    if isinstance(obj, dict):
+        return {str(key): _normalize(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(value) for value in obj]
+    if isinstance(obj, (set, frozenset)):
+        return sorted(_normalize(value) for value in obj)
+    if isinstance(obj, os.PathLike):
+        return {'store': store_fingerprint(obj)}
+    if isinstance(obj, slice):
+        return _normalize([obj.start, obj.stop, obj.step])
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if obj is None or isinstance(obj, bool):
+        return obj
+    if isinstance(obj, str):
+        if not _NUMERIC_STRING.match(obj.strip()):
+            return obj
+        # numbers passed in as strings (e.g. from json configs) hash the same as numbers
+        obj = float(obj)
+    if isinstance(obj, float) and obj.is_integer():
+        return int(obj)
+    if isinstance(obj, (int, float)):
+        return obj
+    return repr(obj)
+
+
+def cache_manifest(name: str, *, code_version: int = 0, **inputs) -> dict:
+    """Build the canonical manifest describing a task output.
+
+    Parameters
+    ----------
+    name : str
+        Task name
+    code_version : int, optional
+        Version of the task implementation. Bump this whenever a change to the task changes its
+        output so previously cached targets are not reused, by default 0
+    **inputs
+        Everything that determines the task output. Upstream stores (``UPath``/``os.PathLike``
+        objects) are replaced by their fingerprint, parameters are normalized.
+
+    Returns
+    -------
+    manifest : dict
+    """
+    return {'task': name, 'code_version': code_version, 'inputs': _normalize(inputs)}
+
+
+def cache_key(name: str, *, code_version: int = 0, **inputs) -> str:
+    """Hash of the manifest built by :py:func:`cache_manifest`
+
+    Returns
+    -------
+    key : str
+    """
+    manifest = cache_manifest(name, code_version=code_version, **inputs)
+    return str_to_hash(json.dumps(manifest, sort_keys=True))
+
+
+def cache_target(root: UPath, name: str, *, code_version: int = 0, **inputs) -> UPath:
+    """Content-addressed cache target for a task output.
+
+    Every task derives its output location from this function so that equivalent runs resolve to
+    the same target and changes to any upstream store, parameter or task version resolve to a new
+    one.
+
+    Parameters
+    ----------
+    root : UPath
+        Storage root, e.g. ``intermediate_dir`` or ``results_dir``
+    name : str
+        Task name, used as the directory under ``root``
+    code_version : int, optional
+        Version of the task implementation, by default 0
+    **inputs
+        Everything that determines the task output
+
+    Returns
+    -------
+    target : UPath
+        ``root / name / key``
+
+    See also
+    --------
+    cache_manifest
+    """
+    return root / name / cache_key(name, code_version=code_version, **inputs)
@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+import inspect
+
+import numpy as np
+import xarray as xr
+
+KINDS = ['difference', 'ratio']
+METHODS = ['equidistant_cdf_matching', 'quantile_map', 'detrended_quantile_map']
+
+
+def plotting_positions(n: int, alpha: float = 0.4, beta: float = 0.4) -> np.ndarray:
+    """Monotonic plotting positions of a sample of size `n` (same as skdownscale's)
+
+    Parameters
+    ----------
+    n : int
+        Sample size
+    alpha, beta : float
+        Plotting position parameters, by default 0.4
+
+    Returns
+    -------
+    pp : np.ndarray
+        Plotting positions, shape (n,)
+    """
+    return (np.arange(1, n + 1) - alpha) / (n + 1.0 - alpha - beta)
+
+
+def _flatten(values: np.ndarray) -> np.ndarray:
+    """View an array of shape (n, ...) as (n, n_pixels)"""
+    return np.asarray(values).reshape(len(values), -1)
+
+
+def _check_n_endpoints(n_endpoints: int, *train: np.ndarray) -> None:
+    """Validate `n_endpoints` and the training sample sizes like ``QuantileMappingReressor``"""
+    if n_endpoints < 2:
+        raise ValueError('Invalid number of n_endpoints, must be >= 2')
+    for values in train:
+        if len(values) < 2 * n_endpoints + 1:
+            raise ValueError(
+                f'{len(values)} training samples, at least {2 * n_endpoints + 1} are required '
+                f'with n_endpoints={n_endpoints}'
+            )
+
+
+def _bracket(count: np.ndarray, m: int) -> tuple[np.ndarray, np.ndarray]:
+    """Indices of the lower and upper interpolation nodes from the number of nodes <= x"""
+    lower = np.clip(count - 1, 0, max(m - 2, 0))
+    return lower, np.minimum(lower + 1, m - 1)
+
+
+def batched_interp(x: np.ndarray, xp: np.ndarray, fp: np.ndarray) -> np.ndarray:
+    """One-dimensional linear interpolation along the first axis of every pixel at once.
+
+    Equivalent to ``np.interp(x[:, i], xp[:, i], fp[:, i])`` for every pixel ``i`` (values outside
+    of `xp` are clamped to the end values of `fp`). When the sample points `xp` are shared by all
+    pixels (1d), the interpolation nodes and weights are computed once and only the gather is done
+    per pixel. Otherwise all pixels are searched together by merging `x` into the (sorted) `xp`
+    with one stable sort along the first axis.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Coordinates to evaluate, shape (k,) or (k, n_pixels)
+    xp : np.ndarray
+        Increasing sample coordinates, shape (m,) or (m, n_pixels)
+    fp : np.ndarray
+        Sample values, shape (m,) or (m, n_pixels)
+
+    Returns
+    -------
+    interpolated : np.ndarray
+        Shape (k, n_pixels), or (k,) when all inputs are 1d
+    """
+    x = np.asarray(x, dtype=np.float64)
+    xp = np.asarray(xp, dtype=np.float64)
+    fp = np.asarray(fp, dtype=np.float64)
+
+    if xp.ndim == 1:
+        lower, upper = _bracket(np.searchsorted(xp, x, side='right'), len(xp))
+        x_lower, x_upper = xp[lower], xp[upper]
+    else:
+        m = xp.shape[0]
+        x = np.broadcast_to(x.reshape(len(x), -1), (len(x), xp.shape[1]))
+        # nodes come first in the merged array, so a stable sort puts ties with x after them and
+        # the running number of nodes at the position of each x is the side='right' search result
+        order = np.argsort(np.concatenate([xp, x]), axis=0, kind='stable').T
+        is_x = order >= m
+        counts = np.cumsum(~is_x, axis=1)
+        count = np.empty(x.shape[::-1], dtype=counts.dtype)
+        np.put_along_axis(
+            count, (order[is_x] - m).reshape(count.shape), counts[is_x].reshape(count.shape), axis=1
+        )
+        lower, upper = _bracket(count.T, m)
+        x_lower = np.take_along_axis(xp, lower, axis=0)
+        x_upper = np.take_along_axis(xp, upper, axis=0)
+
+    dx = x_upper - x_lower
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.where(dx > 0, (x - x_lower) / dx, x >= x_upper)
+    weight = np.clip(weight, 0, 1)
+
+    if fp.ndim == 1:
+        f_lower, f_upper = fp[lower], fp[upper]
+    elif lower.ndim == 1:
+        f_lower, f_upper = fp[lower], fp[upper]
+        weight = weight[:, np.newaxis]
+    else:
+        f_lower = np.take_along_axis(fp, lower, axis=0)
+        f_upper = np.take_along_axis(fp, upper, axis=0)
+    return f_lower + weight * (f_upper - f_lower)
+
+
+def _linear_trend(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Mean and centered least squares trend line along the first axis of (n, n_pixels) values"""
+    t = np.arange(len(values), dtype=np.float64)
+    t -= t.mean()
+    mean = values.mean(axis=0)
+    slope = (t @ (values - mean)) / (t @ t) if len(t) > 1 else np.zeros_like(mean)
+    return mean, t[:, np.newaxis] * slope
+
+
+def equidistant_cdf_matching(
+    x: np.ndarray,
+    x_train: np.ndarray,
+    y_train: np.ndarray,
+    kind: str = 'difference',
+    max_ratio: float = None,
+    y_sorted: bool = False,
+) -> np.ndarray:
+    """Equidistant CDF matching of every pixel of a gridded array at once.
+
+    Gridded equivalent of fitting ``EquidistantCdfMatcher(kind=kind, extrapolate=None)`` on
+    (`x_train`, `y_train`) and predicting `x` pixel by pixel: each value of `x` is mapped to the
+    observed value at its quantile, plus the difference (or times the ratio) between it and the
+    training value at the same quantile. All pixels are sorted along time together and, since
+    the plotting positions only depend on the sample sizes, the interpolation nodes and weights
+    are computed once for the whole grid.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Data to bias correct, shape (n_time, ...)
+    x_train : np.ndarray
+        Training data on the same grid as `x`, shape (n_train, ...)
+    y_train : np.ndarray
+        Training target (e.g. observations), shape (n_obs, ...)
+    kind : str, optional
+        'difference' or 'ratio', by default 'difference'
+    max_ratio : float, optional
+        Upper bound of the ratio for ``kind='ratio'``, by default None
+    y_sorted : bool, optional
+        Whether `y_train` is already sorted along the first axis, by default False
+
+    Returns
+    -------
+    y_hat : np.ndarray
+        Bias corrected data, same shape as `x`
+    """
+    if kind not in KINDS:
+        raise ValueError(f'kind must be one of {KINDS}, got {kind}')
+    shape = np.shape(x)
+    x = _flatten(x)
+    x_train = np.sort(_flatten(x_train), axis=0)
+    y_train = _flatten(y_train)
+    if not y_sorted:
+        y_train = np.sort(y_train, axis=0)
+
+    order = np.argsort(x, axis=0)
+    x_sorted = np.take_along_axis(x, order, axis=0)
+    pp = plotting_positions(len(x))
+    x_train_vals = batched_interp(pp, plotting_positions(len(x_train)), x_train)
+    y_vals = batched_interp(pp, plotting_positions(len(y_train)), y_train)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if kind == 'difference':
+            sorted_y_hat = y_vals + (x_sorted - x_train_vals)
+        else:
+            ratio = x_sorted / x_train_vals
+            if max_ratio is not None:
+                ratio = np.minimum(ratio, max_ratio)
+            sorted_y_hat = y_vals * ratio
+
+    y_hat = np.empty(x.shape, dtype=sorted_y_hat.dtype)
+    np.put_along_axis(y_hat, order, sorted_y_hat, axis=0)
+    return y_hat.reshape(shape)
+
+
+def quantile_mapping(
+    x: np.ndarray, x_train: np.ndarray, y_train: np.ndarray, n_endpoints: int = 10
+) -> np.ndarray:
+    """Quantile mapping of every pixel of a gridded array at once.
+
+    Gridded equivalent of fitting ``QuantileMappingReressor(extrapolate=None, n_endpoints)`` on
+    (`x_train`, `y_train`) and predicting `x` pixel by pixel: each value of `x` is mapped to its
+    quantile in the training data and then to the value of `y_train` at that quantile.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Data to bias correct, shape (n_time, ...)
+    x_train : np.ndarray
+        Training data on the same grid as `x`, shape (n_train, ...)
+    y_train : np.ndarray
+        Training target (e.g. observations), shape (n_obs, ...)
+    n_endpoints : int, optional
+        Without extrapolation, only the minimum training sample size (``2 * n_endpoints + 1``)
+        depends on it, by default 10
+
+    Returns
+    -------
+    y_hat : np.ndarray
+        Bias corrected data, same shape as `x`
+    """
+    _check_n_endpoints(n_endpoints, x_train, y_train)
+    shape = np.shape(x)
+    x_train = np.sort(_flatten(x_train), axis=0)
+    y_train = np.sort(_flatten(y_train), axis=0)
+    quantiles = batched_interp(_flatten(x), x_train, plotting_positions(len(x_train)))
+    return batched_interp(quantiles, plotting_positions(len(y_train)), y_train).reshape(shape)
+
+
+def detrended_quantile_mapping(
+    x: np.ndarray, x_train: np.ndarray, y_train: np.ndarray, n_endpoints: int = 10
+) -> np.ndarray:
+    """Trend preserving quantile mapping of every pixel of a gridded array at once.
+
+    Gridded equivalent of ``TrendAwareQuantileMappingRegressor(QuantileMappingReressor())``: the
+    linear trends of all three inputs are removed before `quantile_mapping`, then the trend of `x`
+    and the change in mean between `x` and `x_train` are added to the mean of `y_train`.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Data to bias correct, shape (n_time, ...)
+    x_train : np.ndarray
+        Training data on the same grid as `x`, shape (n_train, ...)
+    y_train : np.ndarray
+        Training target (e.g. observations), shape (n_obs, ...)
+    n_endpoints : int, optional
+        See `quantile_mapping`, by default 10
+
+    Returns
+    -------
+    y_hat : np.ndarray
+        Bias corrected data, same shape as `x`
+    """
+    shape = np.shape(x)
+    x_mean, x_trend = _linear_trend(_flatten(x).astype(np.float64))
+    x_train_mean, x_train_trend = _linear_trend(_flatten(x_train).astype(np.float64))
+    y_mean, y_trend = _linear_trend(_flatten(y_train).astype(np.float64))
+
+    y_hat = quantile_mapping(
+        _flatten(x) - x_mean - x_trend,
+        _flatten(x_train) - x_train_mean - x_train_trend,
+        _flatten(y_train) - y_mean - y_trend,
+        n_endpoints=n_endpoints,
+    )
+    return (y_hat + x_trend + (x_mean - x_train_mean + y_mean)).reshape(shape)
+
+
+def apply_quantile_mapping(
+    da: xr.DataArray,
+    da_train: xr.DataArray,
+    da_obs: xr.DataArray,
+    method: str = 'quantile_map',
+    dim: str = 'time',
+    **kwargs,
+) -> xr.DataArray:
+    """Bias correct a gridded DataArray with one of the gridded quantile mapping kernels.
+
+    The kernels run on whole blocks of pixels; dask arrays are processed block by block (`dim`
+    must be in a single chunk). Pixels whose first training value is missing are masked, like
+    ``skdownscale.PointWiseDownscaler`` does.
+
+    Parameters
+    ----------
+    da : xr.DataArray
+        Data to bias correct
+    da_train : xr.DataArray
+        Training data on the same grid as `da` (e.g. historical GCM)
+    da_obs : xr.DataArray
+        Training target on the same grid as `da` (e.g. observations)
+    method : str, optional
+        One of 'equidistant_cdf_matching', 'quantile_map' or 'detrended_quantile_map', by default
+        'quantile_map'
+    dim : str, optional
+        Dimension along which the distributions are matched, by default 'time'
+    **kwargs
+        Passed on to the kernel (e.g. ``kind`` for equidistant CDF matching). Options the kernel
+        doesn't take raise a NotImplementedError.
+
+    Returns
+    -------
+    corrected : xr.DataArray
+        Bias corrected data, with the dimension order of `da`
+    """
+    kernels = {
+        'equidistant_cdf_matching': equidistant_cdf_matching,
+        'quantile_map': quantile_mapping,
+        'detrended_quantile_map': detrended_quantile_mapping,
+    }
+    if method not in kernels:
+        raise ValueError(f'method must be one of {METHODS}, got {method}')
+    kernel = kernels[method]
+    unsupported = set(kwargs) - set(list(inspect.signature(kernel).parameters)[3:])
+    if unsupported:
+        raise NotImplementedError(f'unsupported {method} options: {sorted(unsupported)}')
+
+    def _apply(x, x_train, y_train):
+        # apply_ufunc moves the core dimension last
+        x, x_train, y_train = (np.moveaxis(a, -1, 0) for a in (x, x_train, y_train))
+        y_hat = kernel(x, x_train, y_train, **kwargs)
+        y_hat[:, np.isnan(x_train[0])] = np.nan
+        return np.moveaxis(y_hat, 0, -1).astype(x.dtype, copy=False)
+
+    train_dim = f'{dim}_train'
+    obs_dim = f'{dim}_obs'
+    corrected = xr.apply_ufunc(
+        _apply,
+        da,
+        da_train.rename({dim: train_dim}),
+        da_obs.rename({dim: obs_dim}),
+        input_core_dims=[[dim], [train_dim], [obs_dim]],
+        output_core_dims=[[dim]],
+        dask='parallelized',
+        output_dtypes=[da.dtype],
+    )
+    return corrected.transpose(*da.dims)
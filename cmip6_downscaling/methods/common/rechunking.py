@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import tempfile
+from collections.abc import MutableMapping
+
+import dask
+import numpy as np
+import zarr
+from rechunker.algorithm import rechunking_plan
+
+CHECKPOINT_KEY = '.rechunk_checkpoint'
+ENGINES = ['auto', 'memory', 'memmap', 'rechunker']
+
+
+def _chunks_tuple(array: zarr.Array, chunks: dict | tuple) -> tuple[int, ...]:
+    """Convert a chunk definition (dict keyed by dimension or tuple) into a tuple for `array`"""
+    if isinstance(chunks, dict):
+        chunks = [chunks[dim] for dim in array.attrs['_ARRAY_DIMENSIONS']]
+    return tuple(min(int(c), s) if c != -1 else s for c, s in zip(chunks, array.shape))
+
+
+def _align(block_chunks: tuple[int, ...], chunks: tuple[int, ...]) -> tuple[int, ...]:
+    """Round block sizes up to a multiple of the destination chunks so blocks never share a chunk"""
+    return tuple(-(-b // c) * c for b, c in zip(block_chunks, chunks))
+
+
+def _block_regions(shape: tuple[int, ...], block_chunks: tuple[int, ...]):
+    nblocks = [-(-s // c) for s, c in zip(shape, block_chunks)]
+    for index in itertools.product(*(range(n) for n in nblocks)):
+        region = tuple(
+            slice(i * c, min((i + 1) * c, s)) for i, c, s in zip(index, block_chunks, shape)
+        )
+        yield list(index), region
+
+
+def _copy_block(source: zarr.Array, target: zarr.Array, region: tuple[slice, ...]):
+    target[region] = source[region]
+
+
+def _open_or_create(
+    group: zarr.hierarchy.Group,
+    name: str,
+    source: zarr.Array,
+    chunks: tuple[int, ...],
+    options: dict,
+) -> tuple[zarr.Array, bool]:
+    """Reuse an existing array with a matching schema or (re)create it. Returns (array, created)"""
+    if name in group:
+        array = group[name]
+        if array.shape == source.shape and array.chunks == chunks and array.dtype == source.dtype:
+            return array, False
+    array = group.create(
+        name,
+        shape=source.shape,
+        chunks=chunks,
+        dtype=source.dtype,
+        fill_value=source.fill_value,
+        overwrite=True,
+        **options,
+    )
+    array.attrs.update(source.attrs.asdict())
+    return array, True
+
+
+def _copy_stage(
+    source: zarr.Array,
+    target: zarr.Array,
+    block_chunks: tuple[int, ...],
+    stage: str,
+    checkpoint: dict,
+    save_checkpoint,
+    batch_size: int,
+):
+    """Copy `source` into `target` block by block, skipping blocks recorded in `checkpoint`"""
+    done = checkpoint.setdefault(stage, [])
+    done_set = {tuple(index) for index in done}
+    todo = [
+        (index, region)
+        for index, region in _block_regions(source.shape, block_chunks)
+        if tuple(index) not in done_set
+    ]
+    if todo:
+        print(f'{stage}: copying {len(todo)} blocks, {len(done)} already done')
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start : start + batch_size]
+        dask.compute(
+            *[
+                dask.delayed(_copy_block, pure=False)(source, target, region)
+                for _, region in batch
+            ]
+        )
+        done.extend(index for index, _ in batch)
+        save_checkpoint()
+
+
+def resumable_rechunk(
+    source: zarr.hierarchy.Group,
+    target_chunks: dict,
+    max_mem: str,
+    target_store: MutableMapping,
+    temp_store: MutableMapping,
+    target_options: dict = None,
+    temp_options: dict = None,
+    batch_size: int = 100,
+) -> zarr.hierarchy.Group:
+    """Rechunk a zarr group, checkpointing every written block so an interrupted run can resume.
+
+    Uses the same copy plan as `rechunker` (source -> intermediate -> target, with the intermediate
+    skipped when it isn't needed). Completed blocks of each stage are recorded in
+    ``temp_store['.rechunk_checkpoint']`` after every batch. On retry, existing intermediate and
+    target arrays with a matching schema are reused and recorded blocks are skipped; arrays whose
+    schema changed are recreated and their checkpoints reset.
+
+    The target metadata is not consolidated here, so a partially written target is never seen as
+    complete by `is_cached`.
+
+    Parameters
+    ----------
+    source : zarr.hierarchy.Group
+        Source group
+    target_chunks : dict
+        Mapping of array name to chunks (tuple, or dict keyed by dimension name). Only these
+        arrays are copied.
+    max_mem : str
+        Memory available to each copy task. Must look like "2GB".
+    target_store, temp_store : MutableMapping
+        Target and intermediate stores
+    target_options, temp_options : dict, optional
+        Mapping of array name to extra `zarr.create` options (e.g. compressor)
+    batch_size : int, optional
+        Number of blocks computed between checkpoints, by default 100
+
+    Returns
+    -------
+    target : zarr.hierarchy.Group
+    """
+    target_options = target_options or {}
+    temp_options = temp_options or {}
+    max_mem = dask.utils.parse_bytes(max_mem)
+
+    try:
+        checkpoint = json.loads(temp_store[CHECKPOINT_KEY])
+    except KeyError:
+        checkpoint = {}
+
+    def save_checkpoint():
+        temp_store[CHECKPOINT_KEY] = json.dumps(checkpoint).encode()
+
+    target_group = zarr.open_group(target_store, mode='a')
+    temp_group = zarr.open_group(temp_store, mode='a')
+
+    for name, chunks in target_chunks.items():
+        source_array = source[name]
+        chunks = _chunks_tuple(source_array, chunks)
+        read_chunks, int_chunks, write_chunks = rechunking_plan(
+            source_array.shape,
+            source_array.chunks,
+            chunks,
+            source_array.dtype.itemsize,
+            max_mem,
+        )
+
+        target_array, created = _open_or_create(
+            target_group, name, source_array, chunks, target_options.get(name, {})
+        )
+        if created:
+            checkpoint.pop(f'{name}/target', None)
+
+        if read_chunks == write_chunks or read_chunks == int_chunks:
+            copy_from = source_array
+        else:
+            int_array, created = _open_or_create(
+                temp_group, name, source_array, int_chunks, temp_options.get(name, {})
+            )
+            if created:
+                checkpoint.pop(f'{name}/intermediate', None)
+            _copy_stage(
+                source_array,
+                int_array,
+                _align(read_chunks, int_chunks),
+                f'{name}/intermediate',
+                checkpoint,
+                save_checkpoint,
+                batch_size,
+            )
+            copy_from = int_array
+
+        _copy_stage(
+            copy_from,
+            target_array,
+            _align(write_chunks, chunks),
+            f'{name}/target',
+            checkpoint,
+            save_checkpoint,
+            batch_size,
+        )
+
+    target_group.attrs.update(source.attrs.asdict())
+    return target_group
+
+
+def select_rechunk_engine(source: zarr.hierarchy.Group, target_chunks: dict, max_mem: str) -> str:
+    """Pick the rechunking engine for a group.
+
+    Returns ``'memory'`` when every array being rechunked fits into `max_mem` on its own, and
+    ``'rechunker'`` otherwise.
+
+    Parameters
+    ----------
+    source : zarr.hierarchy.Group
+        Source group
+    target_chunks : dict
+        Mapping of array name to chunks
+    max_mem : str
+        The memory available for rechunking. Must look like "2GB".
+
+    Returns
+    -------
+    engine : str
+    """
+    largest = max(source[name].nbytes for name in target_chunks)
+    if largest <= dask.utils.parse_bytes(max_mem):
+        return 'memory'
+    return 'rechunker'
+
+
+def in_process_rechunk(
+    source: zarr.hierarchy.Group,
+    target_chunks: dict,
+    target_store: MutableMapping,
+    target_options: dict = None,
+    buffer: str = 'memory',
+) -> zarr.hierarchy.Group:
+    """Rechunk a zarr group in process, without an intermediate store.
+
+    Each array is read chunk by chunk straight into a pre-sized buffer, either in memory or a
+    memory-mapped file in a local temporary directory, and the target chunks are then written
+    from that buffer. Chunk reads and writes go through zarr's batched ``getitems``/``setitems``,
+    so they run concurrently on async filesystems. Only suitable when an array fits into memory
+    (or onto local disk for ``buffer='memmap'``); use `rechunker` otherwise.
+
+    Parameters
+    ----------
+    source : zarr.hierarchy.Group
+        Source group
+    target_chunks : dict
+        Mapping of array name to chunks (tuple, or dict keyed by dimension name). Only these
+        arrays are copied.
+    target_store : MutableMapping
+        Target store
+    target_options : dict, optional
+        Mapping of array name to extra `zarr.create` options (e.g. compressor)
+    buffer : str, optional
+        ``'memory'`` or ``'memmap'``, by default ``'memory'``
+
+    Returns
+    -------
+    target : zarr.hierarchy.Group
+    """
+    if buffer not in ['memory', 'memmap']:
+        raise ValueError(f"buffer must be 'memory' or 'memmap', got {buffer}")
+    target_options = target_options or {}
+    target_group = zarr.open_group(target_store, mode='w')
+    target_group.attrs.update(source.attrs.asdict())
+
+    with tempfile.TemporaryDirectory() as local_dir:
+        for name, chunks in target_chunks.items():
+            source_array = source[name]
+            target_array, _ = _open_or_create(
+                target_group,
+                name,
+                source_array,
+                _chunks_tuple(source_array, chunks),
+                target_options.get(name, {}),
+            )
+            if buffer == 'memmap' and source_array.ndim > 0:
+                data = np.memmap(
+                    os.path.join(local_dir, name),
+                    dtype=source_array.dtype,
+                    mode='w+',
+                    shape=source_array.shape,
+                )
+            else:
+                data = np.empty(source_array.shape, dtype=source_array.dtype)
+            source_array.get_basic_selection(Ellipsis, out=data)
+            target_array[...] = data
+            del data
+
+    return target_group
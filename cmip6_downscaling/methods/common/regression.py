@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import numpy as np
+
+
+def batched_linear_regression(
+    x: np.ndarray, y: np.ndarray, mask: np.ndarray = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Fit one ordinary least squares regression (with intercept) per batch element.
+
+    Equivalent to fitting ``sklearn.linear_model.LinearRegression().fit(x[i], y[i])`` for every
+    ``i``, but all problems are solved together: inputs are centered and the coefficients come
+    from the batched pseudo-inverse, which gives the same minimum norm solution as ``lstsq`` for
+    rank deficient problems. Computation is done in float64.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Design matrices, shape (n_batch, n_samples, n_features)
+    y : np.ndarray
+        Targets, shape (n_batch, n_samples)
+    mask : np.ndarray, optional
+        Samples each regression is fit on, boolean array of shape (n_batch, n_samples), by default
+        all of them. Masked out samples get zero weight, which is the same as fitting on
+        ``x[i][mask[i]]``. Problems without any sample get missing coefficients.
+
+    Returns
+    -------
+    coef : np.ndarray
+        Coefficients, shape (n_batch, n_features)
+    intercept : np.ndarray
+        Intercepts, shape (n_batch,)
+    residual : np.ndarray
+        ``y - (x @ coef + intercept)``, shape (n_batch, n_samples), for masked out samples too
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.ndim != 3 or y.shape != x.shape[:2]:
+        raise ValueError(
+            f'expected x of shape (n_batch, n_samples, n_features) and y of shape '
+            f'(n_batch, n_samples), got {x.shape} and {y.shape}'
+        )
+
+    if mask is None:
+        x_mean = x.mean(axis=1)
+        y_mean = y.mean(axis=1)
+        x_centered = x - x_mean[:, np.newaxis, :]
+        y_centered = y - y_mean[:, np.newaxis]
+        x_fit, y_fit = x_centered, y_centered
+    else:
+        weight = np.asarray(mask, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n = weight.sum(axis=1)
+            x_mean = np.einsum('bs,bsf->bf', weight, x) / n[:, np.newaxis]
+            y_mean = np.einsum('bs,bs->b', weight, y) / n
+        x_centered = x - x_mean[:, np.newaxis, :]
+        y_centered = y - y_mean[:, np.newaxis]
+        # zero rows don't change the pseudo-inverse solution
+        x_fit = np.where(mask[..., np.newaxis], x_centered, 0)
+        y_fit = np.where(mask, y_centered, 0)
+
+    coef = np.einsum('bfs,bs->bf', np.linalg.pinv(x_fit), y_fit)
+    intercept = y_mean - np.einsum('bf,bf->b', x_mean, coef)
+    residual = y_centered - np.einsum('bsf,bf->bs', x_centered, coef)
+    return coef, intercept, residual
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 0.5 * (1 + np.tanh(0.5 * z))
+
+
+def batched_logistic_regression(
+    x: np.ndarray, y: np.ndarray, C: float = 1.0, max_iter: int = 100, tol: float = 1e-10
+) -> tuple[np.ndarray, np.ndarray]:
+    """Fit one L2 regularized logistic regression (with intercept) per batch element.
+
+    Solves the same problem as ``sklearn.linear_model.LogisticRegression(C=C).fit(x[i], y[i])``
+    for every ``i`` (the intercept is not regularized), with Newton's method run on all problems
+    together. The problems are strictly convex, so both converge to the same coefficients.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Design matrices, shape (n_batch, n_samples, n_features)
+    y : np.ndarray
+        Binary targets, shape (n_batch, n_samples). Every problem must have both classes.
+    C : float, optional
+        Inverse of the regularization strength, by default 1.0
+    max_iter : int, optional
+        Maximum number of Newton iterations, by default 100
+    tol : float, optional
+        Iterations stop once no parameter changes by more than `tol` (relative to its size), by
+        default 1e-10
+
+    Returns
+    -------
+    coef : np.ndarray
+        Coefficients, shape (n_batch, n_features)
+    intercept : np.ndarray
+        Intercepts, shape (n_batch,)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.ndim != 3 or y.shape != x.shape[:2]:
+        raise ValueError(
+            f'expected x of shape (n_batch, n_samples, n_features) and y of shape '
+            f'(n_batch, n_samples), got {x.shape} and {y.shape}'
+        )
+    n_batch, _, n_features = x.shape
+    design = np.concatenate([x, np.ones(x.shape[:2] + (1,))], axis=2)
+    penalty = np.r_[np.full(n_features, 1.0 / C), 0.0]
+
+    params = np.zeros((n_batch, n_features + 1))
+    active = np.arange(n_batch)
+    for _ in range(max_iter):
+        a, p_active = design[active], params[active]
+        prob = _sigmoid(np.einsum('bsf,bf->bs', a, p_active))
+        gradient = np.einsum('bsf,bs->bf', a, prob - y[active]) + penalty * p_active
+        hessian = np.einsum('bsf,bs,bsg->bfg', a, prob * (1 - prob), a) + np.diag(penalty)
+        step = np.linalg.solve(hessian, gradient[..., np.newaxis])[..., 0]
+        params[active] = p_active - step
+        converged = np.all(np.abs(step) <= tol * np.maximum(1, np.abs(p_active)), axis=1)
+        active = active[~converged]
+        if len(active) == 0:
+            break
+    return params[:, :-1], params[:, -1]
@@ -0,0 +1,361 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from hashlib import blake2b
+
+import dask
+import numpy as np
+import pandas as pd
+import xarray as xr
+from upath import UPath
+
+from ... import config
+from ...utils import str_to_hash
+
+_GRID_VARIABLES = ['lat', 'lon', 'lat_b', 'lon_b', 'mask']
+_CMIP_GRID_ATTRS = ['source_id', 'table_id', 'grid_label']
+
+WEIGHTS_INDEX = {
+    'gcm_obs_weights': ['source_id', 'table_id', 'grid_label', 'regrid_method', 'direction'],
+    'downscaled_pyramid_weights': ['regrid_method', 'levels'],
+}
+
+_regridders: OrderedDict = OrderedDict()
+_weights_registry: dict = {}
+_lock = threading.Lock()
+
+
+def _read_weights_catalog(name: str) -> pd.DataFrame:
+    """Read a weights catalog, preferring a fresh local mirror and refreshing it from the remote"""
+    uri = config.get(f'weights.{name}.uri')
+    mirror = config.get(f'weights.{name}.mirror', None)
+    ttl = config.get('weights.ttl')
+
+    if mirror and os.path.exists(mirror) and time.time() - os.path.getmtime(mirror) < ttl:
+        return pd.read_csv(mirror)
+    try:
+        df = pd.read_csv(uri)
+    except Exception as e:
+        if mirror and os.path.exists(mirror):
+            print(f'failed to read {uri} ({e!r}), falling back to local mirror {mirror}')
+            return pd.read_csv(mirror)
+        raise
+    if mirror:
+        os.makedirs(os.path.dirname(mirror), exist_ok=True)
+        tmp_path = f'{mirror}.{uuid.uuid4().hex}.tmp'
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, mirror)
+    return df
+
+
+def weights_registry(name: str) -> dict[tuple[str, ...], str]:
+    """In-memory index of a weights catalog.
+
+    The catalog at ``weights.<name>.uri`` is read once per process and indexed by the columns in
+    ``WEIGHTS_INDEX[name]``. It is reloaded after ``weights.ttl`` seconds. When
+    ``weights.<name>.mirror`` is set, the catalog is also kept in that local file, which is used
+    instead of the remote while it is younger than the TTL, and whenever the remote can't be read.
+
+    Parameters
+    ----------
+    name : str
+        Catalog name, e.g. 'gcm_obs_weights'
+
+    Returns
+    -------
+    registry : dict
+        Mapping of index values (as strings) to weights path
+    """
+    with _lock:
+        loaded_at, registry = _weights_registry.get(name, (None, None))
+        if loaded_at is not None and time.time() - loaded_at < config.get('weights.ttl'):
+            return registry
+
+    df = _read_weights_catalog(name)
+    registry = {}
+    for row in df[WEIGHTS_INDEX[name] + ['path']].itertuples(index=False):
+        registry.setdefault(tuple(str(value) for value in row[:-1]), row[-1])
+
+    with _lock:
+        _weights_registry[name] = (time.time(), registry)
+    return registry
+
+
+def lookup_weights(name: str, **index) -> str:
+    """Look up the path of pre-generated weights in a weights catalog
+
+    Parameters
+    ----------
+    name : str
+        Catalog name, e.g. 'gcm_obs_weights'
+    **index
+        Values of the catalog index columns (see ``WEIGHTS_INDEX``)
+
+    Returns
+    -------
+    path : str
+        Path to weights file
+
+    Raises
+    ------
+    KeyError
+        If the catalog has no entry for `index`
+    """
+    columns = WEIGHTS_INDEX[name]
+    if set(index) != set(columns):
+        raise ValueError(f'{name} is indexed by {columns}, got {sorted(index)}')
+    key = tuple(str(index[column]) for column in columns)
+    try:
+        return weights_registry(name)[key]
+    except KeyError:
+        entry = ', '.join(f'{column}={index[column]!r}' for column in columns)
+        raise KeyError(
+            f'no pre-generated weights in {config.get(f"weights.{name}.uri")} for {entry}'
+        ) from None
+
+
+def grid_fingerprint(ds: xr.Dataset | xr.DataArray) -> str:
+    """Fingerprint the horizontal grid of a dataset.
+
+    Hashes the values of the variables xESMF builds its grids from (``lat``, ``lon``, the cell
+    bounds ``lat_b``/``lon_b`` and ``mask``, when present), so datasets on the same grid share a
+    fingerprint regardless of their data variables or time axis.
+
+    Parameters
+    ----------
+    ds : xr.Dataset or xr.DataArray
+        Dataset on the grid
+
+    Returns
+    -------
+    fingerprint : str
+    """
+    h = blake2b(digest_size=8)
+    for name in _GRID_VARIABLES:
+        if name not in ds.coords and not (isinstance(ds, xr.Dataset) and name in ds):
+            continue
+        values = np.ascontiguousarray(ds[name].values)
+        h.update(f'{name}:{values.dtype.str}:{values.shape}'.encode())
+        h.update(values.tobytes())
+    return h.hexdigest()
+
+
+def regridder_key(
+    source_ds: xr.Dataset,
+    target_ds: xr.Dataset,
+    method: str,
+    extrap_method: str = None,
+    **kwargs,
+) -> str:
+    """Cache key of a regridder: source grid, target grid, method and extrapolation settings
+
+    Returns
+    -------
+    key : str
+    """
+    spec = {
+        'source': grid_fingerprint(source_ds),
+        'target': grid_fingerprint(target_ds),
+        'method': method,
+        'extrap_method': extrap_method,
+        'kwargs': {key: repr(value) for key, value in kwargs.items()},
+    }
+    return str_to_hash(json.dumps(spec, sort_keys=True))
+
+
+def gcm_obs_weights_index(source_ds: xr.Dataset, target_ds: xr.Dataset) -> dict | None:
+    """Index of the ``weights.gcm_obs_weights`` catalog (without ``regrid_method``) for regridding
+    between a GCM and the observation grid.
+
+    The GCM dataset is recognized by its CMIP6 global attributes (``source_id``, ``table_id`` and
+    ``grid_label``, kept by `get_experiment`): regridding to it is 'obs_to_gcm', regridding from
+    it 'gcm_to_obs'.
+
+    Returns
+    -------
+    index : dict or None
+        None unless exactly one of the datasets has the CMIP6 attributes
+    """
+    found = [
+        (ds, direction)
+        for ds, direction in [(target_ds, 'obs_to_gcm'), (source_ds, 'gcm_to_obs')]
+        if all(attr in ds.attrs for attr in _CMIP_GRID_ATTRS)
+    ]
+    if len(found) != 1:
+        return None
+    ds, direction = found[0]
+    return dict({attr: ds.attrs[attr] for attr in _CMIP_GRID_ATTRS}, direction=direction)
+
+
+def _grid_size(ds: xr.Dataset) -> int:
+    """Number of horizontal grid cells of a dataset"""
+    dims = set(ds['lat'].dims) | set(ds['lon'].dims)
+    return int(np.prod([ds.sizes[dim] for dim in dims]))
+
+
+def _catalog_weights(
+    source_ds: xr.Dataset, target_ds: xr.Dataset, method: str, weights_index: dict = None
+):
+    """Pre-generated weights from the ``weights.gcm_obs_weights`` catalog, or None if the catalog
+    has no weights for the grids.
+
+    Catalog weights are for whole, unmasked grids: they are skipped for masked grids (the mask
+    changes the weights) and when their size doesn't match the grids (e.g. for a subset).
+    """
+    weights_index = weights_index or gcm_obs_weights_index(source_ds, target_ds)
+    if not weights_index or 'mask' in source_ds or 'mask' in target_ds:
+        return None
+    try:
+        weights_path = lookup_weights('gcm_obs_weights', regrid_method=method, **weights_index)
+    except KeyError as e:
+        print(e.args[0])
+        return None
+
+    ds_w = xr.open_zarr(weights_path)
+    sizes = (_grid_size(source_ds), _grid_size(target_ds))
+    if (ds_w.attrs['n_in'], ds_w.attrs['n_out']) != sizes:
+        print(f'weights at {weights_path} are not for grids of {sizes[0]} and {sizes[1]} cells')
+        return None
+
+    from ndpyramid.regrid import _reconstruct_xesmf_weights
+
+    print(f'loading regridding weights from {weights_path}')
+    return _reconstruct_xesmf_weights(ds_w)
+
+
+def _evict_disk_cache(cache_dir: str, max_bytes: int, suffix: str = '.nc'):
+    """Delete the least recently used `suffix` files (weights by default) until `cache_dir` is
+    under `max_bytes`"""
+    try:
+        entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith(suffix)]
+    except FileNotFoundError:
+        return
+    entries = sorted(entries, key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def clear_regridder_cache(disk: bool = False):
+    """Drop all regridders and weights catalogs held in memory and, optionally, the weight files
+    on local disk
+
+    Parameters
+    ----------
+    disk : bool, optional
+        Also empty ``regridding.cache_dir``, by default False
+    """
+    with _lock:
+        _regridders.clear()
+        _weights_registry.clear()
+    if disk:
+        _evict_disk_cache(config.get('regridding.cache_dir'), 0)
+
+
+def get_regridder(
+    source_ds: xr.Dataset,
+    target_ds: xr.Dataset,
+    method: str = 'bilinear',
+    extrap_method: str = None,
+    weights_path: UPath | str = None,
+    weights_index: dict = None,
+    **kwargs,
+):
+    """Get an ``xesmf.Regridder``, reusing weights across tasks and flows.
+
+    Regridders are cached per source grid, target grid, method and extrapolation settings (see
+    `regridder_key`). Lookups go through four levels:
+
+    1. a process-wide in-memory LRU holding ``regridding.memory_cache_size`` regridders,
+    2. weight files on local disk under ``regridding.cache_dir``, evicted least recently used
+       first once they exceed ``regridding.disk_cache_size``,
+    3. pre-generated weights at `weights_path` (e.g. from the ``weights.gcm_obs_weights``
+       catalog, see `get_weights`),
+    4. without `weights_path`, pre-generated weights for the grids in the
+       ``weights.gcm_obs_weights`` catalog (see `gcm_obs_weights_index`).
+
+    Weights are only generated with ESMF when none of these has them, and are then written to the
+    local disk cache so the same weights are never computed twice on a machine.
+
+    Parameters
+    ----------
+    source_ds : xr.Dataset
+        Dataset on the source grid
+    target_ds : xr.Dataset
+        Dataset on the target grid
+    method : str, optional
+        Regridding method, by default 'bilinear'
+    extrap_method : str, optional
+        Extrapolation method, by default None
+    weights_path : UPath or str, optional
+        Path to pre-generated weights matching the source and target grids
+    weights_index : dict, optional
+        Index of the ``weights.gcm_obs_weights`` catalog (without ``regrid_method``) to look up
+        weights in, by default derived from the datasets by `gcm_obs_weights_index`
+    **kwargs
+        Passed on to ``xesmf.Regridder`` (e.g. ``ignore_degenerate``)
+
+    Returns
+    -------
+    regridder : xesmf.Regridder
+    """
+    import xesmf as xe
+
+    key = regridder_key(source_ds, target_ds, method, extrap_method=extrap_method, **kwargs)
+    with _lock:
+        if key in _regridders:
+            _regridders.move_to_end(key)
+            return _regridders[key]
+
+    cache_dir = config.get('regridding.cache_dir')
+    local_path = os.path.join(cache_dir, f'{key}.nc')
+
+    weights = None
+    from_disk = os.path.exists(local_path)
+    if from_disk:
+        print(f'loading regridding weights from {local_path}')
+        os.utime(local_path)
+        weights = local_path
+    elif weights_path:
+        from ndpyramid.regrid import _reconstruct_xesmf_weights
+
+        print(f'loading regridding weights from {weights_path}')
+        weights = _reconstruct_xesmf_weights(xr.open_zarr(weights_path))
+    else:
+        weights = _catalog_weights(source_ds, target_ds, method, weights_index=weights_index)
+
+    regridder = xe.Regridder(
+        source_ds,
+        target_ds,
+        method,
+        extrap_method=extrap_method,
+        weights=weights,
+        **kwargs,
+    )
+
+    if not from_disk:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a unique temporary file first so concurrent workers never read partial weights
+        tmp_path = f'{local_path}.{uuid.uuid4().hex}.tmp'
+        regridder.to_netcdf(tmp_path)
+        os.replace(tmp_path, local_path)
+        max_bytes = dask.utils.parse_bytes(config.get('regridding.disk_cache_size'))
+        _evict_disk_cache(cache_dir, max_bytes)
+
+    with _lock:
+        _regridders[key] = regridder
+        _regridders.move_to_end(key)
+        while len(_regridders) > config.get('regridding.memory_cache_size'):
+            _regridders.popitem(last=False)
+    return regridder
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import numpy as np
+
+PADS = ['wrap', 'edge', 'window']
+
+
+def _expand(values: np.ndarray, ndim: int) -> np.ndarray:
+    """Reshape a (n,) array so that it broadcasts against arrays of shape (n, ...)"""
+    return values.reshape((-1,) + (1,) * (ndim - 1))
+
+
+def prefix_sums(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Cumulative sums along the first axis, with a leading zero, of the values (missing values
+    count as zero) and of the number of missing values
+
+    The sum of ``values[lo:hi]`` is ``sums[hi] - sums[lo]``; it is missing when
+    ``counts[hi] - counts[lo] > 0``.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array of shape (n, ...)
+
+    Returns
+    -------
+    sums : np.ndarray
+        float64 array of shape (n + 1, ...)
+    counts : np.ndarray
+        int64 array of shape (n + 1, ...)
+    """
+    missing = np.isnan(values)
+    sums = np.zeros((len(values) + 1,) + values.shape[1:])
+    np.cumsum(np.where(missing, 0, values), axis=0, out=sums[1:])
+    counts = np.zeros(sums.shape, dtype=np.int64)
+    np.cumsum(missing, axis=0, out=counts[1:])
+    return sums, counts
+
+
+def _segment_rolling_mean(
+    values: np.ndarray, start: np.ndarray, length: np.ndarray, window: int, pad: str
+) -> np.ndarray:
+    """Centered rolling mean along the first axis of values made of consecutive segments.
+
+    `start` and `length` give, for every element, the start and length of its segment. Windows
+    never cross segments; `pad` decides what happens at the segment ends.
+    """
+    if pad not in PADS:
+        raise ValueError(f'pad must be one of {PADS}, got {pad}')
+    if window < 1 or window % 2 == 0:
+        raise ValueError(f'window must be a positive odd number, got {window}')
+    if pad == 'wrap' and window > length.min(initial=window):
+        raise ValueError(f'window ({window}) is longer than the series ({length.min()})')
+
+    ndim = values.ndim
+    position = np.arange(len(values)) - start
+    size = np.minimum(length, window) if pad == 'window' else np.full(len(values), window)
+    half = (size - 1) // 2
+    if pad == 'window':
+        position = np.clip(position, half, length - size + half)
+    lo = position - half
+    hi = lo + size
+
+    sums, counts = prefix_sums(values)
+    inner_lo = start + np.clip(lo, 0, length)
+    inner_hi = start + np.clip(hi, 0, length)
+    total = sums[inner_hi] - sums[inner_lo]
+    missing = counts[inner_hi] - counts[inner_lo]
+
+    if pad == 'wrap':
+        # windows hanging off one end of their segment continue at the other end
+        head, tail = lo < 0, hi > length
+        end = start + length
+        total[head] += sums[end[head]] - sums[end[head] + lo[head]]
+        missing[head] += counts[end[head]] - counts[end[head] + lo[head]]
+        total[tail] += sums[start[tail] + hi[tail] - length[tail]] - sums[start[tail]]
+        missing[tail] += counts[start[tail] + hi[tail] - length[tail]] - counts[start[tail]]
+    elif pad == 'edge':
+        # the first (last) value stands in for every position before (after) the segment
+        for n_pad, edge in [
+            (np.clip(-lo, 0, None), start),
+            (np.clip(hi - length, 0, None), start + length - 1),
+        ]:
+            padded = n_pad > 0
+            edge_values = values[edge[padded]]
+            total[padded] += _expand(n_pad[padded], ndim) * np.nan_to_num(edge_values)
+            missing[padded] += np.isnan(edge_values)
+
+    mean = total / _expand(size, ndim)
+    mean[missing > 0] = np.nan
+    return mean
+
+
+def rolling_mean(values: np.ndarray, window: int, pad: str = 'wrap') -> np.ndarray:
+    """Centered rolling mean along the first axis, computed from prefix sums in O(n).
+
+    The cost doesn't depend on `window` and, unlike padding the series and calling
+    ``rolling().mean()``, no padded copy of the data is made. Windows containing missing values
+    are missing.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array of shape (n, ...)
+    window : int
+        Window size, must be odd
+    pad : str, optional
+        How windows are completed at the ends of the series, by default 'wrap':
+
+        - ``'wrap'``: the series is circular, e.g. for a climatology indexed by day of year
+        - ``'edge'``: the series is extended with its first and last value
+        - ``'window'``: positions closer than half a window to the ends take the mean of the
+          first or last full window; a series shorter than `window` is averaged as a whole
+
+    Returns
+    -------
+    mean : np.ndarray
+        float64 array of the shape of `values`
+    """
+    n = len(values)
+    return _segment_rolling_mean(
+        np.asarray(values), np.zeros(n, dtype=int), np.full(n, n), window, pad
+    )
+
+
+def _groups(labels: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Order that sorts `labels` (stable, so the original order is kept within groups), and the
+    start and length of the group of each element in that order"""
+    order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    lengths = np.diff(np.r_[starts, len(labels)])
+    return order, np.repeat(starts, lengths), np.repeat(lengths, lengths)
+
+
+def grouped_rolling_mean(
+    values: np.ndarray, labels: np.ndarray, window: int, pad: str = 'window'
+) -> np.ndarray:
+    """Centered rolling mean along the first axis within each group of `labels`.
+
+    With ``labels`` the day of year of a daily series, this is a rolling mean across years for
+    each day of year: the series is reordered once into a (day of year, year) layout (ragged, as
+    day 366 only exists in leap years), and all groups are averaged together from one set of
+    prefix sums (see `rolling_mean` for `pad`).
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array of shape (n, ...)
+    labels : np.ndarray
+        Group of each element, shape (n,)
+    window : int
+        Window size in number of group members, must be odd
+    pad : str, optional
+        How windows are completed at the ends of each group, by default 'window'
+
+    Returns
+    -------
+    mean : np.ndarray
+        float64 array of the shape of `values`
+    """
+    order, start, length = _groups(np.asarray(labels))
+    out = np.empty(np.shape(values))
+    out[order] = _segment_rolling_mean(np.asarray(values)[order], start, length, window, pad)
+    return out
+
+
+def group_mean(values: np.ndarray, labels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Mean along the first axis of each group of `labels` (like ``groupby(labels).mean()``, but
+    missing values are propagated)
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array of shape (n, ...)
+    labels : np.ndarray
+        Group of each element, shape (n,)
+
+    Returns
+    -------
+    groups : np.ndarray
+        Sorted unique labels, shape (n_groups,)
+    mean : np.ndarray
+        float64 array of shape (n_groups, ...)
+    """
+    labels = np.asarray(labels)
+    order, start, length = _groups(labels)
+    first = np.flatnonzero(start == np.arange(len(start)))
+    sums, counts = prefix_sums(np.asarray(values)[order])
+    lo, hi = start[first], start[first] + length[first]
+    mean = (sums[hi] - sums[lo]) / _expand(length[first], sums.ndim)
+    mean[counts[hi] - counts[lo] > 0] = np.nan
+    return labels[order][first], mean
@@ -10,7 +10,6 @@ from pathlib import PosixPath
 
 import datatree as dt
 import fsspec
-import pandas as pd
 import rechunker
 import xarray as xr
 import zarr
@@ -26,16 +25,25 @@ from xarray_schema.base import SchemaError
 from ... import __version__ as version, config
 from ...data.cmip import get_gcm
 from ...data.observations import open_era5
-from ...utils import str_to_hash
+from .cache import cache_target
 from .containers import RunParameters, TimePeriod
+from .rechunking import (
+    ENGINES,
+    in_process_rechunk,
+    resumable_rechunk,
+    select_rechunk_engine,
+)
+from .regridding import get_regridder, lookup_weights
 from .utils import (
+    COMPLETION_MANIFEST,
     blocking_to_zarr,
     calc_auspicious_chunks_dict,
     is_cached,
+    region_writes_to_zarr,
     resample_wrapper,
     set_zarr_encoding,
     subset_dataset,
-    validate_zarr_store,
+    write_completion_manifest,
 )
 
 xr.set_options(keep_attrs=True)
@@ -77,8 +85,14 @@ def get_obs(run_parameters: RunParameters) -> UPath:
         **asdict(run_parameters), feature_string=feature_string
     )
     title = f"obs ds: {frmt_str}"
-    ds_hash = str_to_hash(frmt_str)
-    target = intermediate_dir / 'get_obs' / ds_hash
+    target = cache_target(
+        intermediate_dir,
+        'get_obs',
+        obs=run_parameters.obs,
+        features=run_parameters.features,
+        bbox=run_parameters.bbox,
+        train_period=run_parameters.train_period,
+    )
 
     if use_cache and is_cached(target):
         print(f'found existing target: {target}')
@@ -103,16 +117,65 @@ def get_obs(run_parameters: RunParameters) -> UPath:
     return target
 
 
+def _chunk_def(ds: xr.Dataset, pattern: str = None, template: UPath = None) -> dict:
+    """Chunk sizes of `ds` following a chunking pattern and/or the chunks of a template dataset,
+    see `rechunk`.
+    """
+    example_var = list(ds.data_vars)[0]
+    # if you have defined a template then use the chunks of that template
+    # to form the desired chunk definition
+    if template is not None:
+        template_ds = xr.open_zarr(template)
+        # define the chunk definition
+        chunk_def = {
+            'time': min(template_ds.chunks['time'][0], len(ds.time)),
+            'lat': min(template_ds.chunks['lat'][0], len(ds.lat)),
+            'lon': min(template_ds.chunks['lon'][0], len(ds.lon)),
+        }
+        # if you have also defined a pattern then override the dimension you've specified there
+        if pattern is not None:
+            # the chunking pattern will return the dimensions that you'll chunk along
+            # so `full_time` will return `('lat', 'lon')`
+            chunk_dims = config.get(f"chunk_dims.{pattern}")
+            for dim in chunk_def:
+                if dim not in chunk_dims:
+                    # override the chunksize of those unchunked dimensions to be the complete length (like passing chunksize=-1
+                    chunk_def[dim] = len(ds[dim])
+    elif pattern is not None:
+        chunk_dims = config.get(f"chunk_dims.{pattern}")
+        chunk_def = calc_auspicious_chunks_dict(ds[example_var], chunk_dims=chunk_dims)
+    else:
+        raise AttributeError('must either define chunking pattern or template')
+    return chunk_def
+
+
 @task(log_stdout=True)
-def get_experiment(run_parameters: RunParameters, time_subset: str) -> UPath:
+def get_experiment(
+    run_parameters: RunParameters,
+    time_subset: str,
+    chunks: dict = None,
+    pattern: str = None,
+    template: UPath = None,
+) -> UPath:
     """Prefect task that returns cmip GCM data from input run parameters.
 
+    All features and scenarios are read and written by one task graph, with one region write per
+    feature into a pre-initialized store.
+
     Parameters
     ----------
     run_parameters : RunParameters
         RunParameter dataclass defined in common/conatiners.py. Constructed from prefect parameters.
     time_subset : str
         String describing time subset request. Either 'train_period', 'predict_period', or 'both'.
+    chunks : dict, optional
+        Output chunks, ideally those of the first downstream consumer, so the output doesn't need
+        to be rechunked. Defaults to ``{'time': 365}``, which standardizes leap-year chunking.
+    pattern : str, optional
+        Chunking pattern of the output, see `rechunk`. Can't be combined with `chunks`.
+    template : UPath, optional
+        Path to a dataset whose chunks the output matches, see `rechunk`. Can't be combined with
+        `chunks`.
 
     Returns
     -------
@@ -134,6 +197,10 @@ def get_experiment(run_parameters: RunParameters, time_subset: str) -> UPath:
     else:
         time_period = getattr(run_parameters, time_subset)
 
+    if chunks is not None and (pattern is not None or template is not None):
+        raise ValueError('chunks can not be combined with a chunking pattern or template')
+    if pattern is None and template is None:
+        chunks = chunks or {'time': 365}
     features = getattr(run_parameters, 'features')
     if features:
         feature_string = '_'.join(features)
@@ -146,21 +213,36 @@ def get_experiment(run_parameters: RunParameters, time_subset: str) -> UPath:
             time_period=time_period, **asdict(run_parameters)
         )
 
+    features = features or [run_parameters.variable]
+
     if int(time_period.start) < 2015 and run_parameters.scenario != 'historical':
         scenarios = ['historical', run_parameters.scenario]
     else:
         scenarios = [run_parameters.scenario]
 
     title = f"experiment ds: {frmt_str}"
-    ds_hash = str_to_hash(frmt_str)
-    target = intermediate_dir / 'get_experiment' / ds_hash
+    target = cache_target(
+        intermediate_dir,
+        'get_experiment',
+        model=run_parameters.model,
+        member=run_parameters.member,
+        grid_label=run_parameters.grid_label,
+        table_id=run_parameters.table_id,
+        scenarios=scenarios,
+        features=features,
+        bbox=run_parameters.bbox,
+        time_period=time_period,
+        chunks=chunks,
+        pattern=pattern,
+        template=template,
+    )
 
     if use_cache and is_cached(target):
         print(f'found existing target: {target}')
         return target
 
-    mode = 'w'
-    for feature in run_parameters.features:
+    subsets = []
+    for feature in features:
         ds_list = []
         for s in scenarios:
             ds_list.append(
@@ -174,16 +256,21 @@ def get_experiment(run_parameters: RunParameters, time_subset: str) -> UPath:
                     time_slice=time_period.time_slice,
                 )
             )
+        # scenarios are concatenated lazily, so each feature is read and written in one region
         ds = xr.concat(ds_list, dim='time')
         subset = subset_dataset(ds, feature, time_period.time_slice, run_parameters.bbox)
-        # Note: dataset is chunked into time:365 chunks to standardize leap-year chunking.
-        subset = subset.chunk({'time': 365})
-        for key in subset.variables:
-            subset[key].encoding = {}
-        subset.attrs.update({'title': title}, **get_cf_global_attrs(version=version))
-        subset = set_zarr_encoding(subset)
-        subset[[feature]].to_zarr(target, mode=mode)
-        mode = 'a'
+        subsets.append(subset[[feature]])
+
+    ds = xr.merge(subsets, join='override', combine_attrs='drop_conflicts')
+    if chunks is None:
+        # the same chunks `rechunk` would give the output
+        chunks = _chunk_def(ds, pattern=pattern, template=template)
+    ds = ds.chunk(chunks)
+    for key in ds.variables:
+        ds[key].encoding = {}
+    ds.attrs.update({'title': title}, **get_cf_global_attrs(version=version))
+    ds = set_zarr_encoding(ds)
+    region_writes_to_zarr(ds, target, validate=True, write_empty_chunks=True)
 
     return target
 
@@ -194,6 +281,9 @@ def rechunk(
     pattern: str = None,
     template: UPath = None,
     max_mem: str = "5GB",
+    resume: bool = False,
+    engine: str = 'rechunker',
+    in_process_max_mem: str = "1GB",
 ) -> UPath:
     """Use `rechunker` package to adjust chunks of dataset to a form
     conducive for your processing.
@@ -211,6 +301,19 @@ def rechunk(
         target to feed to rechunker.
     max_mem : str
         The memory available for rechunking steps. Must look like "2GB". Optional, default is 5GB.
+    resume : bool
+        Keep the target and intermediate stores from a previous, interrupted run and only copy the
+        blocks that were not checkpointed as written. Only supported by the 'rechunker' engine.
+        Optional, default is False.
+    engine : str
+        One of 'auto', 'memory', 'memmap' or 'rechunker'. 'memory' and 'memmap' rechunk in
+        process through a local buffer holding a whole array, without a temporary store.
+        'rechunker' uses the `rechunker` package, with `max_mem` per task (resumable if `resume`
+        is set). 'auto' picks 'memory' when each array fits into `in_process_max_mem`, and
+        'rechunker' otherwise or when resuming. Optional, default is 'rechunker'.
+    in_process_max_mem : str
+        The largest array 'auto' rechunks in memory. Must look like "2GB". Optional, default is
+        1GB.
 
     Returns
     -------
@@ -225,9 +328,15 @@ def rechunk(
     elif pattern is not None:
         pattern_string = pattern
 
-    task_hash = str_to_hash(str(path) + pattern_string + str(template) + max_mem)
-    target = intermediate_dir / 'rechunk' / task_hash
-    path_tmp = scratch_dir / 'rechunk' / task_hash
+    target = cache_target(
+        intermediate_dir,
+        'rechunk',
+        path=path,
+        pattern=pattern_string,
+        template=template,
+        max_mem=max_mem,
+    )
+    path_tmp = scratch_dir / 'rechunk' / target.name
 
     target_store = fsspec.get_mapper(str(target))
     temp_store = fsspec.get_mapper(str(path_tmp))
@@ -239,38 +348,23 @@ def rechunk(
         # of the schema would just hurt performance likely unnecessarily.
         # nevertheless, as future note: if we encounter chunk issues i suggest putting a schema check here
         return target
+    if engine not in ENGINES:
+        raise ValueError(f'engine must be one of {ENGINES}, got {engine}')
+    if resume and engine in ['memory', 'memmap']:
+        raise ValueError(f"resume is only supported by the 'rechunker' engine, got {engine}")
     # if a cached target isn't found we'll go through the rechunking step
+    if resume:
+        # keep the written chunks, but make sure the target can't look complete until we're done
+        for key in ['.zmetadata', COMPLETION_MANIFEST]:
+            target_store.pop(key, None)
+    else:
+        target_store.clear()
+        temp_store.clear()
     # open the zarr group
-    target_store.clear()
-    temp_store.clear()
     group = zarr.open_consolidated(path)
     # open the dataset to access the coordinates
     ds = xr.open_zarr(path)
-    example_var = list(ds.data_vars)[0]
-    # if you have defined a template then use the chunks of that template
-    # to form the desired chunk definition
-    if template is not None:
-        template_ds = xr.open_zarr(template)
-        # define the chunk definition
-        chunk_def = {
-            'time': min(template_ds.chunks['time'][0], len(ds.time)),
-            'lat': min(template_ds.chunks['lat'][0], len(ds.lat)),
-            'lon': min(template_ds.chunks['lon'][0], len(ds.lon)),
-        }
-        # if you have also defined a pattern then override the dimension you've specified there
-        if pattern is not None:
-            # the chunking pattern will return the dimensions that you'll chunk along
-            # so `full_time` will return `('lat', 'lon')`
-            chunk_dims = config.get(f"chunk_dims.{pattern}")
-            for dim in chunk_def:
-                if dim not in chunk_dims:
-                    # override the chunksize of those unchunked dimensions to be the complete length (like passing chunksize=-1
-                    chunk_def[dim] = len(ds[dim])
-    elif pattern is not None:
-        chunk_dims = config.get(f"chunk_dims.{pattern}")
-        chunk_def = calc_auspicious_chunks_dict(ds[example_var], chunk_dims=chunk_dims)
-    else:
-        raise AttributeError('must either define chunking pattern or template')
+    chunk_def = _chunk_def(ds, pattern=pattern, template=template)
     # Note:
     # for rechunker v 0.3.3:
     # initialize the chunks_dict that you'll pass in, filling the coordinates with
@@ -294,8 +388,7 @@ def rechunk(
         # return the initial path and work with that
         target_schema.validate(ds)
         return path
-    rechunk_plan = rechunker.rechunk(
-        source=group,
+    rechunk_kwargs = dict(
         target_chunks=chunks_dict,
         max_mem=max_mem,
         target_store=target_store,
@@ -304,14 +397,32 @@ def rechunk(
             k: {'compressor': zarr.Blosc(clevel=1), 'write_empty_chunks': True} for k in chunks_dict
         },
         temp_options={k: {'compressor': None, 'write_empty_chunks': True} for k in chunks_dict},
-        executor='dask',
     )
-
-    rechunk_plan.execute()
+    if engine == 'auto':
+        # in-process engines start from scratch, only rechunker can resume
+        if resume:
+            engine = 'rechunker'
+        else:
+            engine = select_rechunk_engine(group, chunks_dict, in_process_max_mem)
+    print(f'rechunking {path} with engine: {engine}')
+
+    if engine in ['memory', 'memmap']:
+        in_process_rechunk(
+            group,
+            chunks_dict,
+            target_store,
+            target_options=rechunk_kwargs['target_options'],
+            buffer=engine,
+        )
+    elif resume:
+        resumable_rechunk(group, **rechunk_kwargs)
+    else:
+        rechunk_plan = rechunker.rechunk(source=group, executor='dask', **rechunk_kwargs)
+        rechunk_plan.execute()
 
     # consolidate_metadata here since when it comes out of rechunker it isn't consolidated.
     zarr.consolidate_metadata(target_store)
-    validate_zarr_store(target_store)
+    write_completion_manifest(target)
 
     temp_store.clear()
     return target
@@ -334,8 +445,7 @@ def time_summary(ds_path: UPath, freq: str) -> UPath:
         Path to resampled dataset.
     """
 
-    ds_hash = str_to_hash(str(ds_path) + freq)
-    target = results_dir / 'time_summary' / ds_hash
+    target = cache_target(results_dir, 'time_summary', ds_path=ds_path, freq=freq)
 
     if use_cache and is_cached(target):
         print(f'found existing target: {target}')
@@ -370,19 +480,14 @@ def get_weights(*, run_parameters, direction, regrid_method="bilinear"):
     path : UPath
         Path to weights file.
     """
-    weights = pd.read_csv(config.get('weights.gcm_obs_weights.uri'))
-    path = (
-        weights[
-            (weights.source_id == run_parameters.model)
-            & (weights.table_id == run_parameters.table_id)
-            & (weights.grid_label == run_parameters.grid_label)
-            & (weights.regrid_method == regrid_method)
-            & (weights.direction == direction)
-        ]
-        .iloc[0]
-        .path
+    return lookup_weights(
+        'gcm_obs_weights',
+        source_id=run_parameters.model,
+        table_id=run_parameters.table_id,
+        grid_label=run_parameters.grid_label,
+        regrid_method=regrid_method,
+        direction=direction,
     )
-    return path
 
 
 @task(log_stdout=True)
@@ -403,11 +508,7 @@ def get_pyramid_weights(*, run_parameters, levels: int, regrid_method: str = "bi
     path : UPath
         Path to pyramid weights file.
     """
-    weights = pd.read_csv(config.get('weights.downscaled_pyramid_weights.uri'))
-    path = (
-        weights[(weights.regrid_method == regrid_method) & (weights.levels == levels)].iloc[0].path
-    )
-    return path
+    return lookup_weights('downscaled_pyramid_weights', regrid_method=regrid_method, levels=levels)
 
 
 @task(log_stdout=True)
@@ -434,10 +535,16 @@ def regrid(
         Path to regridded output dataset.
     """
 
-    import xesmf as xe
-
-    ds_hash = str_to_hash(str(source_path) + str(target_grid_path))
-    target = intermediate_dir / 'regrid' / ds_hash
+    target = cache_target(
+        intermediate_dir,
+        'regrid',
+        source_path=source_path,
+        target_grid_path=target_grid_path,
+        weights_path=weights_path,
+        pre_chunk_def=pre_chunk_def,
+        regrid_method='bilinear',
+        extrap_method='nearest_s2d',
+    )
 
     if use_cache and is_cached(target):
         print(f'found existing target: {target}')
@@ -449,27 +556,14 @@ def regrid(
     if pre_chunk_def is not None:
         source_ds = source_ds.chunk(**pre_chunk_def)
 
-    if weights_path:
-        from ndpyramid.regrid import _reconstruct_xesmf_weights
-
-        weights = _reconstruct_xesmf_weights(xr.open_zarr(weights_path))
-        regridder = xe.Regridder(
-            source_ds,
-            target_grid_ds,
-            weights=weights,
-            reuse_weights=True,
-            method="bilinear",
-            extrap_method="nearest_s2d",
-            ignore_degenerate=True,
-        )
-    else:
-        regridder = xe.Regridder(
-            source_ds,
-            target_grid_ds,
-            method="bilinear",
-            extrap_method="nearest_s2d",
-            ignore_degenerate=True,
-        )
+    regridder = get_regridder(
+        source_ds,
+        target_grid_ds,
+        method="bilinear",
+        extrap_method="nearest_s2d",
+        weights_path=weights_path,
+        ignore_degenerate=True,
+    )
 
     regridded_ds = regridder(source_ds, keep_attrs=True)
     regridded_ds.attrs.update(
@@ -557,8 +651,14 @@ def pyramid(
     -------
     target : UPath
     '''
-    ds_hash = str_to_hash(str(ds_path) + str(levels) + str(other_chunks))
-    target = results_dir / 'pyramid' / ds_hash
+    target = cache_target(
+        results_dir,
+        'pyramid',
+        ds_path=ds_path,
+        weights_pyramid_path=weights_pyramid_path,
+        levels=levels,
+        other_chunks=other_chunks,
+    )
 
     if use_cache and is_cached(target):
         print(f'found existing target: {target}')
@@ -591,7 +691,7 @@ def pyramid(
             child[variable].encoding['write_empty_chunks'] = True
 
     dta.to_zarr(target, mode='w')
-    validate_zarr_store(target)
+    write_completion_manifest(target)
     return target
 
 
@@ -1,10 +1,19 @@
 from __future__ import annotations
 
+import datetime
 import functools
+import json
+import os
 import pathlib
 import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from hashlib import blake2b
 
 import dask
+import dask.array
 import fsspec
 import geopandas as gpd
 import numpy as np
@@ -12,31 +21,129 @@ import packaging.version
 import regionmask
 import xarray as xr
 import zarr
+from dask.highlevelgraph import HighLevelGraph
 from upath import UPath
 from xarray_schema import DataArraySchema, DatasetSchema
 from xarray_schema.base import SchemaError
 
+from ... import config
+from ...utils import str_to_hash
 from . import containers
+from .regridding import _evict_disk_cache, grid_fingerprint
 
 xr.set_options(keep_attrs=True)
 
 
-def validate_zarr_store(target: str, raise_on_error=True) -> bool:
-    """Validate a zarr store.
+COMPLETION_MANIFEST = '.completed'
+
+_land_masks: OrderedDict = OrderedDict()
+_land_mask_lock = threading.Lock()
+
+
+def _open_store(target) -> zarr.hierarchy.Group:
+    """Open a zarr store without consolidated metadata so chunk keys can be inspected"""
+    return zarr.open_group(fsspec.get_mapper(str(target)), mode='r')
+
+
+def _manifest_checksum(manifest: dict) -> str:
+    """Checksum of a completion manifest, catches truncated or hand-edited manifests (it is not a
+    signature: anyone can recompute it)"""
+    body = json.dumps(manifest, sort_keys=True).encode()
+    return blake2b(body, digest_size=16).hexdigest()
+
+
+def _expected_nchunks(zmetadata: dict) -> dict[str, int]:
+    """Number of chunks in each array, computed from consolidated metadata alone"""
+    nchunks = {}
+    for key, meta in zmetadata['metadata'].items():
+        if key.endswith('.zarray'):
+            path = key[: -len('.zarray')].rstrip('/')
+            nchunks[path] = int(
+                np.prod([-(-s // c) for s, c in zip(meta['shape'], meta['chunks'])], dtype=int)
+            )
+    return nchunks
+
+
+def write_completion_manifest(target, allow_empty_chunks: bool = False) -> dict:
+    """Scan a consolidated zarr store and write a completion manifest into it.
+
+    The manifest records the chunk count and stored bytes of every array along with a checksum of
+    the consolidated metadata, so that :py:func:`is_cached` can verify the store with two small
+    reads instead of listing every chunk key.
 
     Parameters
     ----------
     target : str
-        Path to zarr store.
-    raise_on_error : bool
-        Flag to turn on/off raising when the store is not valid. If `False`, the function will return
-        `True` when the store is valid (complete) and `False` when the store is not valid.
+        Path to zarr store. Metadata must be consolidated before calling this function.
+    allow_empty_chunks : bool, optional
+        Accept uninitialized chunks, for stores written with ``write_empty_chunks=False`` (these
+        chunks read as the fill value). The number of initialized chunks of every array is then
+        recorded so that full scans (see `validate_zarr_store`) can still check the store. By
+        default False.
 
     Returns
     -------
-    valid : bool
+    manifest : dict
+
+    Raises
+    ------
+    ValueError
+        If any array in the store has uninitialized chunks and `allow_empty_chunks` is False.
     """
+    mapper = fsspec.get_mapper(str(target))
+    group = _open_store(target)
+
+    arrays = {}
+    errors = []
+    for _, array in group.arrays(recurse=True):
+        arrays[array.path] = {'nchunks': array.nchunks, 'nbytes': array.nbytes_stored}
+        if allow_empty_chunks:
+            arrays[array.path]['nchunks_initialized'] = array.nchunks_initialized
+        elif array.nchunks_initialized != array.nchunks:
+            errors.append(
+                f'{array.path} has {array.nchunks - array.nchunks_initialized} uninitialized chunks'
+            )
+    if errors:
+        raise ValueError(f'Found {len(errors)} errors: {errors}')
+
+    manifest = {
+        'arrays': arrays,
+        'zmetadata_checksum': blake2b(mapper['.zmetadata'], digest_size=16).hexdigest(),
+    }
+    manifest['checksum'] = _manifest_checksum(manifest)
+    mapper[COMPLETION_MANIFEST] = json.dumps(manifest, indent=2).encode()
+    return manifest
+
+
+def _check_completion_manifest(target) -> list[str]:
+    mapper = fsspec.get_mapper(str(target))
+    try:
+        manifest = json.loads(mapper[COMPLETION_MANIFEST])
+        zmetadata = mapper['.zmetadata']
+    except (KeyError, OSError, ValueError):
+        return ['missing completion manifest or consolidated metadata']
+
     errors = []
+    checksum = manifest.pop('checksum', None)
+    if checksum != _manifest_checksum(manifest):
+        errors.append('completion manifest checksum does not match')
+    if manifest.get('zmetadata_checksum') != blake2b(zmetadata, digest_size=16).hexdigest():
+        errors.append('consolidated metadata changed after completion manifest was written')
+    else:
+        arrays = manifest.get('arrays', {})
+        for path, nchunks in _expected_nchunks(json.loads(zmetadata)).items():
+            if path not in arrays:
+                errors.append(f'{path} missing from completion manifest')
+            elif arrays[path]['nchunks'] != nchunks:
+                errors.append(f'{path} has {arrays[path]["nchunks"]} of {nchunks} chunks')
+    return errors
+
+
+def _scan_zarr_store(target, nchunks_initialized: dict[str, int] = None) -> list[str]:
+    """Count the initialized chunks of every array, which must all be initialized unless the
+    expected count of an array is in `nchunks_initialized`"""
+    errors = []
+    nchunks_initialized = nchunks_initialized or {}
 
     try:
         store = zarr.open_consolidated(target)
@@ -55,10 +162,53 @@ def validate_zarr_store(target: str, raise_on_error=True) -> bool:
             variables = list(data_group.keys())
             for variable in variables:
                 variable_array = data_group[variable]
-                if variable_array.nchunks_initialized != variable_array.nchunks:
+                expected = nchunks_initialized.get(variable_array.path, variable_array.nchunks)
+                if variable_array.nchunks_initialized != expected:
                     errors.append(
-                        f'{variable} has {variable_array.nchunks - variable_array.nchunks_initialized} uninitialized chunks'
+                        f'{variable} has {expected - variable_array.nchunks_initialized} uninitialized chunks'
                     )
+    return errors
+
+
+def validate_zarr_store(target: str, raise_on_error=True, full_scan: bool = False) -> bool:
+    """Validate a zarr store.
+
+    By default the store is validated against the completion manifest written by
+    :py:func:`write_completion_manifest`, which only requires reading two small objects. Stores
+    without a manifest (e.g. written before manifests were introduced) fall back to a full scan.
+
+    Parameters
+    ----------
+    target : str
+        Path to zarr store.
+    raise_on_error : bool
+        Flag to turn on/off raising when the store is not valid. If `False`, the function will return
+        `True` when the store is valid (complete) and `False` when the store is not valid.
+    full_scan : bool
+        Ignore the completion manifest and count the initialized chunks of every array. This lists
+        every chunk key in the store, so it is slow for large stores; intended for audits. Arrays
+        written with empty chunks skipped are checked against the initialized chunk counts in the
+        manifest (see `write_completion_manifest`).
+
+    Returns
+    -------
+    valid : bool
+    """
+    mapper = fsspec.get_mapper(str(target))
+    if COMPLETION_MANIFEST not in mapper:
+        errors = _scan_zarr_store(target)
+    elif full_scan:
+        arrays = json.loads(mapper[COMPLETION_MANIFEST]).get('arrays', {})
+        errors = _scan_zarr_store(
+            target,
+            {
+                path: array['nchunks_initialized']
+                for path, array in arrays.items()
+                if 'nchunks_initialized' in array
+            },
+        )
+    else:
+        errors = _check_completion_manifest(target)
 
     if errors:
         if raise_on_error:
@@ -82,30 +232,154 @@ def zmetadata_exists(path: UPath):
 
 
 def blocking_to_zarr(
-    ds: xr.Dataset, target, validate: bool = True, write_empty_chunks: bool = True
+    ds: xr.Dataset,
+    target,
+    validate: bool = True,
+    write_empty_chunks: bool = True,
+    metrics: dict = None,
 ):
     '''helper function to write a xarray Dataset to a zarr store.
 
-    The function blocks until the write is complete then writes Zarr's consolidated metadata
+    The function blocks until the write is complete then writes Zarr's consolidated metadata. If
+    `validate` is set, the store is checked for missing chunks and a completion manifest is
+    written (see `write_completion_manifest`). Without `write_empty_chunks`, chunks that are all
+    fill value (e.g. ocean) are not written and are allowed to be missing.
+
+    `metrics` maps names to lazy (dask) scalars derived from `ds`. They are computed in the same
+    pass as the write, sharing its tasks, added to the attributes of the store and returned.
     '''
 
-    if write_empty_chunks:
-        if packaging.version.Version(
-            packaging.version.Version(xr.__version__).base_version
-        ) < packaging.version.Version("2022.03"):
-            raise NotImplementedError(
-                f'`write_empty_chunks` not supported in xarray < 2022.06. Your xarray version is: {xr.__version__}'
-            )
+    if packaging.version.Version(
+        packaging.version.Version(xr.__version__).base_version
+    ) < packaging.version.Version("2022.03"):
+        raise NotImplementedError(
+            f'`write_empty_chunks` not supported in xarray < 2022.06. Your xarray version is: {xr.__version__}'
+        )
+
+    for variable in ds.data_vars:
+        ds[variable].encoding['write_empty_chunks'] = write_empty_chunks
+    metrics = metrics or {}
+    # optimized together, so the metrics don't recompute the tasks they share with the write. the
+    # write mustn't fuse the shared tasks into its own again
+    ds, *values = dask.optimize(ds, *metrics.values())
+    with dask.config.set({'optimization.fuse.active': False if metrics else None}):
+        t = ds.to_zarr(target, mode='w', compute=False)
+    _, *values = dask.compute(t, *values, optimize_graph=False, retries=5)
+    metrics = {key: np.asarray(value).item() for key, value in zip(metrics, values)}
+    if metrics:
+        zarr.open_group(target, mode='r+').attrs.update(metrics)
+    zarr.consolidate_metadata(target)
+
+    if validate:
+        # scans the store once and raises if it is incomplete
+        write_completion_manifest(target, allow_empty_chunks=not write_empty_chunks)
+    return metrics
+
+
+def _last_modified(target) -> float | None:
+    """Latest modification time (POSIX timestamp) of the keys of a store, None if unknown"""
+    fs, path = fsspec.core.url_to_fs(str(target))
+    latest = None
+    for info in fs.find(path, detail=True).values():
+        for key in ['mtime', 'last_modified', 'LastModified']:
+            value = info.get(key)
+            if isinstance(value, datetime.datetime):
+                value = value.timestamp()
+            if isinstance(value, (int, float)):
+                latest = value if latest is None else max(latest, value)
+                break
+    return latest
+
+
+def _is_abandoned(target, grace_period: float) -> bool:
+    """Whether a store has no completion manifest and wasn't modified for `grace_period` seconds"""
+    if COMPLETION_MANIFEST in fsspec.get_mapper(str(target)):
+        return False
+    last_modified = _last_modified(target)
+    return last_modified is not None and time.time() - last_modified > grace_period
+
+
+def write_zarr_once(ds: xr.Dataset, target, grace_period: float = None) -> bool:
+    """Write a dataset to a new zarr store, followed by its completion manifest, unless the store
+    already exists.
+
+    For stores shared by concurrent tasks and flows (e.g. the caches in static storage): an
+    existing store is never overwritten, as ``mode='w'`` would delete it while others may be
+    reading it. Readers should only open the store once it is complete (see `is_cached`). The only
+    exception are stores abandoned by a writer that died: an existing store without completion
+    manifest that wasn't modified for `grace_period` seconds is deleted and written again.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset to write
+    target : str
+        Path to zarr store
+    grace_period : float, optional
+        Seconds after which an incomplete store is considered abandoned, by default
+        ``write_zarr_once.grace_period`` from the config
+
+    Returns
+    -------
+    written : bool
+        False if the store already existed, e.g. because another task is writing it
+    """
+    if grace_period is None:
+        grace_period = config.get('write_zarr_once.grace_period')
+    try:
+        ds.to_zarr(target, mode='w-')
+    except (zarr.errors.ContainsGroupError, zarr.errors.ContainsArrayError):
+        if not _is_abandoned(target, grace_period):
+            print(f'{target} already exists, not overwriting it')
+            return False
+        print(f'{target} is incomplete and was not modified for {grace_period}s, rewriting it')
+        fs, path = fsspec.core.url_to_fs(str(target))
+        fs.rm(path, recursive=True)
+        try:
+            ds.to_zarr(target, mode='w-')
+        except (zarr.errors.ContainsGroupError, zarr.errors.ContainsArrayError):
+            print(f'{target} is being rewritten by another task, not overwriting it')
+            return False
+    write_completion_manifest(target)
+    return True
+
 
-        for variable in ds.data_vars:
+def region_writes_to_zarr(
+    ds: xr.Dataset, target, validate: bool = True, write_empty_chunks: bool = True
+):
+    '''helper function to write a xarray Dataset to a zarr store with concurrent region writes.
+
+    The store is initialized from `ds` first (array metadata and coordinates only). Each data
+    variable is then written into its region of the pre-initialized store, and all region writes
+    are computed as one graph, so reading and writing of all variables overlap in a single pass.
+    Data variables must be chunked the way they should be stored. Blocks until the writes are
+    complete, then consolidates the metadata and, if `validate` is set, writes the completion
+    manifest (see `write_completion_manifest`).
+    '''
+    ds = ds.assign_coords({name: coord.load() for name, coord in ds.coords.items()})
+    for variable in ds.data_vars:
+        if write_empty_chunks:
             ds[variable].encoding['write_empty_chunks'] = True
-    ds = dask.optimize(ds)[0]
-    t = ds.to_zarr(target, mode='w', compute=False)
-    t.compute(retries=5)
+        ds[variable].encoding['chunks'] = tuple(c[0] for c in ds[variable].chunks)
+
+    # writes metadata and coordinates, but none of the data variables
+    ds.to_zarr(target, mode='w', compute=False, consolidated=False)
+
+    writes = []
+    for variable in ds.data_vars:
+        da = ds[variable]
+        region = {dim: slice(0, size) for dim, size in zip(da.dims, da.shape)}
+        subset = ds[[variable]]
+        writes.append(
+            subset.drop_vars(list(subset.coords)).to_zarr(
+                target, region=region, compute=False, consolidated=False
+            )
+        )
+    dask.compute(*dask.optimize(*writes), retries=5)
     zarr.consolidate_metadata(target)
 
     if validate:
-        validate_zarr_store(target)
+        write_completion_manifest(target)
 
 
 def subset_dataset(
@@ -153,9 +427,15 @@ def subset_dataset(
     return subset_ds
 
 
-def apply_land_mask(ds: xr.Dataset) -> xr.Dataset:
+def _land_polygons() -> gpd.GeoDataFrame:
+    """Buffered land polygons at ``land_mask.polygons``"""
+    with fsspec.open(config.get('land_mask.polygons')) as file:
+        return gpd.read_file(file)
+
+
+def compute_land_mask(ds: xr.Dataset) -> xr.DataArray:
     """
-    Apply a land mask to a dataset with lat/lon coordinates.
+    Rasterize the buffered land polygons on the grid of a dataset.
 
     Notes
     --------
@@ -169,21 +449,249 @@ def apply_land_mask(ds: xr.Dataset) -> xr.Dataset:
     buffer_gpd = gpd.GeoDataFrame(geometry=gpd.GeoSeries(buffer))
     buffer_gpd.to_file('2deg_buffer_gdf.gpkg', driver="GPKG")
 
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset with lat and lon coordinates
+
+    Returns
+    -------
+    land : xr.DataArray
+        Boolean mask, True over land
+    """
+    mask = regionmask.from_geopandas(_land_polygons()).mask(ds, wrap_lon=False)
+    return (mask == 0).rename('land')
+
+
+def _grid(ds: xr.Dataset | xr.DataArray) -> xr.Dataset:
+    return xr.Dataset(coords={'lat': ds['lat'], 'lon': ds['lon']})
+
+
+def _land_mask_array(values: np.ndarray, ds: xr.Dataset) -> xr.DataArray:
+    """Land mask values on the grid of `ds`"""
+    grid = _grid(ds)
+    dims = ('lat', 'lon') if grid['lat'].ndim == 1 else grid['lat'].dims
+    return xr.DataArray(values.astype(bool), dims=dims, coords=grid.coords, name='land')
+
+
+def land_mask_key(ds: xr.Dataset | xr.DataArray) -> str:
+    """Key of the land mask of the grid of `ds` (see `get_land_mask`)"""
+    return str_to_hash(
+        json.dumps(
+            [grid_fingerprint(_grid(ds)), config.get('land_mask.polygons'), regionmask.__version__],
+            sort_keys=True,
+        )
+    )
+
+
+def clear_land_mask_cache(disk: bool = False):
+    """Drop all land masks held in memory and, optionally, the mask files on local disk
+
+    Parameters
+    ----------
+    disk : bool, optional
+        Also empty ``land_mask.cache_dir``, by default False
+    """
+    with _land_mask_lock:
+        _land_masks.clear()
+    if disk:
+        _evict_disk_cache(config.get('land_mask.cache_dir'), 0, suffix='.npy')
+
+
+def get_land_mask(ds: xr.Dataset | xr.DataArray) -> xr.DataArray:
+    """Land mask of the grid of `ds`, rasterizing the land polygons only once per grid.
+
+    Masks are cached per grid fingerprint (lat/lon values), polygons file and regionmask version
+    (see `land_mask_key`). Lookups go through three levels:
+
+    1. a process-wide in-memory LRU holding ``land_mask.memory_cache_size`` masks,
+    2. ``.npy`` files on local disk under ``land_mask.cache_dir``, evicted least recently used
+       first once they exceed ``land_mask.disk_cache_size``,
+    3. small zarr stores under ``land_mask.uri`` (static storage) shared by all flows, written
+       once and never overwritten once complete (see `write_zarr_once`).
+
+    The polygons are only downloaded and rasterized (see `compute_land_mask`) when none of these
+    has the mask.
+
+    Parameters
+    ----------
+    ds : xr.Dataset or xr.DataArray
+        Dataset with lat and lon coordinates
+
+    Returns
+    -------
+    land : xr.DataArray
+        Boolean mask in memory, True over land
+    """
+    key = land_mask_key(ds)
+    with _land_mask_lock:
+        if key in _land_masks:
+            _land_masks.move_to_end(key)
+            return _land_masks[key]
+
+    cache_dir = config.get('land_mask.cache_dir')
+    local_path = os.path.join(cache_dir, f'{key}.npy')
+    static_path = UPath(config.get('land_mask.uri')) / f'{key}.zarr'
+
+    from_disk = os.path.exists(local_path)
+    if from_disk:
+        os.utime(local_path)
+        values = np.load(local_path)
+    elif is_cached(static_path):
+        print(f'loading land mask from {static_path}')
+        values = xr.open_zarr(static_path)['land'].values
+    else:
+        print(f'rasterizing land mask, caching it at {static_path}')
+        values = compute_land_mask(ds).values
+        # tasks missing the cache together each keep the mask they computed (see get_region_index)
+        write_zarr_once(_land_mask_array(values, ds).to_dataset(), static_path)
+
+    if not from_disk:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a unique temporary file first so concurrent workers never read partial masks
+        tmp_path = f'{local_path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.save(file, values)
+        os.replace(tmp_path, local_path)
+        max_bytes = dask.utils.parse_bytes(config.get('land_mask.disk_cache_size'))
+        _evict_disk_cache(cache_dir, max_bytes, suffix='.npy')
+
+    land = _land_mask_array(values, ds)
+    with _land_mask_lock:
+        _land_masks[key] = land
+        _land_masks.move_to_end(key)
+        while len(_land_masks) > config.get('land_mask.memory_cache_size'):
+            _land_masks.popitem(last=False)
+    return land
+
+
+def skip_masked_blocks(data: dask.array.Array, mask: np.ndarray) -> dask.array.Array:
+    """Mask a dask array without reading the blocks in which the mask is all False.
+
+    Equivalent to ``np.where(mask, data, np.nan)``, but blocks entirely outside of the mask become
+    constant NaN blocks that don't depend on `data` (so their inputs are culled from the graph
+    and never read or computed) and blocks entirely inside of it are passed through unchanged.
+
+    Parameters
+    ----------
+    data : dask.array.Array
+        Floating point array
+    mask : np.ndarray
+        Boolean array with the number of dimensions of `data`, of length 1 or the length of `data`
+        along each axis
+
+    Returns
+    -------
+    masked : dask.array.Array
+    """
+    name = f'skip-masked-blocks-{dask.base.tokenize(data, mask)}'
+    offsets = [np.cumsum((0,) + chunks) for chunks in data.chunks]
+    layer = {}
+    for index in np.ndindex(*data.numblocks):
+        block_mask = mask[
+            tuple(
+                slice(None) if length == 1 else slice(offsets[axis][i], offsets[axis][i + 1])
+                for axis, (i, length) in enumerate(zip(index, mask.shape))
+            )
+        ]
+        if block_mask.all():
+            layer[(name,) + index] = (data.name,) + index
+        elif block_mask.any():
+            layer[(name,) + index] = (np.where, block_mask, (data.name,) + index, np.nan)
+        else:
+            shape = tuple(data.chunks[axis][i] for axis, i in enumerate(index))
+            layer[(name,) + index] = (functools.partial(np.full, shape, np.nan, data.dtype),)
+    graph = HighLevelGraph.from_collections(name, layer, dependencies=[data])
+    return dask.array.Array(graph, name, data.chunks, dtype=data.dtype)
+
+
+def apply_land_mask(ds: xr.Dataset, skip_ocean_chunks: bool = False) -> xr.Dataset:
+    """
+    Apply a land mask to a dataset with lat/lon coordinates.
+
+    The mask is only rasterized once per grid (see `get_land_mask`) and is applied with ``where``.
+
     Parameters
     ----------
     ds : xr.Dataset
         Input dataset to mask.
+    skip_ocean_chunks : bool, optional
+        Push the mask down into the dask graphs of floating point variables (see
+        `skip_masked_blocks`), so chunks that are entirely ocean are never read or computed, by
+        default False. The values are the same, and the pixels and chunks that are computed (see
+        `ocean_chunk_report`) are printed and added to the attributes.
 
     Returns
     -------
     xr.Dataset
     """
-    with fsspec.open(
-        'https://cmip6downscaling.blob.core.windows.net/static/1deg_buffer_gdf.gpkg'
-    ) as file:
-        gdf = gpd.read_file(file)
-    mask = regionmask.from_geopandas(gdf).mask(ds, wrap_lon=False)
-    return ds.where(mask == 0)
+    land = get_land_mask(ds)
+    masked = ds.where(land)
+    if not skip_ocean_chunks:
+        return masked
+
+    for name, da in ds.data_vars.items():
+        if (
+            not isinstance(da.data, dask.array.Array)
+            or da.dtype.kind != 'f'
+            or not set(land.dims) <= set(da.dims)
+        ):
+            continue
+        mask = land.transpose(*[dim for dim in da.dims if dim in land.dims]).values
+        mask = mask.reshape([da.sizes[dim] if dim in land.dims else 1 for dim in da.dims])
+        masked[name] = (da.dims, skip_masked_blocks(da.data, mask), da.attrs)
+
+    report = ocean_chunk_report(ds)
+    print(
+        f"computing {report['pixels_computed']} of {report['pixels_total']} pixels "
+        f"({report['pixels_land']} land), skipping {report['chunks_skipped']} of "
+        f"{report['chunks_total']} chunks"
+    )
+    masked.attrs.update(report)
+    return masked
+
+
+def ocean_chunk_report(ds: xr.Dataset) -> dict[str, int]:
+    """Pixels and spatial chunks of a dataset that are computed when chunks that are entirely
+    ocean are skipped (see `apply_land_mask`).
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset with lat and lon coordinates, chunked the way it is computed
+
+    Returns
+    -------
+    report : dict
+        ``pixels_total``, ``pixels_land`` and ``pixels_computed`` (pixels in chunks with land), and
+        ``chunks_total`` and ``chunks_skipped`` (spatial chunks without land). ``pixels_computed``
+        is exact for steps that compute every pixel of a chunk. Steps computing only some pixels
+        of a chunk (e.g. GARD, which only fits pixels with valid inputs) count them themselves.
+    """
+    land = get_land_mask(ds)
+    chunks = {dim: (size,) for dim, size in land.sizes.items()}
+    for da in ds.data_vars.values():
+        if da.chunks is not None and set(land.dims) <= set(da.dims):
+            chunks = {dim: da.chunks[da.get_axis_num(dim)] for dim in land.dims}
+            break
+
+    values = land.values
+    offsets = [np.cumsum((0,) + chunks[dim]) for dim in land.dims]
+    report = {
+        'pixels_total': int(values.size),
+        'pixels_land': int(values.sum()),
+        'pixels_computed': 0,
+        'chunks_total': 0,
+        'chunks_skipped': 0,
+    }
+    for index in np.ndindex(*[len(chunks[dim]) for dim in land.dims]):
+        block = values[tuple(slice(o[i], o[i + 1]) for o, i in zip(offsets, index))]
+        report['chunks_total'] += 1
+        if block.any():
+            report['pixels_computed'] += block.size
+        else:
+            report['chunks_skipped'] += 1
+    return report
 
 
 def calc_auspicious_chunks_dict(
@@ -1,4 +1,3 @@
-import functools
 from dataclasses import asdict
 
 import fsspec
@@ -14,13 +13,15 @@ from ... import __version__ as version, config
 from ...data.observations import open_era5
 from ...data.utils import lon_to_180
 from ..common.bias_correction import bias_correct_gcm_by_method
-from ..common.containers import RunParameters, str_to_hash
+from ..common.cache import cache_target
+from ..common.containers import RunParameters
 from ..common.utils import (
     apply_land_mask,
     blocking_to_zarr,
+    is_cached,
     set_zarr_encoding,
     subset_dataset,
-    validate_zarr_store,
+    write_completion_manifest,
 )
 from .utils import (
     EPSILON,
@@ -43,8 +44,6 @@ use_cache = config.get('run_options.use_cache')
 
 xr.set_options(keep_attrs=True)
 
-is_cached = functools.partial(validate_zarr_store, raise_on_error=False)
-
 
 @task(log_stdout=True)
 def shift(path: UPath, path_type: str, run_parameters: RunParameters) -> UPath:
@@ -71,8 +70,7 @@ def shift(path: UPath, path_type: str, run_parameters: RunParameters) -> UPath:
     else:
         raise ValueError('path_type must be gcm or obs')
 
-    ds_hash = str_to_hash(str(path) + str(output_degree))
-    target = intermediate_dir / 'shift' / ds_hash
+    target = cache_target(intermediate_dir, 'shift', path=path, output_degree=output_degree)
 
     if use_cache and is_cached(target):
         print(f'found existing target: {target}')
@@ -107,8 +105,7 @@ def coarsen_obs(path: UPath, output_degree: float) -> UPath:
         Path to coarsened dataset.
     """
     # Similar to coarsen_and_interpolate in GARD tasks (maybe could be combined?)
-    ds_hash = str_to_hash(str(path) + str(output_degree))
-    target = intermediate_dir / 'coarsen' / ds_hash
+    target = cache_target(intermediate_dir, 'coarsen', path=path, output_degree=output_degree)
 
     if use_cache and is_cached(target):
         print(f'found existing target: {target}')
@@ -144,8 +141,9 @@ def coarsen_and_interpolate(path: UPath, output_degree: float) -> UPath:
         ``output_degre``.
     """
     # Similar to coarsen_and_interpolate in GARD tasks (maybe could be combined?)
-    ds_hash = str_to_hash(str(path) + str(output_degree))
-    target = intermediate_dir / 'coarsen_interpolate' / ds_hash
+    target = cache_target(
+        intermediate_dir, 'coarsen_interpolate', path=path, output_degree=output_degree
+    )
 
     if use_cache and is_cached(target):
         print(f'found existing target: {target}')
@@ -184,8 +182,14 @@ def rescale(source_path: UPath, obs_path: UPath, run_parameters: RunParameters)
     UPath
         Path to rescaled dataset
     """
-    ds_hash = str_to_hash(str(source_path) + str(obs_path))
-    target = results_dir / 'deepsd_rescale' / ds_hash
+    target = cache_target(
+        results_dir,
+        'deepsd_rescale',
+        source_path=source_path,
+        obs_path=obs_path,
+        variable=run_parameters.variable,
+        train_dates=run_parameters.train_dates,
+    )
 
     if use_cache and is_cached(target):
         print(f'found existing target: {target}')
@@ -207,8 +211,14 @@ def rescale(source_path: UPath, obs_path: UPath, run_parameters: RunParameters)
         rescaled_ds = rescaled_ds.clip(min=0)
     rescaled_ds.attrs.update({'title': 'deepsd_output'}, **get_cf_global_attrs(version=version))
     print(f'writing rescaled dataset to {target}')
-    rescaled_ds = rescaled_ds.pipe(apply_land_mask).pipe(set_zarr_encoding)
-    blocking_to_zarr(ds=rescaled_ds, target=target, validate=True, write_empty_chunks=True)
+    # chunks that are entirely ocean are neither computed nor written
+    skip_ocean_chunks = config.get('run_options.skip_ocean_chunks')
+    rescaled_ds = rescaled_ds.pipe(apply_land_mask, skip_ocean_chunks=skip_ocean_chunks).pipe(
+        set_zarr_encoding
+    )
+    blocking_to_zarr(
+        ds=rescaled_ds, target=target, validate=True, write_empty_chunks=not skip_ocean_chunks
+    )
     return target
 
 
@@ -228,8 +238,12 @@ def normalize_gcm(predict_path: UPath, historical_path: UPath) -> UPath:
         Path to normalized dataset.
     """
     # Create path for output file
-    ds_hash = str_to_hash(str(predict_path) + str(historical_path))
-    target = intermediate_dir / 'normalize' / ds_hash
+    target = cache_target(
+        intermediate_dir,
+        'normalize',
+        predict_path=predict_path,
+        historical_path=historical_path,
+    )
 
     # Skip step if output file already exists when using cache
     if use_cache and is_cached(target):
@@ -279,8 +293,13 @@ def inference(gcm_path: UPath, run_parameters: RunParameters) -> UPath:
     tf.compat.v1.disable_eager_execution()
 
     # Create path for output file
-    ds_hash = str_to_hash(str(gcm_path))
-    target = intermediate_dir / 'inference' / ds_hash
+    target = cache_target(
+        intermediate_dir,
+        'inference',
+        gcm_path=gcm_path,
+        model=run_parameters.model,
+        variable=run_parameters.variable,
+    )
 
     # Skip step if output file already exists when using cache
     if use_cache and is_cached(target):
@@ -398,6 +417,7 @@ def inference(gcm_path: UPath, run_parameters: RunParameters) -> UPath:
         )
         task.compute(retries=10)
 
+    write_completion_manifest(target)
     return target
 
 
@@ -427,6 +447,7 @@ def update_var_attrs(
     fs = fsspec.filesystem('az', account_name='cmip6downscaling')
     fs.copy(source_attrs, target_attrs)
     zarr.consolidate_metadata(target_path)
+    write_completion_manifest(target_path)
     return target_path
 
 
@@ -450,8 +471,15 @@ def bias_correction(
         Path to dataset containing bias corrected model predictions.
     """
     # Create path for output file
-    ds_hash = str_to_hash(str(downscaled_path) + str(obs_path))
-    target = results_dir / 'deepsd_bias_correction' / ds_hash
+    target = cache_target(
+        results_dir,
+        'deepsd_bias_correction',
+        downscaled_path=downscaled_path,
+        obs_path=obs_path,
+        variable=run_parameters.variable,
+        bias_correction_method=run_parameters.bias_correction_method,
+        bias_correction_kwargs=run_parameters.bias_correction_kwargs,
+    )
 
     # Skip step if output file already exists when using cache
     if use_cache and is_cached(target):
@@ -499,12 +527,14 @@ def get_validation(run_parameters: RunParameters) -> UPath:
     title = "validation ds: {obs}_{variable}_{latmin}_{latmax}_{lonmin}_{lonmax}_{predict_dates[0]}_{predict_dates[1]}".format(
         **asdict(run_parameters)
     )
-    ds_hash = str_to_hash(
-        "{obs}_{variable}_{latmin}_{latmax}_{lonmin}_{lonmax}_{predict_dates[0]}_{predict_dates[1]}".format(
-            **asdict(run_parameters)
-        )
+    target = cache_target(
+        intermediate_dir,
+        'get_validation',
+        obs=run_parameters.obs,
+        variable=run_parameters.variable,
+        bbox=run_parameters.bbox,
+        predict_period=run_parameters.predict_period,
     )
-    target = intermediate_dir / 'get_validation' / ds_hash
 
     if use_cache and is_cached(target):
         print(f'found existing target: {target}')
@@ -527,4 +557,5 @@ def get_validation(run_parameters: RunParameters) -> UPath:
     print(f'writing validation dataset to {target}', subset)
     store = subset.pipe(set_zarr_encoding).to_zarr(target, mode='w', compute=False)
     store.compute(retries=2)
+    write_completion_manifest(target)
     return target
@@ -3,6 +3,8 @@ import numpy as np
 import xarray as xr
 import xesmf as xe
 
+from ..common.regridding import get_regridder
+
 EPSILON = 1e-6  # small value to add to the denominator when normalizing to avoid division by 0
 INPUT_SIZE = 51  # number of pixels in a patch example used for training deepsd model (in both lat/lon (or x/y) directions)
 PATCH_STRIDE = 20  # number of pixels to skip when generating patches for deepsd training
@@ -57,7 +59,7 @@ def bilinear_interpolate(ds: xr.Dataset, output_degree: float) -> xr.Dataset:
     """
 
     target_grid_ds = xe.util.grid_global(output_degree, output_degree, cf=True)
-    regridder = xe.Regridder(ds, target_grid_ds, "bilinear", extrap_method="nearest_s2d")
+    regridder = get_regridder(ds, target_grid_ds, "bilinear", extrap_method="nearest_s2d")
     return regridder(ds, keep_attrs=True)
 
 
@@ -79,7 +81,7 @@ def conservative_interpolate(ds: xr.Dataset, output_degree: float) -> xr.Dataset
     """
     target_grid_ds = xe.util.grid_global(output_degree, output_degree, cf=True)
     # conservative area regridding needs lat_bands and lon_bands
-    regridder = xe.Regridder(ds, target_grid_ds, "conservative")
+    regridder = get_regridder(ds, target_grid_ds, "conservative")
     return regridder(ds, keep_attrs=True)
 
 
@@ -0,0 +1,658 @@
+from __future__ import annotations
+
+import math
+from typing import Any
+
+import numba
+import numpy as np
+import xarray as xr
+
+from ..common.regression import batched_linear_regression, batched_logistic_regression
+
+MODEL_TYPES = ['AnalogRegression', 'PureAnalog', 'PureRegression']
+ANALOG_KINDS = ['best_analog', 'sample_analogs', 'weight_analogs', 'mean_analogs']
+OUTPUT_NAMES = ['pred', 'exceedance_prob', 'prediction_error']
+
+# options of the skdownscale estimators that only tune their KDTree
+_IGNORED_PARAMS = ['kdtree_kwargs', 'query_kwargs']
+
+
+def _outputs(pred: np.ndarray, exceedance_prob: np.ndarray, error: np.ndarray) -> dict:
+    shape = np.broadcast_shapes(pred.shape, exceedance_prob.shape, error.shape)
+    return {
+        name: np.broadcast_to(values, shape).astype(np.float64)
+        for name, values in zip(OUTPUT_NAMES, [pred, exceedance_prob, error])
+    }
+
+
+def _rmse(residual: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Root mean squared residual along the last axis over the masked in samples"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(np.where(mask, residual**2, 0).sum(axis=-1) / mask.sum(axis=-1))
+
+
+def _exceedance(
+    x: np.ndarray, y: np.ndarray, x_pred: np.ndarray, thresh: float | None, C: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Samples above `thresh` and the logistic regression probability of exceeding it at `x_pred`.
+
+    Problems with a single class (all or none of the samples above `thresh`) have an exceedance
+    probability of 1 or 0 and keep all their samples for the regression.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Training features, shape (n_batch, n_samples, n_features)
+    y : np.ndarray
+        Training targets, shape (n_batch, n_samples)
+    x_pred : np.ndarray
+        Features to predict, shape (n_batch, n_pred, n_features)
+    thresh : float or None
+        Threshold, no logistic regression is fit when None
+    C : float
+        Inverse of the regularization strength of the logistic regressions
+
+    Returns
+    -------
+    exceed : np.ndarray
+        Samples the regressions are fit on, shape (n_batch, n_samples)
+    exceedance_prob : np.ndarray
+        Probability of exceeding `thresh`, shape (n_batch, n_pred)
+    """
+    n_batch, n_pred = x_pred.shape[:2]
+    if thresh is None:
+        return np.ones(y.shape, dtype=bool), np.ones((n_batch, n_pred))
+
+    exceed = y > thresh
+    fraction = exceed.mean(axis=1)
+    two_classes = (fraction > 0) & (fraction < 1)
+    exceedance_prob = np.repeat(fraction[:, np.newaxis], n_pred, axis=1)
+    if two_classes.any():
+        coef, intercept = batched_logistic_regression(
+            x[two_classes], exceed[two_classes], C=C
+        )
+        z = np.einsum('bsf,bf->bs', x_pred[two_classes], coef) + intercept[:, np.newaxis]
+        exceedance_prob[two_classes] = 0.5 * (1 + np.tanh(0.5 * z))
+    exceed[~two_classes] = True
+    return exceed, exceedance_prob
+
+
+def pure_regression(
+    x_train: np.ndarray,
+    y_train: np.ndarray,
+    x_pred: np.ndarray,
+    thresh: float = None,
+    C: float = 1.0,
+) -> dict[str, np.ndarray]:
+    """GARD pure regression of every pixel at once.
+
+    Gridded equivalent of ``skdownscale.pointwise_models.PureRegression(thresh=thresh)``: one
+    linear regression per pixel, fit on the training days above `thresh`, and one logistic
+    regression per pixel for the probability of exceeding `thresh`. The prediction error is the
+    RMSE of the linear regression on its training days.
+
+    Parameters
+    ----------
+    x_train : np.ndarray
+        Training features, shape (n_pixels, n_train, n_features)
+    y_train : np.ndarray
+        Training targets, shape (n_pixels, n_train)
+    x_pred : np.ndarray
+        Features to predict, shape (n_pixels, n_pred, n_features)
+    thresh : float, optional
+        Threshold, by default None
+    C : float, optional
+        Inverse of the regularization strength of the logistic regressions, by default 1.0
+
+    Returns
+    -------
+    outputs : dict
+        ``pred``, ``exceedance_prob`` and ``prediction_error`` arrays of shape (n_pixels, n_pred)
+    """
+    exceed, exceedance_prob = _exceedance(x_train, y_train, x_pred, thresh, C)
+    coef, intercept, residual = batched_linear_regression(x_train, y_train, mask=exceed)
+    pred = np.einsum('bsf,bf->bs', np.asarray(x_pred, dtype=np.float64), coef)
+    pred += intercept[:, np.newaxis]
+    error = _rmse(residual, exceed)[:, np.newaxis]
+    return _outputs(pred, exceedance_prob, error)
+
+
+def nearest_analogs(
+    x_train: np.ndarray, x_pred: np.ndarray, k: int, max_elements: int = 2**24
+) -> tuple[np.ndarray, np.ndarray]:
+    """The `k` training days closest (euclidean distance in feature space) to every prediction day
+    of every pixel, by brute force.
+
+    Prediction days are processed in blocks so that at most `max_elements` distances are held in
+    memory; only the top `k` of each row are kept (with argpartition) and sorted.
+
+    Parameters
+    ----------
+    x_train : np.ndarray
+        Training features, shape (n_pixels, n_train, n_features)
+    x_pred : np.ndarray
+        Features to predict, shape (n_pixels, n_pred, n_features)
+    k : int
+        Number of analogs
+    max_elements : int, optional
+        Maximum size of a block of distances, by default 2**24
+
+    Returns
+    -------
+    distances : np.ndarray
+        Distances to the analogs, shape (n_pixels, n_pred, k), increasing along the last axis
+    inds : np.ndarray
+        Positions of the analogs in the training days, shape (n_pixels, n_pred, k)
+    """
+    x_train = np.asarray(x_train, dtype=np.float64)
+    x_pred = np.asarray(x_pred, dtype=np.float64)
+    n_pixels, n_train, n_features = x_train.shape
+    n_pred = x_pred.shape[1]
+    block_size = max(1, max_elements // max(1, n_pixels * n_train))
+
+    distances = np.empty((n_pixels, n_pred, k))
+    inds = np.empty((n_pixels, n_pred, k), dtype=int)
+    for start in range(0, n_pred, block_size):
+        block = slice(start, start + block_size)
+        squared = np.zeros((n_pixels, len(range(n_pred)[block]), n_train))
+        for f in range(n_features):
+            squared += (x_pred[:, block, f, np.newaxis] - x_train[:, np.newaxis, :, f]) ** 2
+        if k < n_train:
+            top = np.argpartition(squared, k - 1, axis=2)[..., :k]
+        else:
+            top = np.broadcast_to(np.arange(n_train), squared.shape).copy()
+        top_squared = np.take_along_axis(squared, top, axis=2)
+        order = np.argsort(top_squared, axis=2, kind='stable')
+        inds[:, block] = np.take_along_axis(top, order, axis=2)
+        distances[:, block] = np.sqrt(np.take_along_axis(top_squared, order, axis=2))
+    return distances, inds
+
+
+def _gather(values: np.ndarray, inds: np.ndarray) -> np.ndarray:
+    """``values[i, inds[i]]`` for every pixel ``i``"""
+    pixels = np.arange(len(inds)).reshape((-1,) + (1,) * (inds.ndim - 1))
+    return np.asarray(values, dtype=np.float64)[pixels, inds]
+
+
+def _nanmean(values: np.ndarray) -> np.ndarray:
+    """Mean along the last axis skipping missing values (missing when all of them are)"""
+    valid = np.isfinite(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(valid, values, 0).sum(axis=-1) / valid.sum(axis=-1)
+
+
+def _nanstd(values: np.ndarray) -> np.ndarray:
+    """Standard deviation along the last axis skipping missing values"""
+    valid = np.isfinite(values)
+    deviation = np.where(valid, values - _nanmean(values)[..., np.newaxis], 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt((deviation**2).sum(axis=-1) / valid.sum(axis=-1))
+
+
+def _n_analogs(n_analogs: int, n_train: int) -> int:
+    # like skdownscale, use all training days when there are fewer than n_analogs
+    return min(n_analogs, n_train)
+
+
+def pure_analog(
+    x_train: np.ndarray,
+    y_train: np.ndarray,
+    x_pred: np.ndarray,
+    n_analogs: int = 200,
+    kind: str = 'best_analog',
+    thresh: float = None,
+    thresh_fixes: bool = False,
+) -> dict[str, np.ndarray]:
+    """GARD pure analog of every pixel at once.
+
+    Gridded equivalent of ``skdownscale.pointwise_models.PureAnalog``: the prediction is the best
+    analog, a random analog, or the (inverse distance weighted) mean of the `n_analogs` training
+    days closest to each prediction day (see `nearest_analogs`), and the prediction error is the
+    standard deviation of the analogs. With `thresh`, the exceedance probability is the fraction
+    of analogs above it; as in skdownscale, the means are 0 and the prediction error is missing
+    on days where any analog is below it. With `thresh_fixes`, the analogs below `thresh` are
+    left out instead: the prediction and its error only use the analogs above it (days where none
+    is get 0).
+
+    Parameters
+    ----------
+    x_train : np.ndarray
+        Training features, shape (n_pixels, n_train, n_features)
+    y_train : np.ndarray
+        Training targets, shape (n_pixels, n_train)
+    x_pred : np.ndarray
+        Features to predict, shape (n_pixels, n_pred, n_features)
+    n_analogs : int, optional
+        Number of analogs, by default 200
+    kind : str, optional
+        One of 'best_analog', 'sample_analogs', 'weight_analogs' or 'mean_analogs', by default
+        'best_analog'
+    thresh : float, optional
+        Threshold, by default None
+    thresh_fixes : bool, optional
+        Whether to only use the analogs above `thresh`, by default False
+
+    Returns
+    -------
+    outputs : dict
+        ``pred``, ``exceedance_prob`` and ``prediction_error`` arrays of shape (n_pixels, n_pred)
+    """
+    if kind not in ANALOG_KINDS:
+        raise ValueError(f'kind must be one of {ANALOG_KINDS}, got {kind}')
+    if kind == 'best_analog' or n_analogs == 1:
+        kind, k = 'best_analog', 1
+    else:
+        k = _n_analogs(n_analogs, np.shape(x_train)[1])
+
+    distances, inds = nearest_analogs(x_train, x_pred, k)
+    analogs = _gather(y_train, inds)
+    if thresh is not None and thresh_fixes:
+        above = analogs > thresh
+        analogs = np.where(above, analogs, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if kind == 'best_analog':
+            pred = analogs[..., 0]
+        elif kind == 'sample_analogs':
+            choice = np.random.randint(low=0, high=k, size=analogs.shape[:2])
+            pred = np.take_along_axis(analogs, choice[..., np.newaxis], axis=2)[..., 0]
+        elif kind == 'weight_analogs':
+            # work around for zero distances (perfect matches)
+            weights = 1.0 / np.where(distances == 0, 1e-20, distances)
+            valid = np.isfinite(analogs)
+            pred = np.where(valid, analogs * weights, 0).sum(axis=2) / np.where(
+                valid, weights, 0
+            ).sum(axis=2)
+        else:
+            pred = _nanmean(analogs)
+
+    error = analogs.std(axis=2)
+    exceedance_prob = np.ones(pred.shape)
+    if thresh is not None and thresh_fixes:
+        # days where all analogs are below thresh
+        pred = np.nan_to_num(pred, nan=0.0)
+        error = np.nan_to_num(_nanstd(analogs), nan=0.0)
+        exceedance_prob = above.mean(axis=2)
+    elif thresh is not None:
+        # like skdownscale, analogs below thresh are masked out of the means and the error, which
+        # makes them missing when any analog is below thresh (the means are then set to 0)
+        above = analogs > thresh
+        all_above = above.all(axis=2)
+        if kind in ['weight_analogs', 'mean_analogs']:
+            pred = np.where(all_above, pred, 0.0)
+        error = np.where(all_above, error, np.nan)
+        exceedance_prob = above.mean(axis=2)
+    return _outputs(pred, exceedance_prob, error)
+
+
+def analog_regression(
+    x_train: np.ndarray,
+    y_train: np.ndarray,
+    x_pred: np.ndarray,
+    n_analogs: int = 200,
+    thresh: float = None,
+    C: float = 1.0,
+    batch_size: int = 4096,
+    thresh_fixes: bool = False,
+) -> dict[str, np.ndarray]:
+    """GARD analog regression of every pixel at once.
+
+    Gridded equivalent of ``skdownscale.pointwise_models.AnalogRegression``: for each prediction
+    day, a linear regression (and, with `thresh`, a logistic regression for the probability of
+    exceeding it) is fit on the `n_analogs` closest training days (see `nearest_analogs`). The
+    regressions of up to `batch_size` (pixel, day) pairs are solved together. The prediction error
+    is the RMSE of each regression on its analogs. As in skdownscale, the reported exceedance
+    probability is that of the first class of the logistic regression, i.e. of *not* exceeding
+    `thresh`, and 1 when all analogs are on the same side of it. With `thresh_fixes`, it is the
+    probability of exceeding `thresh` (1 or 0 when all analogs are on the same side of it).
+
+    Parameters
+    ----------
+    x_train : np.ndarray
+        Training features, shape (n_pixels, n_train, n_features)
+    y_train : np.ndarray
+        Training targets, shape (n_pixels, n_train)
+    x_pred : np.ndarray
+        Features to predict, shape (n_pixels, n_pred, n_features)
+    n_analogs : int, optional
+        Number of analogs, by default 200
+    thresh : float, optional
+        Threshold, by default None
+    C : float, optional
+        Inverse of the regularization strength of the logistic regressions, by default 1.0
+    batch_size : int, optional
+        Number of regressions solved together, by default 4096
+    thresh_fixes : bool, optional
+        Whether to report the probability of exceeding `thresh`, by default False
+
+    Returns
+    -------
+    outputs : dict
+        ``pred``, ``exceedance_prob`` and ``prediction_error`` arrays of shape (n_pixels, n_pred)
+    """
+    x_train = np.asarray(x_train, dtype=np.float64)
+    y_train = np.asarray(y_train, dtype=np.float64)
+    x_pred = np.asarray(x_pred, dtype=np.float64)
+    n_pixels, n_train, n_features = x_train.shape
+    n_pred = x_pred.shape[1]
+    _, inds = nearest_analogs(x_train, x_pred, _n_analogs(n_analogs, n_train))
+
+    # one regression per (pixel, prediction day)
+    pixel = np.repeat(np.arange(n_pixels), n_pred)
+    inds = inds.reshape(n_pixels * n_pred, -1)
+    x_flat = x_pred.reshape(n_pixels * n_pred, 1, n_features)
+    outputs = {name: np.empty(n_pixels * n_pred) for name in OUTPUT_NAMES}
+    for start in range(0, len(inds), batch_size):
+        batch = slice(start, start + batch_size)
+        x = x_train[pixel[batch, np.newaxis], inds[batch]]
+        y = y_train[pixel[batch, np.newaxis], inds[batch]]
+        exceed, exceedance_prob = _exceedance(x, y, x_flat[batch], thresh, C)
+        coef, intercept, residual = batched_linear_regression(x, y, mask=exceed)
+        outputs['pred'][batch] = np.einsum('bf,bf->b', x_flat[batch, 0], coef) + intercept
+        if thresh is not None and not thresh_fixes:
+            # like skdownscale, report the probability of the first class of the logistic
+            # regressions (not exceeding thresh), and 1 for analogs all on one side of thresh
+            exceedance_prob = np.where(exceed.all(axis=1), 1.0, 1 - exceedance_prob[:, 0])
+        else:
+            exceedance_prob = exceedance_prob[:, 0]
+        outputs['exceedance_prob'][batch] = exceedance_prob
+        outputs['prediction_error'][batch] = _rmse(residual, exceed)
+    return {name: values.reshape(n_pixels, n_pred) for name, values in outputs.items()}
+
+
+def unsupported_params(model_params: dict[str, Any] = None) -> list[str]:
+    """Model parameters of `get_gard_model` the gridded GARD models can't reproduce.
+
+    Parameters
+    ----------
+    model_params : dict, optional
+        Model parameters, by default None
+
+    Returns
+    -------
+    unsupported : list of str
+        Names of the unsupported parameters, empty when the model can be fit with `fit_and_predict`
+    """
+    params = model_params or {}
+    unsupported = [key for key in ['lr_kwargs', 'linear_kwargs'] if params.get(key)]
+    logistic_kwargs = params.get('logistic_kwargs') or {}
+    unsupported += [f'logistic_kwargs.{key}' for key in sorted(set(logistic_kwargs) - {'C'})]
+    return unsupported
+
+
+def fit_and_predict(
+    x_train: np.ndarray,
+    y_train: np.ndarray,
+    x_pred: np.ndarray,
+    model_type: str,
+    model_params: dict[str, Any] = None,
+    thresh_fixes: bool = False,
+) -> dict[str, np.ndarray]:
+    """Fit and predict a GARD model on every pixel at once.
+
+    Takes the `model_type` and `model_params` of `get_gard_model`. Options that only tune the
+    KDTree of the skdownscale estimators (``kdtree_kwargs``, ``query_kwargs``) are ignored: analogs
+    are found by brute force. Of the logistic regression options, only ``C`` is supported; the
+    linear regressions take no options. Models with other options (see `unsupported_params`) have
+    to be fit with the skdownscale estimators.
+
+    The analog models reproduce skdownscale's handling of ``thresh`` unless `thresh_fixes` is set
+    (see `pure_analog` and `analog_regression`).
+
+    Parameters
+    ----------
+    x_train : np.ndarray
+        Training features, shape (n_pixels, n_train, n_features)
+    y_train : np.ndarray
+        Training targets, shape (n_pixels, n_train)
+    x_pred : np.ndarray
+        Features to predict, shape (n_pixels, n_pred, n_features)
+    model_type : str
+        One of 'AnalogRegression', 'PureAnalog' or 'PureRegression'
+    model_params : dict, optional
+        Model parameters, by default None
+    thresh_fixes : bool, optional
+        Whether the analog models use the ``thresh`` fixes, by default False
+
+    Returns
+    -------
+    outputs : dict
+        ``pred``, ``exceedance_prob`` and ``prediction_error`` arrays of shape (n_pixels, n_pred)
+    """
+    if model_type not in MODEL_TYPES:
+        raise NotImplementedError(
+            'model_type must be AnalogRegression, PureAnalog, or PureRegression'
+        )
+    unsupported = unsupported_params(model_params)
+    if unsupported:
+        raise NotImplementedError(
+            f'{unsupported} are not supported by the gridded GARD models, use the skdownscale '
+            'estimators (see `get_gard_model`)'
+        )
+    params = {k: v for k, v in (model_params or {}).items() if k not in _IGNORED_PARAMS}
+    params.pop('lr_kwargs', None)
+    params.pop('linear_kwargs', None)
+    logistic_kwargs = dict(params.pop('logistic_kwargs', None) or {})
+    if 'C' in logistic_kwargs:
+        params['C'] = logistic_kwargs['C']
+
+    if model_type == 'PureAnalog':
+        return pure_analog(x_train, y_train, x_pred, thresh_fixes=thresh_fixes, **params)
+    elif model_type == 'AnalogRegression':
+        return analog_regression(x_train, y_train, x_pred, thresh_fixes=thresh_fixes, **params)
+    return pure_regression(x_train, y_train, x_pred, **params)
+
+
+def gridded_fit_and_predict(
+    xtrain: xr.Dataset,
+    ytrain: xr.DataArray,
+    xpred: xr.Dataset,
+    features: list[str],
+    model_type: str,
+    model_params: dict[str, Any] = None,
+    dim: str = 'time',
+    thresh_fixes: bool = False,
+) -> xr.Dataset:
+    """Fit and predict a GARD model on every pixel of in-memory datasets (see `fit_and_predict`).
+
+    Pixels are stacked into (pixel, time, feature) arrays. Pixels with missing training or
+    prediction data (e.g. ocean) are left out and are missing in the output.
+
+    Parameters
+    ----------
+    xtrain : xr.Dataset
+        Training features
+    ytrain : xr.DataArray
+        Training target
+    xpred : xr.Dataset
+        Features to predict
+    features : list of str
+        Variables of `xtrain` and `xpred` used as features
+    model_type : str
+        One of 'AnalogRegression', 'PureAnalog' or 'PureRegression'
+    model_params : dict, optional
+        Model parameters, by default None
+    dim : str, optional
+        Dimension the models are fit along, by default 'time'
+    thresh_fixes : bool, optional
+        Whether the analog models use the ``thresh`` fixes, by default False
+
+    Returns
+    -------
+    out : xr.Dataset
+        ``pred``, ``exceedance_prob`` and ``prediction_error`` on the grid and `dim` of `xpred`
+    """
+
+    def _stack(ds):
+        da = ds[features].to_array('feature').transpose(dim, ..., 'feature')
+        values = da.values
+        return values.reshape(values.shape[0], -1, values.shape[-1]).transpose(1, 0, 2)
+
+    template = xpred[features[0]].transpose(dim, ...)
+    x_train = _stack(xtrain)
+    x_pred = _stack(xpred)
+    y_train = ytrain.transpose(*template.dims).values.reshape(len(ytrain[dim]), -1).T
+    valid = (
+        np.isfinite(x_train).all(axis=(1, 2))
+        & np.isfinite(y_train).all(axis=1)
+        & np.isfinite(x_pred).all(axis=(1, 2))
+    )
+
+    out = xr.Dataset()
+    outputs = None
+    if valid.any():
+        outputs = fit_and_predict(
+            x_train[valid],
+            y_train[valid],
+            x_pred[valid],
+            model_type,
+            model_params,
+            thresh_fixes=thresh_fixes,
+        )
+    for name in OUTPUT_NAMES:
+        values = np.full((x_pred.shape[0], x_pred.shape[1]), np.nan)
+        if outputs is not None:
+            values[valid] = outputs[name]
+        out[name] = template.copy(data=values.T.reshape(template.shape))
+    return out
+
+
+# rational approximation of the inverse normal CDF (Acklam), relative error below 1.15e-9
+_ICDF_A = (
+    -39.69683028665376,
+    220.9460984245205,
+    -275.9285104469687,
+    138.357751867269,
+    -30.66479806614716,
+    2.506628277459239,
+)
+_ICDF_B = (
+    -54.47609879822406,
+    161.5858368580409,
+    -155.6989798598866,
+    66.80131188771972,
+    -13.28068155288572,
+)
+_ICDF_C = (
+    -0.007784894002430293,
+    -0.3223964580411365,
+    -2.400758277161838,
+    -2.549732539343734,
+    4.374664141464968,
+    2.938163982698783,
+)
+_ICDF_D = (
+    0.007784695709041462,
+    0.3224671290700398,
+    2.445134137142996,
+    3.754408661907416,
+)
+_ICDF_LOW = 0.02425
+
+
+@numba.njit
+def _ndtr(x: float) -> float:
+    """Standard normal CDF"""
+    return 0.5 * math.erfc(-x / math.sqrt(2.0))
+
+
+@numba.njit(error_model='numpy')
+def _ndtri(p: float, approximate: bool) -> float:
+    """Inverse of the standard normal CDF, NaN outside of [0, 1].
+
+    Without `approximate`, the rational approximation is refined with one step of Halley's method,
+    which brings it to double precision.
+    """
+    if not (p >= 0.0 and p <= 1.0):
+        return np.nan
+    if p == 0.0:
+        return -np.inf
+    if p == 1.0:
+        return np.inf
+    a, b, c, d = _ICDF_A, _ICDF_B, _ICDF_C, _ICDF_D
+    if _ICDF_LOW <= p <= 1 - _ICDF_LOW:
+        q = p - 0.5
+        r = q * q
+        x = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q
+        x /= ((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1
+    else:
+        q = math.sqrt(-2 * math.log(min(p, 1 - p)))
+        x = ((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]
+        x /= (((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1
+        if p > 0.5:
+            x = -x
+    if not approximate:
+        # refine in the lower half, where the CDF is computed accurately
+        sign, y, q = (1.0, x, p) if p <= 0.5 else (-1.0, -x, 1 - p)
+        u = (_ndtr(y) - q) * math.sqrt(2 * math.pi) * math.exp(0.5 * y * y)
+        x = sign * (y - u / (1 + 0.5 * y * u))
+    return x
+
+
+@numba.njit(error_model='numpy')
+def _random_effects(pred, error, prob, scrf, use_thresh, cube_root, approximate, out):
+    for i in range(out.size):
+        if not use_thresh:
+            out[i] = pred[i] + scrf[i] * error[i]
+            continue
+        # the part of the uniform distribution above the probability of not exceeding the
+        # threshold, rescaled to [0, 1] and mapped back to a normal distribution
+        non_exceedance = 1 - prob[i]
+        r = _ndtri((_ndtr(scrf[i]) - non_exceedance) / prob[i], approximate)
+        if cube_root:
+            value = (np.cbrt(pred[i]) + error[i] * r) ** 3
+        else:
+            value = pred[i] + r * error[i]
+        # days below the threshold and negative values are set to 0
+        out[i] = value if value >= 0 else 0.0
+
+
+def random_effects(
+    pred: np.ndarray,
+    prediction_error: np.ndarray,
+    exceedance_prob: np.ndarray,
+    scrf: np.ndarray,
+    use_thresh: bool = False,
+    cube_root: bool = False,
+    approximate: bool = False,
+) -> np.ndarray:
+    """Add the random effects to GARD predictions in a single pass.
+
+    Without a threshold, the downscaled value is ``pred + scrf * prediction_error``. With a
+    threshold, the random field is converted to a uniform distribution; the values above the
+    probability of not exceeding the threshold are rescaled to [0, 1], converted back to a normal
+    distribution and scale the prediction error, values on the other side (and negative values)
+    are set to 0. For cube root transformed variables (e.g. ``pr``), the error is added to the
+    cube root of `pred` and the sum is cubed.
+
+    Every element is computed at once by a compiled loop, without temporary arrays.
+
+    Parameters
+    ----------
+    pred, prediction_error, exceedance_prob : np.ndarray
+        GARD model outputs
+    scrf : np.ndarray
+        Spatio-temporally correlated random fields, standard normal
+    use_thresh : bool, optional
+        Whether the model was fit with a threshold, by default False
+    cube_root : bool, optional
+        Whether the variable is cube root transformed, by default False
+    approximate : bool, optional
+        Use the rational approximation of the inverse normal CDF (relative error below 1.15e-9)
+        without refining it, by default False
+
+    Returns
+    -------
+    downscaled : np.ndarray
+        Shape of the broadcast inputs
+    """
+    arrays = np.broadcast_arrays(pred, prediction_error, exceedance_prob, scrf)
+    out = np.empty(arrays[0].shape, dtype=np.result_type(*arrays))
+    _random_effects(
+        *(np.ascontiguousarray(a).ravel() for a in arrays),
+        use_thresh,
+        cube_root,
+        approximate,
+        out.reshape(-1),
+    )
+    return out
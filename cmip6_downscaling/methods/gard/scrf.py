@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from upath import UPath
+
+from ... import config
+from ..common.containers import RunParameters
+
+
+def scrf_library_path(variable: str) -> UPath:
+    """Path to the stored spatio-temporally correlated random fields (SCRF) of a variable.
+
+    The library holds a global, pre-generated (see ``scrf.ipynb``) stretch of daily random fields,
+    ``scrf.uri`` in the config formatted with the variable.
+
+    Parameters
+    ----------
+    variable : str
+        Variable name
+
+    Returns
+    -------
+    path : UPath
+    """
+    return UPath(config.get('scrf.uri').format(variable=variable))
+
+
+def _positions(index: pd.Index, values: np.ndarray, dim: str) -> np.ndarray:
+    """Positions of `values` in `index`, which must contain all of them (like ``sel``)"""
+    positions = index.get_indexer(values)
+    if (positions < 0).any():
+        raise KeyError(f'{(positions < 0).sum()} {dim} values are not in the random fields')
+    return positions
+
+
+def scrf_time_positions(time: np.ndarray, start: str, n_days: int) -> np.ndarray:
+    """Day of a stored stretch of `n_days` random fields used for each time step.
+
+    The stored days are reused as many times as needed from January 1st of the `start` year, so
+    the random field of a date is the stored day at its offset from that day, modulo `n_days`.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Dates, datetime64
+    start : str
+        First year of the period the random fields are laid out over
+    n_days : int
+        Number of stored days
+
+    Returns
+    -------
+    positions : np.ndarray
+        Integer positions in the stored days, shape of `time`
+    """
+    offsets = (pd.DatetimeIndex(time) - pd.Timestamp(f'{start}-01-01')).days.values
+    return np.mod(offsets, n_days)
+
+
+def virtual_scrf(library: xr.Dataset, template: xr.Dataset, start: str) -> xr.Dataset:
+    """Lazy view of the random fields on the grid, time steps and chunks of `template`.
+
+    Equivalent to concatenating copies of `library` from January 1st of the `start` year until the
+    end of `template` and selecting the lat, lon and time values of `template`, but the days and
+    pixels are picked by position (see `scrf_time_positions`) and no copy of the random fields is
+    made until the view is computed.
+
+    Parameters
+    ----------
+    library : xr.Dataset
+        Stored random fields, with lat, lon and time dimensions
+    template : xr.Dataset
+        Dataset defining the lat, lon and time coordinates and the chunks of the view
+    start : str
+        First year of the period the random fields are laid out over
+
+    Returns
+    -------
+    scrf : xr.Dataset
+        Random fields, float32, with the coordinates of `template`
+    """
+    indexers = {
+        'lat': _positions(library.indexes['lat'], template.lat.values, 'lat'),
+        'lon': _positions(library.indexes['lon'], template.lon.values, 'lon'),
+        'time': scrf_time_positions(template.time.values, start, library.sizes['time']),
+    }
+    scrf = library.drop_vars(['spatial_ref', 'time'], errors='ignore').isel(indexers)
+    scrf = scrf.astype('float32').assign_coords(
+        {'lat': template.lat, 'lon': template.lon, 'time': template.time}
+    )
+    chunks = {dim: template.chunks[dim] for dim in indexers if dim in template.chunks}
+    return scrf.chunk(chunks) if chunks else scrf
+
+
+def open_scrf(template: xr.Dataset, run_parameters: RunParameters) -> xr.Dataset:
+    """Random fields of a run, aligned with its prediction dataset (see `virtual_scrf`)
+
+    Parameters
+    ----------
+    template : xr.Dataset
+        Prediction dataset
+    run_parameters : RunParameters
+        Parameters for run set-up and model specs
+
+    Returns
+    -------
+    scrf : xr.Dataset
+        Lazy random fields with the coordinates and chunks of `template`
+    """
+    library = xr.open_zarr(scrf_library_path(run_parameters.variable))
+    return virtual_scrf(library, template, run_parameters.predict_period.start)
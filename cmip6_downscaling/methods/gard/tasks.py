@@ -1,10 +1,5 @@
-from dataclasses import asdict
-
 import dask
-import numpy as np
-import pandas as pd
 import xarray as xr
-import xesmf as xe
 from carbonplan_data.metadata import get_cf_global_attrs
 from prefect import task
 from scipy.special import cbrt
@@ -14,8 +9,12 @@ from upath import UPath
 
 from ... import __version__ as version, config
 from ..common.bias_correction import bias_correct_gcm_by_method
-from ..common.containers import RunParameters, str_to_hash
+from ..common.cache import cache_target
+from ..common.containers import RunParameters
+from ..common.regridding import gcm_obs_weights_index, get_regridder
 from ..common.utils import apply_land_mask, blocking_to_zarr, set_zarr_encoding, zmetadata_exists
+from . import core as gard_core
+from .scrf import open_scrf, scrf_library_path
 from .utils import add_random_effects, get_gard_model
 
 xr.set_options(keep_attrs=True)
@@ -41,8 +40,14 @@ def coarsen_and_interpolate(fine_path: UPath, coarse_path: UPath) -> UPath:
     UPath
         Path to interpolated dataset.
     """
-    ds_hash = str_to_hash(str(fine_path) + str(coarse_path))
-    target = intermediate_dir / 'coarsen_and_interpolate' / ds_hash
+    target = cache_target(
+        intermediate_dir,
+        'coarsen_and_interpolate',
+        fine_path=fine_path,
+        coarse_path=coarse_path,
+        regrid_method='bilinear',
+        extrap_method='nearest_s2d',
+    )
 
     if use_cache and zmetadata_exists(target):
         print(f'found existing target: {target}')
@@ -53,11 +58,18 @@ def coarsen_and_interpolate(fine_path: UPath, coarse_path: UPath) -> UPath:
     target_ds = xr.open_zarr(coarse_path)
 
     # coarsen
-    regridder = xe.Regridder(fine_ds, target_ds, "bilinear", extrap_method="nearest_s2d")
+    regridder = get_regridder(fine_ds, target_ds, "bilinear", extrap_method="nearest_s2d")
     coarse_ds = regridder(fine_ds, keep_attrs=True)
 
-    # interpolate back to the fine grid
-    regridder = xe.Regridder(coarse_ds, fine_ds, "bilinear", extrap_method="nearest_s2d")
+    # interpolate back to the fine grid. coarse_ds has the attributes of the obs, so the catalog
+    # weights are looked up for the grid of target_ds
+    regridder = get_regridder(
+        coarse_ds,
+        fine_ds,
+        "bilinear",
+        extrap_method="nearest_s2d",
+        weights_index=gcm_obs_weights_index(target_ds, fine_ds),
+    )
     interpolated_ds = regridder(coarse_ds, keep_attrs=True)
 
     interpolated_ds.attrs.update(
@@ -69,7 +81,16 @@ def coarsen_and_interpolate(fine_path: UPath, coarse_path: UPath) -> UPath:
     return target
 
 
-def _fit_and_predict_wrapper(xtrain, ytrain, xpred, scrf, run_parameters, dim='time'):
+def _fit_and_predict_wrapper(
+    xtrain,
+    ytrain,
+    xpred,
+    scrf,
+    run_parameters,
+    dim='time',
+    thresh_fixes=False,
+    approximate_icdf=False,
+):
 
     xpred = xpred.rename({'t2': 'time'})
     scrf = scrf.rename({'t2': 'time'})
@@ -90,10 +111,6 @@ def _fit_and_predict_wrapper(xtrain, ytrain, xpred, scrf, run_parameters, dim='t
             .sel(variable='variable_0')
             .drop('variable')
         )
-    # model definition
-    model = PointWiseDownscaler(
-        model=get_gard_model(run_parameters.model_type, run_parameters.model_params), dim=dim
-    )
     # model fitting
     # # TODO need to fix this to only transform some variables
     if 'pr' in run_parameters.features:
@@ -112,13 +129,33 @@ def _fit_and_predict_wrapper(xtrain, ytrain, xpred, scrf, run_parameters, dim='t
     #     pr       (time, lat, lon) float32 0.4851 0.2508 0.1828 ... -0.5607 -0.5607
     #     tasmax   (time, lat, lon) float32 270.3 270.3 270.1 ... 257.0 256.3 256.3
     #     tasmin   (time, lat, lon) float32 261.5 261.3 261.1 ... 254.1 253.4 253.4
-    model.fit(xtrain[run_parameters.features], ytrain[run_parameters.variable])
-    out = model.predict(bias_corrected_gcm_pred[run_parameters.features]).to_dataset(dim='variable')
+    if gard_core.unsupported_params(run_parameters.model_params):
+        # options the gridded models can't reproduce, fit one skdownscale model per pixel (without
+        # the thresh fixes)
+        model = PointWiseDownscaler(
+            model=get_gard_model(run_parameters.model_type, run_parameters.model_params), dim=dim
+        )
+        model.fit(xtrain[run_parameters.features], ytrain[run_parameters.variable])
+        out = model.predict(bias_corrected_gcm_pred[run_parameters.features]).to_dataset(
+            dim='variable'
+        )
+    else:
+        # all pixels of the block are fit and predicted at once
+        out = gard_core.gridded_fit_and_predict(
+            xtrain,
+            ytrain[run_parameters.variable],
+            bias_corrected_gcm_pred,
+            features=run_parameters.features,
+            model_type=run_parameters.model_type,
+            model_params=run_parameters.model_params,
+            dim=dim,
+            thresh_fixes=thresh_fixes,
+        )
     if 'pr' == run_parameters.variable:
         out['pred'] = out['pred'] ** 3
 
     # # model prediction
-    downscaled = add_random_effects(out, scrf.scrf, run_parameters)
+    downscaled = add_random_effects(out, scrf.scrf, run_parameters, approximate=approximate_icdf)
     return downscaled
 
 
@@ -127,8 +164,8 @@ def fit_and_predict(
     xtrain_path: UPath,
     ytrain_path: UPath,
     xpred_path: UPath,
-    scrf_path: UPath,
     run_parameters: RunParameters,
+    scrf_path: UPath = None,
     dim: str = 'time',
 ) -> UPath:
     """Prepare inputs (e.g. normalize), use them to fit a GARD model based upon
@@ -144,10 +181,11 @@ def fit_and_predict(
         Path to historical prediction dataset (interpolated GCM)
     xpred_path : UPath
         Path to future prediction dataset (interpolated GCM) chunked full_time
-    scrf_path : UPath
-        Path to scrf chunked in full_time
     run_parameters : RunParameters
         Parameters for run set-up and model specs
+    scrf_path : UPath, optional
+        Path to scrf chunked in full_time. By default the random fields are read straight from
+        the SCRF library, aligned with xpred (see `open_scrf`).
     dim : str, optional
         Dimension to apply the model along. Default is ``time``.
 
@@ -156,25 +194,47 @@ def fit_and_predict(
     path : UPath
         Path to output dataset chunked full_time
     """
-    ds_hash = str_to_hash(
-        str(xtrain_path)
-        + str(ytrain_path)
-        + str(xpred_path)
-        + str(scrf_path)
-        + run_parameters.run_id_hash
-        + str(dim)
+    # analog models that only use the analogs above thresh and report the probability of exceeding
+    # it, instead of reproducing skdownscale
+    thresh_fixes = config.get('run_options.gard_thresh_fixes')
+    # fast approximation of the inverse normal CDF in the random effects (see `random_effects`)
+    approximate_icdf = config.get('run_options.gard_approximate_icdf')
+    target = cache_target(
+        results_dir,
+        'gard_fit_and_predict',
+        xtrain_path=xtrain_path,
+        ytrain_path=ytrain_path,
+        xpred_path=xpred_path,
+        scrf_path=scrf_path or scrf_library_path(run_parameters.variable),
+        predict_period=run_parameters.predict_period,
+        variable=run_parameters.variable,
+        features=run_parameters.features,
+        bias_correction_method=run_parameters.bias_correction_method,
+        bias_correction_kwargs=run_parameters.bias_correction_kwargs,
+        model_type=run_parameters.model_type,
+        model_params=run_parameters.model_params,
+        dim=dim,
+        thresh_fixes=thresh_fixes,
+        approximate_icdf=approximate_icdf,
+        code_version=3,
     )
-    target = results_dir / 'gard_fit_and_predict' / ds_hash
 
     if use_cache and zmetadata_exists(target):
         print(f'found existing target: {target}')
         return target
 
+    # chunks that are entirely ocean are neither read, fit nor written
+    skip_ocean_chunks = config.get('run_options.skip_ocean_chunks')
+
     # load in datasets
-    xtrain = xr.open_zarr(xtrain_path).pipe(apply_land_mask)
-    ytrain = xr.open_zarr(ytrain_path).pipe(apply_land_mask)
-    xpred = xr.open_zarr(xpred_path).pipe(apply_land_mask)
-    scrf = xr.open_zarr(scrf_path).pipe(apply_land_mask)
+    xtrain = xr.open_zarr(xtrain_path).pipe(apply_land_mask, skip_ocean_chunks=skip_ocean_chunks)
+    ytrain = xr.open_zarr(ytrain_path).pipe(apply_land_mask, skip_ocean_chunks=skip_ocean_chunks)
+    xpred = xr.open_zarr(xpred_path).pipe(apply_land_mask, skip_ocean_chunks=skip_ocean_chunks)
+    if scrf_path is None:
+        scrf = open_scrf(xpred, run_parameters)
+    else:
+        scrf = xr.open_zarr(scrf_path)
+    scrf = scrf.pipe(apply_land_mask, skip_ocean_chunks=skip_ocean_chunks)
     # make sure you have the variables you need in obs
     for v in xpred.data_vars:
         assert v in ytrain.data_vars
@@ -196,15 +256,28 @@ def fit_and_predict(
         _fit_and_predict_wrapper,
         xtrain,
         args=(ytrain, xpred.rename({'time': 't2'}), scrf.rename({'time': 't2'}), run_parameters),
-        kwargs={'dim': dim},
+        kwargs={'dim': dim, 'thresh_fixes': thresh_fixes, 'approximate_icdf': approximate_icdf},
         template=template,
     )
     out.attrs.update({'title': 'gard_fit_and_predict'}, **get_cf_global_attrs(version=version))
     out = dask.optimize(out)[0]
     # remove apply_land_mask after scikit-downscale#110 is merged
 
-    out_ds = out.pipe(apply_land_mask).pipe(set_zarr_encoding)
-    blocking_to_zarr(ds=out_ds, target=target, validate=True, write_empty_chunks=True)
+    out_ds = out.pipe(apply_land_mask, skip_ocean_chunks=skip_ocean_chunks).pipe(set_zarr_encoding)
+    metrics = {}
+    if skip_ocean_chunks:
+        # only the pixels with valid inputs are fit, and only those have a prediction
+        prediction = out_ds[run_parameters.variable].isel({dim: 0})
+        metrics['pixels_computed'] = prediction.notnull().sum().data
+    metrics = blocking_to_zarr(
+        ds=out_ds,
+        target=target,
+        validate=True,
+        write_empty_chunks=not skip_ocean_chunks,
+        metrics=metrics,
+    )
+    if metrics:
+        print(f"fit {metrics['pixels_computed']} of {out_ds.attrs['pixels_total']} pixels")
 
     return target
 
@@ -215,6 +288,9 @@ def read_scrf(prediction_path: UPath, run_parameters: RunParameters):
     Read spatial-temporally correlated random fields on file and subset into the correct spatial/temporal domain according to model_output.
     The random fields are stored in decade (10 year) long time series for the global domain and pre-generated using `scrf.ipynb`.
 
+    `fit_and_predict` reads the random fields directly from the library (see `open_scrf`), this
+    task is only needed to write them out.
+
     Parameters
     ----------
     prediction_path : UPath
@@ -228,47 +304,21 @@ def read_scrf(prediction_path: UPath, run_parameters: RunParameters):
     scrf : xr.DataArray
         Spatio-temporally correlated random fields (SCRF)
     """
-    # TODO: this is a temporary creation of random fields. ultimately we probably want to have
-    # ~150 years of random fields, but this is fine.
-
-    ds_hash = str_to_hash(
-        "{obs}_{variable}_{latmin}_{latmax}_{lonmin}_{lonmax}_{predict_dates[0]}_{predict_dates[1]}".format(
-            **asdict(run_parameters)
-        )
+    target = cache_target(
+        intermediate_dir,
+        'scrf',
+        obs=run_parameters.obs,
+        variable=run_parameters.variable,
+        bbox=run_parameters.bbox,
+        predict_period=run_parameters.predict_period,
+        scrf_library=scrf_library_path(run_parameters.variable),
     )
 
-    target = intermediate_dir / 'scrf' / ds_hash
-
     if use_cache and zmetadata_exists(target):
         print(f'found existing target: {target}')
         return target
     prediction_ds = xr.open_zarr(prediction_path)
-    scrf_ten_years = xr.open_zarr(f'az://static/scrf/ERA5_{run_parameters.variable}_1981_1990.zarr')
-
-    scrf_list = []
-    for year in np.arange(
-        int(run_parameters.predict_period.start), int(run_parameters.predict_period.stop) + 10, 10
-    ):
-        scrf_list.append(scrf_ten_years.drop('time'))
-    scrf = xr.concat(scrf_list, dim='time')
-    scrf['time'] = pd.date_range(
-        start=f'{run_parameters.predict_period.start}-01-01', periods=scrf.dims['time']
-    )
-
-    scrf = scrf.sel(time=run_parameters.predict_period.time_slice)
-
-    scrf = scrf.drop('spatial_ref').astype('float32')
-
-    scrf = scrf.sel(
-        lat=prediction_ds.lat.values, lon=prediction_ds.lon.values, time=prediction_ds.time.values
-    )
-    assert len(scrf.time) == len(prediction_ds.time)
-    assert len(scrf.lat) == len(prediction_ds.lat)
-    assert len(scrf.lon) == len(prediction_ds.lon)
-
-    scrf = scrf.assign_coords(
-        {'lat': prediction_ds.lat, 'lon': prediction_ds.lon, 'time': prediction_ds.time}
-    )
+    scrf = open_scrf(prediction_ds, run_parameters)
     if (scrf.chunks['lon'][0] != 48) or (scrf.chunks['lat'][0] != 48):
         scrf = scrf.chunk({'lon': 48, 'lat': 48, 'time': 3652})
     scrf = dask.optimize(scrf)[0]
@@ -4,11 +4,10 @@ from typing import Any
 
 import numpy as np
 import xarray as xr
-from scipy.special import cbrt
-from scipy.stats import norm as norm
 from skdownscale.pointwise_models import AnalogRegression, PureAnalog, PureRegression
 
 from ..common.containers import RunParameters
+from .core import random_effects
 
 xr.set_options(keep_attrs=True)
 
@@ -45,44 +44,48 @@ def get_gard_model(
 
 
 def add_random_effects(
-    model_output: xr.Dataset, scrf: xr.DataArray, run_parameters: RunParameters
+    model_output: xr.Dataset,
+    scrf: xr.DataArray,
+    run_parameters: RunParameters,
+    approximate: bool = False,
 ) -> xr.Dataset:
+    """Add the spatio-temporally correlated random effects to the GARD model output.
+
+    Parameters
+    ----------
+    model_output : xr.Dataset
+        GARD model output with ``pred``, ``prediction_error`` and ``exceedance_prob``
+    scrf : xr.DataArray
+        Spatio-temporally correlated random fields
+    run_parameters : RunParameters
+        Parameters for run set-up and model specs
+    approximate : bool, optional
+        Use a fast approximation of the inverse normal CDF, by default False (see
+        `random_effects`)
+
+    Returns
+    -------
+    downscaled : xr.Dataset
+    """
     if run_parameters.model_params is not None:
         thresh = run_parameters.model_params.get('thresh')
     else:
         thresh = None
 
-    if thresh is not None:
-        # convert scrf from a normal distribution to a uniform distribution
-        scrf_uniform = xr.apply_ufunc(
-            norm.cdf, scrf, dask='parallelized', output_dtypes=[scrf.dtype]
-        )
-
-        # find where exceedance prob is exceeded
-        mask = scrf_uniform > (1 - model_output['exceedance_prob'])
-
-        # Rescale the uniform distribution
-        new_uniform = (scrf_uniform - (1 - model_output['exceedance_prob'])) / model_output[
-            'exceedance_prob'
-        ]
-
-        # Get the normal distribution equivalent of new_uniform
-        r_normal = xr.apply_ufunc(
-            norm.ppf, new_uniform, dask='parallelized', output_dtypes=[new_uniform.dtype]
-        )
-        if run_parameters.variable == 'pr':
-            downscaled = (
-                cbrt(model_output['pred']) + (model_output['prediction_error'] * r_normal)
-            ) ** 3
-        else:
-            downscaled = model_output['pred'] + r_normal * model_output['prediction_error']
-
-        # what do we do for thresholds like heat wave?
-        valids = np.logical_or(mask, downscaled >= 0)
-        downscaled = downscaled.where(valids, 0)
-        downscaled = downscaled.where(downscaled >= 0, 0)
-
-    else:
-        downscaled = model_output['pred'] + scrf * model_output['prediction_error']
-
+    # one pass over the inputs, see random_effects
+    # what do we do for thresholds like heat wave?
+    downscaled = xr.apply_ufunc(
+        random_effects,
+        model_output['pred'],
+        model_output['prediction_error'],
+        model_output['exceedance_prob'],
+        scrf,
+        kwargs=dict(
+            use_thresh=thresh is not None,
+            cube_root=run_parameters.variable == 'pr',
+            approximate=approximate,
+        ),
+        dask='parallelized',
+        output_dtypes=[np.result_type(model_output['pred'].dtype, scrf.dtype)],
+    )
     return downscaled.to_dataset(name=run_parameters.variable)
@@ -1,12 +1,40 @@
 from __future__ import annotations
 
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import xarray as xr
-import xesmf as xe
 from skdownscale.pointwise_models import EquidistantCdfMatcher, PointWiseDownscaler
-from sklearn.linear_model import LinearRegression
 
-from .utils import add_circular_temporal_pad, generate_batches, pad_with_edge_year
+from ..common.quantile_mapping import equidistant_cdf_matching
+from ..common.regression import batched_linear_regression
+from ..common.regridding import get_regridder
+from ..common.rolling import group_mean, grouped_rolling_mean, rolling_mean
+from .utils import generate_batches
+
+
+def _epoch_trend(
+    values: np.ndarray,
+    doy: np.ndarray,
+    historical: np.ndarray,
+    day_rolling_window: int,
+    year_rolling_window: int,
+) -> np.ndarray:
+    """Epoch trend of an array with time along the first axis (see `epoch_trend`)"""
+    day_mean = rolling_mean(values, day_rolling_window, pad='wrap')
+    trend = grouped_rolling_mean(day_mean, doy, year_rolling_window, pad='window')
+
+    # historical climatology of each day of year, from the rolling average of the historical period
+    hist_doy, climatology = group_mean(
+        rolling_mean(values[historical], day_rolling_window, pad='wrap'), doy[historical]
+    )
+    lookup = np.full(doy.max() + 1, -1)
+    lookup[hist_doy] = np.arange(len(hist_doy))
+    index = lookup[doy]
+    trend -= climatology[index]
+    trend[index < 0] = np.nan
+    return trend
 
 
 def epoch_trend(
@@ -19,6 +47,13 @@ def epoch_trend(
     Calculate the epoch trend as a multi-day, multi-year rolling average. The trend is calculated as the anomaly
     against the historical mean (also a multi-day rolling average).
 
+    The day rolling average is centered and wraps around the ends of the series. The year rolling average is
+    taken over the same day of year in neighboring years; the first and last years, which don't have enough
+    neighbors, repeat the average of the first and last full window. All windowed sums come from cumulative sums
+    along time (see `cmip6_downscaling.methods.common.rolling`), so the cost doesn't depend on the window sizes
+    and no padded copies of the data are made. Only the time dimension needs to be in memory: this can be applied
+    to spatial blocks with `xarray.map_blocks`.
+
     Parameters
     ----------
     data : xr.Dataset
@@ -33,94 +68,193 @@ def epoch_trend(
     Returns
     -------
     trend : xr.Dataset
-        The long term average trend
+        The long term average trend, on the time steps of data
     """
     # the rolling windows need to be odd numbers since the rolling average is centered
     assert day_rolling_window % 2 == 1
-    d_offset = int((day_rolling_window - 1) / 2)
-
     assert year_rolling_window % 2 == 1
-    y_offset = int((year_rolling_window - 1) / 2)
-
-    # get historical mean as a rolling average -- the result has one number for each day of year
-    # which is the average of the neighboring day of years over multiple years
-    padded = add_circular_temporal_pad(data=data.sel(time=historical_period), offset=d_offset)
-    hist_mean = (
-        padded.rolling(time=day_rolling_window, center=True)
-        .mean()
-        .dropna('time')
-        .groupby("time.dayofyear")
-        .mean()
-    )
 
-    # get rolling average for the entire data -- the result has one number for each day in the entire time series
-    # which is the average of the neighboring day of years in neighboring years
-    padded = add_circular_temporal_pad(data=data, offset=d_offset)
-
-    def func(x):
-        window = min(len(x.time), year_rolling_window)
-        return x.rolling(time=window, center=True).mean()
-
-    rolling_doy_mean = (
-        padded.rolling(time=day_rolling_window, center=True)
-        .mean()
-        .dropna('time')
-        .groupby('time.dayofyear')
-        .apply(func)
-        .dropna('time')
-    )
+    doy = data.time.dt.dayofyear.values
+    time = data.time.to_index()
+    historical = np.flatnonzero(time.isin(data.time.sel(time=historical_period).values))
 
-    # repeat the first/last year to cover the time periods without enough data for the rolling average
-    for i in range(y_offset):
-        rolling_doy_mean = pad_with_edge_year(rolling_doy_mean)
+    trend = xr.Dataset(attrs=data.attrs)
+    for name, da in data.data_vars.items():
+        da = da.transpose('time', ...)
+        values = _epoch_trend(da.values, doy, historical, day_rolling_window, year_rolling_window)
+        trend[name] = da.copy(data=values.astype(da.dtype, copy=False))
+    return trend
 
-    # remove historical mean from rolling average, leaving trend as the anamoly
-    trend = rolling_doy_mean.groupby('time.dayofyear') - hist_mean
 
-    return trend
+def noleap_dayofyear(time: xr.DataArray) -> np.ndarray:
+    """
+    Day of year on a 365 day calendar: days after February 28th of leap years are shifted back by one, so that e.g.
+    March 1st is always day 60 and December 31st is always day 365. February 29th shares day 59 with February 28th.
+
+    Parameters
+    ----------
+    time : xr.DataArray
+        1D xr data array of datetimes
+
+    Returns
+    -------
+    doy : np.ndarray
+        Day of year in 1-365
+    """
+    doy = time.dt.dayofyear.values
+    is_leap_year = time.dt.is_leap_year.values
+    return doy - (is_leap_year & (doy > 59))
+
+
+def doy_window(doy: int, doy_range: int = 45) -> np.ndarray:
+    """
+    Days of year (on a 365 day calendar) within doy_range days of doy, wrapping around the end of the year.
+
+    Parameters
+    ----------
+    doy : int
+        Day of year in 1-365
+    doy_range : int
+        The range of day of year to include on either side of doy
+
+    Returns
+    -------
+    window : np.ndarray
+        Sorted days of year in 1-365
+    """
+    offsets = np.arange(-min(doy_range, 182), min(doy_range, 182) + 1)
+    return np.unique((doy - 1 + offsets) % 365 + 1)
+
+
+def build_doy_index(doy: np.ndarray) -> dict[int, np.ndarray]:
+    """
+    Index from day of year to the positions of the days with that day of year.
+
+    Parameters
+    ----------
+    doy : np.ndarray
+        Day of year (1-365, see `noleap_dayofyear`) of each day
+
+    Returns
+    -------
+    index : dict
+        Mapping of day of year to sorted positions in doy
+    """
+    doy = np.asarray(doy)
+    order = np.argsort(doy, kind='stable')
+    values, starts = np.unique(doy[order], return_index=True)
+    return dict(zip(values.tolist(), np.split(order, starts[1:])))
+
+
+def _squared_distances(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Sum of squared differences between every row of y and every row of x, skipping NaNs.
+
+    Uses the expansion ``(x - y)**2 = x**2 + y**2 - 2xy`` so the work is done by matrix products.
+    Pixels that are NaN in either day don't contribute, like in a NaN-skipping sum.
+    """
+    x_valid, y_valid = np.isfinite(x), np.isfinite(y)
+    x0, y0 = np.where(x_valid, x, 0), np.where(y_valid, y, 0)
+    distances = (y0**2) @ x_valid.T + y_valid @ (x0**2).T - 2 * (y0 @ x0.T)
+    return np.maximum(distances, 0)
 
 
-def get_doy_mask(
-    source_doy: xr.DataArray,
-    target_doy: xr.DataArray,
+def find_analogs(
+    x: np.ndarray,
+    y: np.ndarray,
+    source_doy: np.ndarray,
+    target_doy: np.ndarray,
+    n_analogs: int = 10,
     doy_range: int = 45,
-) -> xr.DataArray:
+    block_size: int = 1024,
+) -> np.ndarray:
     """
-    Given two 1D dataarrays containing day of year informations: source_doy and target_doy , return a matrix of shape
-    len(target_doy) x len(source_doy). Cell (i, j) is True if the source doy j is within doy_range days of the target
-    doy i, and False otherwise
+    For each target day in y, find the n_analogs source days in x with the lowest RMSE, among the source days within
+    doy_range days of year of the target day. Source days are indexed by day of year (see `build_doy_index`), and
+    target days with the same day of year are searched together, against only the source days in their window.
+    Distances are computed with matrix products in blocks of at most block_size target days, and only the top
+    n_analogs of each row are kept (with argpartition).
 
     Parameters
     ----------
-    source_doy : xr.DataArray
-        1D xr data array with day of year information
-    target_doy : xr.DataArray
-        1D xr data array with day of year information
+    x : np.ndarray
+        Source days, shape (n_source_days, n_pixels)
+    y : np.ndarray
+        Target days, shape (n_target_days, n_pixels)
+    source_doy : np.ndarray
+        Day of year (1-365, see `noleap_dayofyear`) of each source day
+    target_doy : np.ndarray
+        Day of year (1-365, see `noleap_dayofyear`) of each target day
+    n_analogs : int
+        Number of analog days to look for
+    doy_range : int
+        The range of day of year to look for analogs within
+    block_size : int
+        Maximum number of target days processed at once
 
     Returns
     -------
-    mask : xr.DataArray
-        2D xr data array of boolean type in the shape of len(target_doy) x len(source_doy)
+    inds : np.ndarray
+        Positions of the analogs in x, shape (n_target_days, n_analogs), sorted by increasing RMSE
     """
-    # get the min and max doy within doy_range days to target doy
-    target_doy_min = target_doy - doy_range
-    target_doy_max = target_doy + doy_range
-    # make sure the range is within 0-365
-    # TODO: what to do with leap years???
-    target_doy_min[target_doy_min <= 0] += 365
-    target_doy_max[target_doy_max > 365] -= 365
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    source_index = build_doy_index(source_doy)
+    target_index = build_doy_index(target_doy)
+    for doy in itertools.chain(source_index, target_index):
+        if not 1 <= doy <= 365:
+            raise ValueError(f'days of year must be in 1-365, got {doy}')
+
+    inds = np.empty((len(y), n_analogs), dtype=int)
+    for doy, targets in target_index.items():
+        window = [source_index[d] for d in doy_window(doy, doy_range) if d in source_index]
+        candidates = np.sort(np.concatenate(window)) if window else np.array([], dtype=int)
+        if len(candidates) < n_analogs:
+            raise ValueError(
+                f'only {len(candidates)} source days within {doy_range} days of day of year {doy}, '
+                f'{n_analogs} analogs requested'
+            )
+        for start in range(0, len(targets), block_size):
+            block = targets[start : start + block_size]
+            distances = _squared_distances(x[candidates], y[block])
+            top = np.argpartition(distances, n_analogs - 1, axis=1)[:, :n_analogs]
+            order = np.argsort(np.take_along_axis(distances, top, axis=1), axis=1, kind='stable')
+            inds[block] = candidates[np.take_along_axis(top, order, axis=1)]
+    return inds
 
-    # if the min is larger than max, the target doy is at the edge of a year, and we can accept the
-    # source if any one of the condition is True
-    one_sided = target_doy_min > target_doy_max
-    edges = ((source_doy >= target_doy_min) | (source_doy <= target_doy_max)) & (one_sided)
-    # otherwise the source doy needs to be within min and max
-    within = (source_doy >= target_doy_min) & (source_doy <= target_doy_max) & (~one_sided)
 
-    # mask is true if either one of the condition is satisfied
-    mask = edges | within
+def _kind(variable: str) -> str:
+    return 'ratio' if variable in ['pr', 'huss', 'vas', 'uas'] else 'difference'
 
-    return mask
+
+def compute_obs_cdfs(da_obs: xr.DataArray, batches: list[np.ndarray]) -> list[np.ndarray]:
+    """
+    Precompute the sorted observations (i.e. the empirical CDF values) of every pixel for each day of year window.
+
+    Parameters
+    ----------
+    da_obs : xr.DataArray
+        Observations used to train the bias correction, with a time dimension
+    batches : list
+        Days of year in each window, as returned by `generate_batches`
+
+    Returns
+    -------
+    obs_cdfs : list
+        One array of shape (n_days_in_window, ...) per window, sorted along the first axis
+    """
+    doy = da_obs.time.dt.dayofyear
+    values = da_obs.transpose('time', ...).values
+    return [np.sort(values[doy.isin(b).values], axis=0) for b in batches]
+
+
+def _bias_correct_window(
+    gcm: np.ndarray, train_gcm: np.ndarray, obs_cdf: np.ndarray, kind: str
+) -> np.ndarray:
+    """Equidistant CDF matching of every pixel of one day of year window"""
+    out = equidistant_cdf_matching(gcm, train_gcm, obs_cdf, kind=kind, y_sorted=True)
+    # same pixel mask as PointWiseDownscaler
+    out[:, np.isnan(train_gcm[0])] = np.nan
+    return out.astype(gcm.dtype, copy=False)
 
 
 def bias_correction(
@@ -129,6 +263,8 @@ def bias_correction(
     variables: list[str],
     batch_size: int = 15,
     buffer_size: int = 15,
+    n_workers: int = 1,
+    obs_cdfs: dict[str, list[np.ndarray]] = None,
 ) -> xr.Dataset:
     """
     Run bias correction as it is done in the MACA method.
@@ -139,6 +275,109 @@ def bias_correction(
     together, but only the result of the center 15 days are used. The historical GCM is mapped
     to historical coarsened observation in the bias correction.
 
+    The day of year windows can be bias corrected concurrently on a thread pool, each writing the
+    days of its core into a shared output array. Within a window all pixels are corrected at once
+    (see `equidistant_cdf_matching`). The sorted observations of every window are computed once up
+    front (see `compute_obs_cdfs`) and can be passed in to share them across GCM inputs. See
+    `bias_correction_sequential` for the reference implementation.
+
+    Parameters
+    ----------
+    ds_gcm : xr.Dataset
+        GCM dataset, must have a dimension called time on which we can call .dt.dayofyear on
+    ds_obs : xr.Dataset
+        Observation dataset, must have a dimension called time on which we can call .dt.dayofyear on
+    variables : List[str]
+        Names of the variables used in obs and gcm dataset (including features and label)
+    batch_size : Optional[int]
+        The batch size in terms of day of year to bias correct together
+    buffer_size : Optional[int]
+        The buffer size in terms of day of year to include in the bias correction
+    n_workers : Optional[int]
+        Number of threads bias correcting windows concurrently, by default 1 (no thread pool).
+        Keep it small when called in dask tasks, as every task starts its own pool. None lets
+        `concurrent.futures.ThreadPoolExecutor` choose.
+    obs_cdfs : Optional[dict]
+        Precomputed `compute_obs_cdfs` output for each variable. Must be computed from the
+        observations on the days also present in ds_gcm, with the same batch and buffer sizes.
+
+    Returns
+    -------
+    ds_out : xr.Dataset
+        The bias corrected dataset
+
+    See Also
+    --------
+    https://climate.northwestknowledge.net/MACA/MACAmethod.php
+    """
+
+    # map_blocks work around
+    if 't2' in ds_obs.coords:
+        ds_obs = ds_obs.rename({'t2': 'time'})
+
+    if isinstance(variables, str):
+        variables = [variables]
+
+    # the models are trained on the days present in both datasets
+    train_time = np.intersect1d(ds_gcm.time.values, ds_obs.time.values)
+    train_gcm = ds_gcm.sel(time=train_time)
+    train_obs = ds_obs.sel(time=train_time)
+
+    doy_gcm = ds_gcm.time.dt.dayofyear.values
+    doy_train = train_gcm.time.dt.dayofyear.values
+    batches, cores = generate_batches(
+        n=doy_gcm.max(), batch_size=batch_size, buffer_size=buffer_size, one_indexed=True
+    )
+
+    ds_out = xr.Dataset()
+    for var in variables:
+        gcm = ds_gcm[var].transpose('time', ...)
+        gcm_values = gcm.values
+        train_values = train_gcm[var].transpose('time', ...).values
+        if obs_cdfs is not None:
+            var_obs_cdfs = obs_cdfs[var]
+        else:
+            var_obs_cdfs = compute_obs_cdfs(train_obs[var], batches)
+
+        out = np.full(gcm_values.shape, np.nan, dtype=gcm_values.dtype)
+
+        def _run(b, c, obs_cdf):
+            in_batch = np.isin(doy_gcm, b)
+            corrected = _bias_correct_window(
+                gcm_values[in_batch], train_values[np.isin(doy_train, b)], obs_cdf, _kind(var)
+            )
+            # only keep the core days of the window; cores don't overlap
+            in_core = np.isin(doy_gcm[in_batch], c)
+            out[np.flatnonzero(in_batch)[in_core]] = corrected[in_core]
+
+        if n_workers == 1:
+            list(map(_run, batches, cores, var_obs_cdfs))
+        else:
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                list(pool.map(_run, batches, cores, var_obs_cdfs))
+
+        ds_out[var] = gcm.copy(data=out)
+
+    return ds_out
+
+
+def bias_correction_sequential(
+    ds_gcm: xr.Dataset,
+    ds_obs: xr.Dataset,
+    variables: list[str],
+    batch_size: int = 15,
+    buffer_size: int = 15,
+) -> xr.Dataset:
+    """
+    Run bias correction as it is done in the MACA method, one day of year window after the other. Reference
+    implementation of `bias_correction`.
+
+    The bias correction is performed using the Equidistant CDF matching method in batches.
+    Neighboring day of years are bias corrected together with a buffer. That is, with a batch
+    size of 15 and a buffer size of 15, the 45 neighboring days of year are bias corrected
+    together, but only the result of the center 15 days are used. The historical GCM is mapped
+    to historical coarsened observation in the bias correction.
+
     Parameters
     ----------
     ds_gcm : xr.Dataset
@@ -190,7 +429,6 @@ def bias_correction(
         )
 
         bc_result = []
-        # TODO: currently running in sequence but can be mapped out into separate workers/runners
         for i, (b, c) in enumerate(zip(batches, cores)):
             gcm_batch = ds_gcm.sel(time=doy_gcm.isin(b))
             obs_batch = ds_obs.sel(time=doy_obs.isin(b))
@@ -214,6 +452,7 @@ def construct_analogs(
     label: str,
     n_analogs: int = 10,
     doy_range: int = 45,
+    batch_size: int = 1024,
 ) -> xr.Dataset:
     """
     Find analog days for each coarse scale GCM day from coarsened observations, then use the fine scale versions of
@@ -236,6 +475,8 @@ def construct_analogs(
         Number of analog days to look for
     doy_range : int
         The range of day of year to look for analogs within
+    batch_size : int
+        Number of GCM days whose analogs are searched for and whose linear regressions are solved together
 
     Returns
     -------
@@ -263,90 +504,59 @@ def construct_analogs(
     coarse_template = _make_template(da_obs_coarse)
     fine_template = _make_template(da_obs_fine)
 
-    regridder = xe.Regridder(
+    regridder = get_regridder(
         coarse_template,
         fine_template,
         "bilinear",
         extrap_method="nearest_s2d",
     )
 
-    # get dimension sizes from input data
-    domain_shape_coarse = (len(da_obs_coarse.lat), len(da_obs_coarse.lon))
-    n_pixel_coarse = domain_shape_coarse[0] * domain_shape_coarse[1]
-
     # rename the time dimension to keep track of them
     X = da_obs_coarse.rename({'time': 'ndays_in_obs'})  # coarse obs
     y = da_gcm.rename({'time': 'ndays_in_gcm'})  # coarse gcm
 
-    # get rmse between each GCM slices to be downscaled and each observation slices
-    # will have the shape ndays_in_gcm x ndays_in_obs
-    rmse = np.sqrt(((X - y) ** 2).sum(dim=['lat', 'lon'])) / n_pixel_coarse
-    rmse = rmse.load()
-
-    # get a day of year mask in the same shape of rmse according to the day range input
-    mask = get_doy_mask(
-        source_doy=X.ndays_in_obs.dt.dayofyear,
-        target_doy=y.ndays_in_gcm.dt.dayofyear,
+    # find the indices with the lowest rmse within the day of year constraint, without materializing the
+    # ndays_in_gcm x ndays_in_obs rmse matrix
+    ind = find_analogs(
+        X.transpose('ndays_in_obs', 'lat', 'lon').values.reshape(len(X.ndays_in_obs), -1),
+        y.transpose('ndays_in_gcm', 'lat', 'lon').values.reshape(len(y.ndays_in_gcm), -1),
+        source_doy=noleap_dayofyear(X.ndays_in_obs),
+        target_doy=noleap_dayofyear(y.ndays_in_gcm),
+        n_analogs=n_analogs,
         doy_range=doy_range,
+        block_size=batch_size,
     )
 
-    # find the indices with the lowest rmse within the day of year constraint
-    dim_order = ['ndays_in_gcm', 'ndays_in_obs']
-    inds = (
-        rmse.where(mask)
-        .argsort(axis=rmse.get_axis_num('ndays_in_obs'))
-        .isel(ndays_in_obs=slice(0, n_analogs))
-        .transpose(*dim_order)
-    )
     # rearrage the data into tabular format in order to train linear regression models to get coefficients
     X = X.stack(pixel_coarse=['lat', 'lon'])
     X = X.where(X.notnull(), drop=True)
     y = y.stack(pixel_coarse=['lat', 'lon'])
     y = y.where(y.notnull(), drop=True)
 
-    # initialize models to be used
-    lr_model = LinearRegression()
-
-    # initialize temporary variables
-    downscaled = []
-    residuals = []
-    coefs = []
-    intercepts = []
-    obs_analogs = []
-
-    # pre-load to speed up for loop (lots of indexing into x & y)
-    X = X.load()
-    y = y.load()
+    # pre-load to speed up indexing into x & y
+    X = X.load().transpose('ndays_in_obs', 'pixel_coarse')
+    y = y.load().transpose('ndays_in_gcm', 'pixel_coarse')
 
     # train a linear regression model for each day in coarsen GCM dataset, where the features are each coarsened observation
-    # analogs, and examples are each pixels within the coarsened domain
-    for i in range(len(y)):
-
-        # get data from the GCM day being downscaled
-        yi = y.isel(ndays_in_gcm=i)
-        # get data from the coarsened obs analogs
-        ind = inds.isel(ndays_in_gcm=i).values
-
-        # save obs_analogs for later
-        obs_analogs.append(da_obs_fine.isel(time=ind).rename({'time': 'analog'}).drop('analog'))
-
-        xi = X.isel(ndays_in_obs=ind).transpose('pixel_coarse', 'ndays_in_obs')
-
-        # fit model
-        lr_model.fit(xi.data, yi.data)
-        coefs.append(lr_model.coef_)
-        intercepts.append(lr_model.intercept_)
-
-        residual = yi - lr_model.predict(xi.data)
-        residual = residual.unstack('pixel_coarse')
-
-        residuals.append(residual)
+    # analogs, and examples are each pixels within the coarsened domain. The design matrices of a batch of days are
+    # gathered into one array of shape (days, pixels, analogs) and solved together.
+    coefs = np.empty(ind.shape)
+    intercepts = np.empty(len(ind))
+    residuals = np.empty(y.shape)
+    for start in range(0, len(ind), batch_size):
+        batch = slice(start, start + batch_size)
+        xi = X.data[ind[batch]].transpose(0, 2, 1)
+        coefs[batch], intercepts[batch], residuals[batch] = batched_linear_regression(
+            xi, y.data[batch]
+        )
 
-    # reconstruct xarray objects from temporary lists
-    residuals = xr.concat(residuals, dim='ndays_in_gcm').rename({'ndays_in_gcm': 'time'})
+    # reconstruct xarray objects
+    residuals = y.copy(data=residuals).unstack('pixel_coarse')
+    residuals = residuals.rename({'ndays_in_gcm': 'time'})
     coefs = xr.DataArray(coefs, dims=('time', 'analog'), coords={'time': residuals.time})
     intercepts = xr.DataArray(intercepts, coords={'time': residuals.time})
-    obs_analogs = xr.concat(obs_analogs, dim='time')
+    obs_analogs = da_obs_fine.isel(time=xr.DataArray(ind, dims=('ndays_in_gcm', 'analog')))
+    obs_analogs = obs_analogs.drop_vars('time').rename({'ndays_in_gcm': 'time'})
 
     # interpolate residuals to fine grid
     interpolated_residual = regridder(residuals)
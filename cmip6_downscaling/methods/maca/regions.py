@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import regionmask
+import xarray as xr
+from upath import UPath
+
+from ... import config
+from ...utils import str_to_hash
+from ..common.regridding import grid_fingerprint
+from ..common.utils import is_cached, write_zarr_once
+
+_region_indexes: OrderedDict = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_regions(region_def: str = 'ar6.land') -> regionmask.Regions:
+    """Regionmask regions from a key such as 'ar6.land'"""
+    regions = regionmask.defined_regions
+    for name in region_def.split('.'):
+        regions = getattr(regions, name)
+    return regions
+
+
+@dataclass
+class RegionIndex:
+    """Integer region mask of a grid with the bounding box and pixel count of every region"""
+
+    mask: xr.DataArray
+    bboxes: dict[int, dict[str, slice]]
+    pixel_counts: dict[int, int]
+
+    @property
+    def regions(self) -> list[int]:
+        return list(self.bboxes)
+
+    def indexers(self, region: int) -> dict[str, slice | np.ndarray]:
+        """Rows and columns in which `region` has pixels, ready for ``ds.isel``.
+
+        These are the bounding box slices, unless the region skips rows or columns within its
+        bounding box (e.g. islands), in which case the skipped ones are left out, like
+        ``ds.where(mask == region, drop=True)`` does.
+
+        Parameters
+        ----------
+        region : int
+            Region number
+
+        Returns
+        -------
+        indexers : dict
+        """
+        if region not in self.bboxes:
+            raise ValueError(f'region {region} has no pixels on this grid')
+        bbox = self.bboxes[region]
+        in_region = (self.mask.isel(bbox) == region).values
+        indexers = {}
+        for axis, dim in enumerate(self.mask.dims):
+            present = np.flatnonzero(in_region.any(axis=1 - axis))
+            if len(present) == bbox[dim].stop - bbox[dim].start:
+                indexers[dim] = bbox[dim]
+            else:
+                indexers[dim] = bbox[dim].start + present
+        return indexers
+
+    def to_dataset(self) -> xr.Dataset:
+        regions = np.array(self.regions, dtype=int)
+        ds = xr.Dataset({'mask': self.mask}, coords={'region': regions})
+        for dim in self.mask.dims:
+            ds[f'{dim}_start'] = ('region', [self.bboxes[r][dim].start for r in regions])
+            ds[f'{dim}_stop'] = ('region', [self.bboxes[r][dim].stop for r in regions])
+        ds['pixel_count'] = ('region', [self.pixel_counts[r] for r in regions])
+        ds['mask'].encoding = {'dtype': 'int16', '_FillValue': -1}
+        return ds
+
+    @classmethod
+    def from_dataset(cls, ds: xr.Dataset) -> RegionIndex:
+        """Region index from a dataset written by `to_dataset`; the mask is not loaded"""
+        dims = ds['mask'].dims
+        table = ds.drop_vars('mask').load()
+        regions = [int(r) for r in table.region.values]
+        bboxes = {
+            region: {
+                dim: slice(int(table[f'{dim}_start'][i]), int(table[f'{dim}_stop'][i]))
+                for dim in dims
+            }
+            for i, region in enumerate(regions)
+        }
+        pixel_counts = dict(zip(regions, table.pixel_count.values.astype(int).tolist()))
+        return cls(mask=ds['mask'], bboxes=bboxes, pixel_counts=pixel_counts)
+
+
+def compute_region_index(ds: xr.Dataset, region_def: str = 'ar6.land') -> RegionIndex:
+    """Rasterize the regions on the grid of `ds` and index them.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset with lat and lon coordinates
+    region_def : str, optional
+        Regionmask key, by default `ar6.land`
+
+    Returns
+    -------
+    RegionIndex
+    """
+    mask = get_regions(region_def).mask(ds)
+    values = mask.values
+    rows, cols = np.nonzero(np.isfinite(values))
+    regions, inverse, counts = np.unique(
+        values[rows, cols].astype(int), return_inverse=True, return_counts=True
+    )
+    bboxes = {int(region): {} for region in regions}
+    for dim, index in zip(mask.dims, [rows, cols]):
+        start = np.full(len(regions), index.max(initial=0))
+        stop = np.zeros(len(regions), dtype=int)
+        np.minimum.at(start, inverse, index)
+        np.maximum.at(stop, inverse, index + 1)
+        for i, region in enumerate(regions):
+            bboxes[int(region)][dim] = slice(int(start[i]), int(stop[i]))
+    pixel_counts = {int(r): int(c) for r, c in zip(regions, counts)}
+    return RegionIndex(mask=mask, bboxes=bboxes, pixel_counts=pixel_counts)
+
+
+def region_index_path(ds: xr.Dataset, region_def: str = 'ar6.land') -> UPath:
+    """Location of the cached region index of the grid of `ds` (see `get_region_index`)"""
+    grid = xr.Dataset(coords={'lat': ds['lat'], 'lon': ds['lon']})
+    key = str_to_hash(
+        json.dumps([grid_fingerprint(grid), region_def, regionmask.__version__], sort_keys=True)
+    )
+    return UPath(config.get('region_masks.uri')) / region_def / f'{key}.zarr'
+
+
+def get_region_index(ds: xr.Dataset, region_def: str = 'ar6.land') -> RegionIndex:
+    """Region index of the grid of `ds`, rasterizing the regions only once per grid.
+
+    Indexes are cached per grid fingerprint (lat/lon values), region definition and regionmask
+    version: in a process-wide LRU holding ``region_masks.memory_cache_size`` indexes, and as
+    small zarr stores under ``region_masks.uri`` (static storage) shared by all flows. Stores are
+    written once and not overwritten once complete (see `write_zarr_once`), and are opened
+    lazily, so only the bounding boxes and pixel counts are read up front and the mask is read
+    chunk by chunk as regions are extracted.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset with lat and lon coordinates
+    region_def : str, optional
+        Regionmask key, by default `ar6.land`
+
+    Returns
+    -------
+    RegionIndex
+    """
+    path = region_index_path(ds, region_def)
+    key = str(path)
+    with _lock:
+        if key in _region_indexes:
+            _region_indexes.move_to_end(key)
+            return _region_indexes[key]
+
+    if is_cached(path):
+        index = RegionIndex.from_dataset(xr.open_zarr(path))
+    else:
+        # concurrent tasks may miss the cache together: the first one writes the store, and every
+        # task keeps using the index it computed itself, never the store while it is written
+        print(f'rasterizing {region_def} regions, caching them at {path}')
+        index = compute_region_index(ds, region_def)
+        write_zarr_once(index.to_dataset().chunk({'lat': 512, 'lon': 512}), path)
+
+    with _lock:
+        _region_indexes[key] = index
+        _region_indexes.move_to_end(key)
+        while len(_region_indexes) > config.get('region_masks.memory_cache_size'):
+            _region_indexes.popitem(last=False)
+    return index
+
+
+def extract_region(ds: xr.Dataset, region: int, region_def: str = 'ar6.land') -> xr.Dataset:
+    """Lazily extract one region of a dataset.
+
+    Equivalent to ``ds.where(mask == region, drop=True)``, but the dataset is only cropped to the
+    rows and columns of the region with ``isel`` (see `RegionIndex.indexers`) and masked within
+    them, so no data is read or written until the result is computed.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset with lat and lon coordinates
+    region : int
+        Region number
+    region_def : str, optional
+        Regionmask key, by default `ar6.land`
+
+    Returns
+    -------
+    xr.Dataset
+        Region of the dataset, NaN outside of the region
+    """
+    index = get_region_index(ds, region_def)
+    indexers = index.indexers(region)
+    mask = index.mask.isel(indexers).compute()
+    return ds.isel(indexers).where(mask == region)
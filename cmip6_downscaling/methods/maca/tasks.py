@@ -1,9 +1,9 @@
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
 import dask
-import regionmask
 import xarray as xr
 import zarr
 from carbonplan_data.metadata import get_cf_global_attrs
@@ -11,21 +11,42 @@ from prefect import task
 from upath import UPath
 
 from cmip6_downscaling import __version__ as version, config
+from cmip6_downscaling.methods.common.cache import cache_key, cache_target
 from cmip6_downscaling.methods.common.containers import RunParameters
-from cmip6_downscaling.methods.common.utils import blocking_to_zarr, is_cached
+from cmip6_downscaling.methods.common.utils import (
+    blocking_to_zarr,
+    is_cached,
+    write_completion_manifest,
+)
 from cmip6_downscaling.methods.maca import core as maca_core
+from cmip6_downscaling.methods.maca.regions import extract_region, get_regions
 from cmip6_downscaling.methods.maca.utils import (
+    RegionStores,
+    block_slices,
     initialize_out_store,
     make_regions_mask,
     merge_block_to_zarr,
 )
-from cmip6_downscaling.utils import str_to_hash
 
 intermediate_dir = UPath(config.get("storage.intermediate.uri")) / version
 results_dir = UPath(config.get("storage.results.uri")) / version
 use_cache = config.get('run_options.use_cache')
 
 
+def _bias_correct(x_ds: xr.Dataset, y_ds: xr.Dataset, variable: str) -> xr.Dataset:
+    """Lazy MACA bias correction of `x_ds` against `y_ds`, block by block in space"""
+    x_ds = x_ds.chunk({'time': -1})
+    y_ds = y_ds.chunk({'time': -1})
+    return xr.map_blocks(
+        maca_core.bias_correction,
+        x_ds,
+        args=(y_ds.rename({'time': 't2'}),),
+        # dask already runs the blocks in parallel, so each block gets a small thread pool, if any
+        kwargs=dict(variables=[variable], n_workers=config.get('maca_bias_correction.n_workers')),
+        template=x_ds,
+    )
+
+
 @task(log_stdout=True)
 def bias_correction(x_path: UPath, y_path: UPath, run_parameters: RunParameters) -> UPath:
     """
@@ -45,24 +66,19 @@ def bias_correction(x_path: UPath, y_path: UPath, run_parameters: RunParameters)
     target : UPath
     """
 
-    ds_hash = str_to_hash(str(x_path) + str(y_path))
-    target = intermediate_dir / 'bias_correction' / ds_hash
+    target = cache_target(
+        intermediate_dir,
+        'bias_correction',
+        x_path=x_path,
+        y_path=y_path,
+        variable=run_parameters.variable,
+    )
 
     if use_cache and is_cached(target):
         print(f"found existing target: {target}")
         return target
 
-    x_ds = xr.open_zarr(x_path).chunk({'time': -1})
-    y_ds = xr.open_zarr(y_path).chunk({'time': -1})
-
-    bc_ds = xr.map_blocks(
-        maca_core.bias_correction,
-        x_ds,
-        args=(y_ds.rename({'time': 't2'}),),
-        kwargs=dict(variables=[run_parameters.variable]),
-        template=x_ds,
-    )
-
+    bc_ds = _bias_correct(xr.open_zarr(x_path), xr.open_zarr(y_path), run_parameters.variable)
     bc_ds.attrs.update({'title': 'bias_correction'}, **get_cf_global_attrs(version=version))
 
     blocking_to_zarr(ds=bc_ds, target=target, validate=True, write_empty_chunks=True)
@@ -103,7 +119,15 @@ def epoch_trend(
 
     # TODO: figure out how this task should differ for ['pr', 'huss', 'vas', 'uas']
 
-    ds_hash = str_to_hash(str(data_path) + run_parameters.run_id_hash)
+    ds_hash = cache_key(
+        'epoch_trend',
+        code_version=1,
+        data_path=data_path,
+        train_period=run_parameters.train_period,
+        predict_period=run_parameters.predict_period,
+        day_rolling_window=run_parameters.day_rolling_window,
+        year_rolling_window=run_parameters.year_rolling_window,
+    )
     trend_target = intermediate_dir / 'epoch_trend' / ds_hash
     detrend_target = intermediate_dir / 'epoch_detrend' / ds_hash
 
@@ -124,28 +148,30 @@ def epoch_trend(
     elif train_end > predict_start:
         predict_start = train_end + 1
 
-    ds_gcm_full_time = xr.open_zarr(data_path).load()
+    # the trend only needs the full time series of each pixel, so it is computed one spatial block
+    # at a time and the blocks run in parallel
+    ds_gcm_full_time = xr.open_zarr(data_path).chunk({'time': -1, 'lat': 48, 'lon': 48})
+    for key in ds_gcm_full_time.variables:
+        ds_gcm_full_time[key].encoding = {}
 
     # note that this is the non-buffered slice
-    # TODO: this could probably be sped up with map_blocks
     historical_period = run_parameters.train_period.time_slice
-    trend = maca_core.epoch_trend(
-        data=ds_gcm_full_time,
-        historical_period=historical_period,
-        day_rolling_window=run_parameters.day_rolling_window,
-        year_rolling_window=run_parameters.year_rolling_window,
+    trend = xr.map_blocks(
+        maca_core.epoch_trend,
+        ds_gcm_full_time,
+        kwargs=dict(
+            historical_period=historical_period,
+            day_rolling_window=run_parameters.day_rolling_window,
+            year_rolling_window=run_parameters.year_rolling_window,
+        ),
+        template=ds_gcm_full_time,
     )
-
-    if 'dayofyear' in trend.variables:
-        trend = trend.drop('dayofyear')
-
-    trend = trend.chunk({'lat': 48, 'lon': 48})
     trend.attrs.update({'title': 'epoch_trend'}, **get_cf_global_attrs(version=version))
 
     blocking_to_zarr(ds=trend, target=trend_target, validate=True, write_empty_chunks=True)
 
-    detrended_data = ds_gcm_full_time - trend
-    detrended_data = detrended_data.chunk({'time': -1, 'lat': 48, 'lon': 48})
+    # read the trend back instead of recomputing it
+    detrended_data = ds_gcm_full_time - xr.open_zarr(trend_target)
 
     detrended_data.attrs.update(
         {'title': 'epoch_trend - detrended'}, **get_cf_global_attrs(version=version)
@@ -163,6 +189,8 @@ def construct_analogs(
     coarse_obs_path: UPath,
     fine_obs_path: UPath,
     run_parameters: RunParameters,
+    region: int = None,
+    region_def: str = 'ar6.land',
 ) -> UPath:
     """
     MACA analog construction
@@ -177,16 +205,29 @@ def construct_analogs(
         Path to fine obs dataset
     run_parameters : RunParameters
         Downscaling run parameter container
+    region : int, optional
+        Region key. If set, the inputs are full datasets and the region is extracted from them
+        lazily (see `extract_region`) instead of being written out by `split_by_region` first.
+    region_def : str, optional
+        Regionmask key, by default `ar6.land`
 
     Returns
     -------
     target : UPath
     """
 
-    ds_hash = str_to_hash(
-        str(gcm_path) + str(coarse_obs_path) + str(fine_obs_path) + run_parameters.run_id_hash
+    region_kwargs = {} if region is None else {'region': region, 'region_def': region_def}
+    target = cache_target(
+        intermediate_dir,
+        'construct_analogs',
+        gcm_path=gcm_path,
+        coarse_obs_path=coarse_obs_path,
+        fine_obs_path=fine_obs_path,
+        variable=run_parameters.variable,
+        **region_kwargs,
+        # analog days are matched by noleap day of year, which changes results in leap years
+        code_version=1,
     )
-    target = intermediate_dir / 'construct_analogs' / ds_hash
 
     if use_cache and is_cached(target):
         print(f"found existing target: {target}")
@@ -199,6 +240,13 @@ def construct_analogs(
         ds_obs_coarse = xr.open_zarr(coarse_obs_path)
         ds_obs_fine = xr.open_zarr(fine_obs_path)
 
+        if region is not None:
+            ds_gcm = extract_region(ds_gcm, region, region_def)
+            ds_obs_coarse = extract_region(ds_obs_coarse, region, region_def)
+            ds_obs_fine = extract_region(ds_obs_fine, region, region_def)
+            # same title as the stores written by split_by_region
+            ds_gcm.attrs['title'] = f'region {region}'
+
         analogs = maca_core.construct_analogs(
             ds_gcm, ds_obs_coarse, ds_obs_fine, run_parameters.variable
         )
@@ -213,20 +261,9 @@ def construct_analogs(
     return target
 
 
-def _get_regions(region_def):
-    """helper function to extract regionmaks regions"""
-
-    if region_def == 'ar6.land':
-        regions = regionmask.defined_regions.ar6.land
-    else:
-        regions = getattr(regionmask.defined_regions, region_def)
-
-    return regions
-
-
 @task(log_stdout=True)
 def get_region_numbers(region_def: str = 'ar6.land'):
-    regions = _get_regions(region_def)
+    regions = get_regions(region_def)
     return regions.numbers[:-2]  # drop antarctica
 
 
@@ -253,12 +290,12 @@ def split_by_region(region: int, data_path: UPath, region_def: str = 'ar6.land')
     combine_regions
     """
 
-    regions = _get_regions(region_def)
-
-    target = (
-        intermediate_dir
-        / 'split_by_region'
-        / str_to_hash(str(data_path) + region_def + str(region))
+    target = cache_target(
+        intermediate_dir,
+        'split_by_region',
+        region=region,
+        data_path=data_path,
+        region_def=region_def,
     )
 
     if use_cache and is_cached(target):
@@ -268,8 +305,7 @@ def split_by_region(region: int, data_path: UPath, region_def: str = 'ar6.land')
     ds = xr.open_zarr(data_path)
 
     with dask.config.set(**{'array.slicing.split_large_chunks': False}):
-        mask = regions.mask(ds)
-        ds_region = ds.where(mask == region, drop=True)
+        ds_region = extract_region(ds, region, region_def)
         ds_region = ds_region.chunk({'lat': -1, 'lon': -1, 'time': 365})
     ds_region.attrs.update({'title': f'region {region}'}, **get_cf_global_attrs(version=version))
     blocking_to_zarr(ds=ds_region, target=target, validate=True, write_empty_chunks=True)
@@ -304,10 +340,12 @@ def combine_regions(
     split_by_region
     """
 
-    target = (
-        results_dir
-        / 'combine_regions'
-        / str_to_hash(str(regions) + str(region_paths) + str(template_path))
+    target = cache_target(
+        results_dir,
+        'combine_regions',
+        regions=regions,
+        region_paths=region_paths,
+        template_path=template_path,
     )
 
     if use_cache and is_cached(target):
@@ -316,41 +354,48 @@ def combine_regions(
 
     n_chunk_per_block = 4
     chunk_size = 48
+    write_empty_chunks = config.get('combine_regions.write_empty_chunks')
 
     out_time_index = xr.open_zarr(region_paths[0]).time.values
-    template = initialize_out_store(template_path, target, out_time_index, chunk_size=chunk_size)
+    template = initialize_out_store(
+        template_path,
+        target,
+        out_time_index,
+        chunk_size=chunk_size,
+        write_empty_chunks=write_empty_chunks,
+    )
 
-    mask = make_regions_mask(template.isel(time=0), chunk_size=chunk_size)
+    mask = make_regions_mask(template.isel(time=0), chunk_size=chunk_size).load()
 
-    region_paths_dict = dict(zip(regions, region_paths))
+    region_stores = RegionStores(
+        dict(zip(regions, region_paths)), maxsize=config.get('combine_regions.max_open_stores')
+    )
 
+    # blocks are made of whole output chunks, so they can be written concurrently
     block_size = chunk_size * n_chunk_per_block
-    # Iterate over chunks and merge pieces within each chunk
-    total = []
-    for ilon in range(0, mask.sizes['lon'], block_size):
-        if ilon <= mask.sizes['lon'] - block_size:
-            xslice = slice(ilon, ilon + block_size)
-        else:
-            xslice = slice(ilon, mask.sizes['lon'])
-        for ilat in range(0, mask.sizes['lat'], block_size):
-            if ilat <= mask.sizes['lat'] - block_size:
-                yslice = slice(ilat, ilat + block_size)
-            else:
-                yslice = slice(ilat, mask.sizes['lat'])
-            total.append(
-                merge_block_to_zarr(
-                    mask.isel(lon=xslice, lat=yslice),
-                    template.isel(lon=xslice, lat=yslice),
-                    region_paths_dict,
-                    target,
-                    xslice=xslice,
-                    yslice=yslice,
-                )
-            )
-    # TODO: merge_block_to_zarr was originally design to be a dask.delayed function
-    # But this wasn't playing nice with dask+prefect.
-    # result = dask.compute(*total, scheduler='threads')
+    blocks = [
+        (xslice, yslice)
+        for xslice in block_slices(mask.sizes['lon'], block_size)
+        for yslice in block_slices(mask.sizes['lat'], block_size)
+    ]
+
+    def _merge(slices):
+        xslice, yslice = slices
+        return merge_block_to_zarr(
+            mask.isel(lon=xslice, lat=yslice),
+            template.isel(lon=xslice, lat=yslice),
+            region_stores,
+            target,
+            xslice=xslice,
+            yslice=yslice,
+            write_empty_chunks=write_empty_chunks,
+        )
+
+    with ThreadPoolExecutor(max_workers=config.get('combine_regions.n_workers')) as pool:
+        list(pool.map(_merge, blocks))
+
     zarr.consolidate_metadata(target)
+    write_completion_manifest(target, allow_empty_chunks=not write_empty_chunks)
     return target
 
 
@@ -375,7 +420,9 @@ def replace_epoch_trend(analogs_path: UPath, trend_path: UPath) -> UPath:
     epoch_trend
     """
 
-    target = results_dir / 'replace_epoch_trend' / str_to_hash(str(analogs_path) + str(trend_path))
+    target = cache_target(
+        results_dir, 'replace_epoch_trend', analogs_path=analogs_path, trend_path=trend_path
+    )
 
     if use_cache and is_cached(target):
         print(f"found existing target: {target}")
@@ -392,3 +439,59 @@ def replace_epoch_trend(analogs_path: UPath, trend_path: UPath) -> UPath:
     blocking_to_zarr(ds=downscaled, target=target, validate=True, write_empty_chunks=True)
 
     return target
+
+
+@task(log_stdout=True)
+def replace_epoch_trend_and_bias_correct(
+    analogs_path: UPath, trend_path: UPath, y_path: UPath, run_parameters: RunParameters
+) -> UPath:
+    """
+    Replace epoch trend and bias correct the result in a single pass
+
+    Same output as ``bias_correction(replace_epoch_trend(analogs_path, trend_path), y_path)``, but
+    the trend is added to the analogs lazily and each spatial block goes straight into the bias
+    correction, so the epoch replaced data is never written nor read back.
+
+    Parameters
+    ----------
+    analogs_path : UPath
+        Path to constructed analogs
+    trend_path : UPath
+        Path to trend dataset, chunked like the analogs
+    y_path : UPath
+        Path to target dataset
+    run_parameters : RunParameters
+        Downscaling run parameter container
+
+    Returns
+    -------
+    target : UPath
+
+    See also
+    --------
+    replace_epoch_trend
+    bias_correction
+    """
+
+    target = cache_target(
+        results_dir,
+        'replace_epoch_trend_and_bias_correct',
+        analogs_path=analogs_path,
+        trend_path=trend_path,
+        y_path=y_path,
+        variable=run_parameters.variable,
+    )
+
+    if use_cache and is_cached(target):
+        print(f"found existing target: {target}")
+        return target
+
+    downscaled = xr.open_zarr(analogs_path) + xr.open_zarr(trend_path)
+    bc_ds = _bias_correct(downscaled, xr.open_zarr(y_path), run_parameters.variable)
+
+    bc_ds.attrs.update(
+        {'title': 'replace_epoch_trend_and_bias_correct'}, **get_cf_global_attrs(version=version)
+    )
+    blocking_to_zarr(ds=bc_ds, target=target, validate=True, write_empty_chunks=True)
+
+    return target
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
+import threading
+from collections import OrderedDict
+
 import dask
 import numpy as np
 import pandas as pd
-import regionmask
 import xarray as xr
 from carbonplan_data.metadata import get_cf_global_attrs
 from upath import UPath
 
 from ... import __version__ as version
+from .regions import get_region_index
 
 
 def add_circular_temporal_pad(data: xr.Dataset, offset: int, timeunit: str = 'D') -> xr.Dataset:
@@ -152,7 +155,11 @@ def generate_batches(
 
 
 def initialize_out_store(
-    template_path: UPath, out_path: str, time_index: xr.DataArray, chunk_size: int = 48
+    template_path: UPath,
+    out_path: str,
+    time_index: xr.DataArray,
+    chunk_size: int = 48,
+    write_empty_chunks: bool = True,
 ) -> xr.Dataset:
     """Write the empty zarr store where you'll write your final outputs chunk-by-chunk.
 
@@ -166,6 +173,9 @@ def initialize_out_store(
         Time index to apply to the output store
     chunk_size : int, optional
         Length and width of chunk size spatially (will be full time), by default 48
+    write_empty_chunks : bool, optional
+        Whether chunks that are entirely missing are written, by default True. Otherwise they are
+        left out of the store and read back as missing values.
 
     Returns
     -------
@@ -178,7 +188,7 @@ def initialize_out_store(
     template.attrs.update({'title': 'combine_regions'}, **get_cf_global_attrs(version=version))
 
     for v in template.data_vars:
-        template[v].encoding['write_empty_chunks'] = True
+        template[v].encoding['write_empty_chunks'] = write_empty_chunks
 
     template.to_zarr(
         out_path,
@@ -203,67 +213,113 @@ def make_regions_mask(template_one_timeslice: xr.DataArray, chunk_size=48) -> xr
     xr.Dataset
         Integer mask with pixels numbered according to each region number.
     """
-    mask = (
-        regionmask.defined_regions.ar6.land.mask(template_one_timeslice).fillna(46).astype(np.byte)
-    )
+    mask = get_region_index(template_one_timeslice).mask.fillna(46).astype(np.byte)
     mask = mask.chunk({'lon': chunk_size, 'lat': chunk_size})
     return mask
 
 
-# @dask.delayed
+class RegionStores:
+    """Least recently used cache of open region datasets, safe to share between threads.
+
+    Parameters
+    ----------
+    paths : dict
+        Mapping of region key to region path
+    maxsize : int, optional
+        Maximum number of datasets kept open, by default 32
+    """
+
+    def __init__(self, paths: dict[int, UPath], maxsize: int = 32):
+        self.paths = paths
+        self.maxsize = maxsize
+        self._datasets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, region) -> bool:
+        return region in self.paths
+
+    def __getitem__(self, region) -> xr.Dataset:
+        with self._lock:
+            if region in self._datasets:
+                self._datasets.move_to_end(region)
+                return self._datasets[region]
+        ds = xr.open_zarr(self.paths[region])
+        with self._lock:
+            self._datasets[region] = ds
+            self._datasets.move_to_end(region)
+            while len(self._datasets) > self.maxsize:
+                self._datasets.popitem(last=False)
+        return ds
+
+
+def block_slices(n: int, block_size: int) -> list[slice]:
+    """Consecutive slices of `block_size` elements covering ``range(n)`` (the last one may be
+    shorter)"""
+    return [slice(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+
+
 def merge_block_to_zarr(
     mask: xr.DataArray,
     template: xr.Dataset,
-    split_region_paths: dict[int, UPath],
+    region_stores: dict[int, xr.Dataset] | RegionStores,
     out_path: UPath,
     *,
     xslice: slice,
     yslice: slice,
+    write_empty_chunks: bool = True,
 ):
     """
     Find ar6 regions in each block, merge and reindex, write to zarr
 
+    Blocks must be aligned with the chunks of the output store, so that blocks can be written
+    concurrently.
+
     Parameters
     ----------
     mask : xr.DataArray
         Integer mask to determine which region to pull data from
     template : xr.Dataset
         Dataset defining the target schema
-    split_region_paths : dict
-        Mapping of region key to region path
+    region_stores : dict or RegionStores
+        Mapping of region key to region dataset
     out_path : UPath
         Target dataset path
     xslice : slice
         Latitude slice
     yslice : slice
         Longitude slice
+    write_empty_chunks : bool, optional
+        Whether chunks without any data are written, by default True. When False, blocks without
+        any region are skipped and the chunks of the other blocks that are entirely missing are
+        left out of the store, so they read back as missing values.
 
     """
     print(xslice, yslice)
 
     components = pd.unique(mask.values.ravel())
-    components = [c for c in components if c in split_region_paths]
+    components = [c for c in components if c in region_stores]
     if len(components) > 0:
         with dask.config.set(**{'array.slicing.split_large_chunks': False}):
             merged = (
                 xr.merge(
-                    xr.open_zarr(split_region_paths[ind])
-                    .where(mask.isin(ind), drop=True)
-                    .sortby(["lon", "lat"])
+                    region_stores[ind].where(mask.isin(ind), drop=True).sortby(["lon", "lat"])
                     for ind in components
                 )
                 .reindex_like(template)
                 .sortby("lat", ascending=True)
             ).load()
 
-        for variable in merged.data_vars:
-            merged[variable].encoding['write_empty_chunks'] = True
-
+        # region writes go to existing arrays, so the encoding of `merged` isn't used; metadata
+        # is consolidated once all blocks are written
         merged.drop(['lat', 'lon', 'time']).to_zarr(
             out_path,
             region={'lat': yslice, 'lon': xslice, 'time': slice(0, merged.sizes['time'])},
             mode="r+",
+            consolidated=False,
+            write_empty_chunks=write_empty_chunks,
         )
+    elif not write_empty_chunks:
+        print('skipping empty block')
     else:
         print('writing blank')
         template.drop(['lat', 'lon', 'time']).to_zarr(
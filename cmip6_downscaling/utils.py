@@ -12,6 +12,20 @@ def str_to_hash(s: str) -> str:
     return blake2b(s.encode(), digest_size=8).hexdigest()
 
 
+def version_tag(info: dict) -> str | None:
+    """Version tag (ETag, falling back to the modification time) from an ``fsspec`` info dict
+
+    Returns
+    -------
+    tag : str or None
+        None if the filesystem reports neither
+    """
+    for key in ['etag', 'ETag', 'last_modified', 'LastModified', 'mtime']:
+        if info.get(key) is not None:
+            return str(info[key])
+    return None
+
+
 def write(ds: xr.Dataset | datatree.DataTree, target, use_cache: bool = True) -> str:
 
     from .methods.common.utils import zmetadata_exists
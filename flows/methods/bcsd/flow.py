@@ -73,9 +73,10 @@ with Flow(
     # input datasets
     p['obs_path'] = get_obs(run_parameters)
 
-    p['obs_full_space_path'] = rechunk(path=p['obs_path'], pattern='full_space')
-    p['experiment_train_path'] = get_experiment(run_parameters, time_subset='train_period')
-    p['experiment_predict_path'] = get_experiment(run_parameters, time_subset='predict_period')
+    p['obs_full_space_path'] = rechunk(path=p['obs_path'], pattern='full_space', engine='auto')
+    p['experiment_train_path'] = get_experiment(
+        run_parameters, time_subset='train_period', pattern='full_time'
+    )
 
     # after regridding coarse_obs will have smaller array size in space but still
     # be chunked finely along time. but that's good to get it for regridding back to
@@ -93,23 +94,25 @@ with Flow(
     )
 
     p['interpolated_obs_full_time_path'] = rechunk(
-        path=p['interpolated_obs_path'], pattern="full_time"
+        path=p['interpolated_obs_path'], pattern="full_time", engine='auto'
     )
-    p['obs_full_time_path'] = rechunk(path=p['obs_path'], pattern="full_time")
+    p['obs_full_time_path'] = rechunk(path=p['obs_path'], pattern="full_time", engine='auto')
     p['spatial_anomalies_path'] = spatial_anomalies(
         p['obs_full_time_path'], p['interpolated_obs_full_time_path']
     )
-    p['coarse_obs_full_time_path'] = rechunk(p['coarse_obs_path'], pattern='full_time')
-    p['experiment_train_full_time_path'] = rechunk(p['experiment_train_path'], pattern='full_time')
-
-    p['experiment_predict_full_time_path'] = rechunk(
-        p['experiment_predict_path'],
+    p['coarse_obs_full_time_path'] = rechunk(
+        p['coarse_obs_path'], pattern='full_time', engine='auto'
+    )
+    # the gcm data is read in full time, as bias correction needs it
+    p['experiment_predict_path'] = get_experiment(
+        run_parameters,
+        time_subset='predict_period',
         pattern='full_time',
         template=p['coarse_obs_full_time_path'],
     )
     p['bias_corrected_path'] = fit_and_predict(
-        experiment_train_full_time_path=p['experiment_train_full_time_path'],
-        experiment_predict_full_time_path=p['experiment_predict_full_time_path'],
+        experiment_train_full_time_path=p['experiment_train_path'],
+        experiment_predict_full_time_path=p['experiment_predict_path'],
         coarse_obs_full_time_path=p['coarse_obs_full_time_path'],
         run_parameters=run_parameters,
     )
@@ -117,6 +120,7 @@ with Flow(
         p['bias_corrected_path'],
         pattern='full_space',
         template=p['obs_full_space_path'],
+        engine='auto',
     )
     p['bias_corrected_fine_full_space_path'] = regrid(
         source_path=p['bias_corrected_full_space_path'],
@@ -128,6 +132,7 @@ with Flow(
         p['bias_corrected_fine_full_space_path'],
         pattern='full_time',
         template=p['obs_full_time_path'],
+        engine='auto',
     )
     p['final_bcsd_full_time_path'] = postprocess_bcsd(
         p['bias_corrected_fine_full_time_path'], p['spatial_anomalies_path']
@@ -144,11 +149,17 @@ with Flow(
     # space before passing into pyramid step. we probably want to add a cleanup
     # to this step in particular since otherwise we will have an exact
     # duplicate of the daily, monthly, and annual datasets
-    p['final_bcsd_full_space_path'] = rechunk(p['final_bcsd_full_time_path'], pattern='full_space')
+    p['final_bcsd_full_space_path'] = rechunk(
+        p['final_bcsd_full_time_path'], pattern='full_space', engine='auto'
+    )
 
     # make temporal summaries
-    p['monthly_summary_full_space_path'] = rechunk(p['monthly_summary_path'], pattern='full_space')
-    p['annual_summary_full_space_path'] = rechunk(p['annual_summary_path'], pattern='full_space')
+    p['monthly_summary_full_space_path'] = rechunk(
+        p['monthly_summary_path'], pattern='full_space', engine='auto'
+    )
+    p['annual_summary_full_space_path'] = rechunk(
+        p['annual_summary_path'], pattern='full_space', engine='auto'
+    )
 
     # pyramids
 
@@ -50,12 +50,12 @@ with Flow(
     )
     p = {}
     p['obs_path'] = get_obs(run_parameters)
-    p['obs_full_space_path'] = rechunk(path=p['obs_path'], pattern='full_space')
+    p['obs_full_space_path'] = rechunk(path=p['obs_path'], pattern='full_space', engine='auto')
     p['shifted_obs_full_space_path'] = shift(
         path=p['obs_full_space_path'], path_type='obs', run_parameters=run_parameters
     )
     p['shifted_obs_full_time_path'] = rechunk(
-        path=p['shifted_obs_full_space_path'], pattern='full_time'
+        path=p['shifted_obs_full_space_path'], pattern='full_time', engine='auto'
     )
 
     # # Tasks for running inference on ERA5
@@ -74,8 +74,13 @@ with Flow(
     # )
 
     # Tasks for running inference on gcm
-    p['experiment_train_path'] = get_experiment(run_parameters, time_subset='train_period')
-    p['experiment_predict_path'] = get_experiment(run_parameters, time_subset='predict_period')
+    # shift interpolates in space, so the gcm data is read in full space
+    p['experiment_train_path'] = get_experiment(
+        run_parameters, time_subset='train_period', pattern='full_space'
+    )
+    p['experiment_predict_path'] = get_experiment(
+        run_parameters, time_subset='predict_period', pattern='full_space'
+    )
     p['shifted_experiment_predict_path'] = shift(
         path=p['experiment_predict_path'], path_type='gcm', run_parameters=run_parameters
     )
@@ -95,6 +100,7 @@ with Flow(
         path=p['normalized_shifted_model_output_path'],
         pattern='full_time',
         template=p['shifted_obs_full_time_path'],
+        engine='auto',
     )
     p['shifted_model_output_path'] = rescale(
         source_path=p['normalized_shifted_model_output_full_time_path'],
@@ -147,17 +153,17 @@ with Flow(
 
         # make temporal summaries
         p['bias_corrected_monthly_summary_full_space_path'] = rechunk(
-            p['bias_corrected_monthly_summary_path'], pattern='full_space'
+            p['bias_corrected_monthly_summary_path'], pattern='full_space', engine='auto'
         )
         p['bias_corrected_annual_summary_full_space_path'] = rechunk(
-            p['bias_corrected_annual_summary_path'], pattern='full_space'
+            p['bias_corrected_annual_summary_path'], pattern='full_space', engine='auto'
         )
 
         p['raw_monthly_summary_full_space_path'] = rechunk(
-            p['raw_monthly_summary_path'], pattern='full_space'
+            p['raw_monthly_summary_path'], pattern='full_space', engine='auto'
         )
         p['raw_annual_summary_full_space_path'] = rechunk(
-            p['raw_annual_summary_path'], pattern='full_space'
+            p['raw_annual_summary_path'], pattern='full_space', engine='auto'
         )
         # Add attrs from rescaled product to bias corrected product
         p['bias_corrected_monthly_summary_full_space_path'] = update_var_attrs(
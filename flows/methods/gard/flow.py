@@ -18,7 +18,7 @@ from cmip6_downscaling.methods.common.tasks import (
     regrid,
     time_summary,
 )
-from cmip6_downscaling.methods.gard.tasks import coarsen_and_interpolate, fit_and_predict, read_scrf
+from cmip6_downscaling.methods.gard.tasks import coarsen_and_interpolate, fit_and_predict
 
 xr.set_options(keep_attrs=True)
 config.set({'run_options.use_cache': False})
@@ -67,10 +67,16 @@ with Flow(
 
     # input datasets
     p['obs_path'] = get_obs(run_parameters)
-    p['obs_full_space_path'] = rechunk(path=p['obs_path'], pattern='full_space')
-    p['obs_full_time_path'] = rechunk(path=p['obs_path'], pattern='full_time')
+    p['obs_full_space_path'] = rechunk(path=p['obs_path'], pattern='full_space', engine='auto')
+    p['obs_full_time_path'] = rechunk(path=p['obs_path'], pattern='full_time', engine='auto')
     p['experiment_train_path'] = get_experiment(run_parameters, time_subset='train_period')
-    p['experiment_predict_path'] = get_experiment(run_parameters, time_subset='predict_period')
+    # the prediction data is read in full space, ready for interpolation
+    p['experiment_predict_path'] = get_experiment(
+        run_parameters,
+        time_subset='predict_period',
+        pattern='full_space',
+        template=p['obs_full_space_path'],
+    )
 
     # after regridding coarse_obs will have smaller array size in space but still
     # be chunked finely along time. but that's good to get it for regridding back to
@@ -82,17 +88,12 @@ with Flow(
 
     # just allow the interpolated obs full time rechunking determine the size of the subsequent full-time chunking routines
     p['interpolated_obs_full_time_path'] = rechunk(
-        p['interpolated_obs_full_space_path'], pattern='full_time'
-    )
-
-    # get gcm data into full space to prep for interpolation
-    p['experiment_predict_full_space_path'] = rechunk(
-        p['experiment_predict_path'], pattern="full_space", template=p['obs_full_space_path']
+        p['interpolated_obs_full_space_path'], pattern='full_time', engine='auto'
     )
 
     # interpolate gcm to finescale. it will retain the same temporal chunking pattern (likely 25 timesteps)
     p['experiment_predict_fine_full_space_path'] = regrid(
-        source_path=p['experiment_predict_full_space_path'],
+        source_path=p['experiment_predict_path'],
         target_grid_path=p['obs_path'],
         weights_path=None,
     )
@@ -100,21 +101,14 @@ with Flow(
         p['experiment_predict_fine_full_space_path'],
         pattern="full_time",
         template=p['interpolated_obs_full_time_path'],
+        engine='auto',
     )
 
-    p['scrf_path'] = read_scrf(p['experiment_predict_fine_full_time_path'], run_parameters)
-
-    p['scrf_full_time_path'] = rechunk(
-        p['scrf_path'],
-        pattern="full_time",
-        template=p['experiment_predict_fine_full_time_path'],
-    )
-
+    # the random fields are read straight from the SCRF library, aligned with the prediction data
     p['model_output_path'] = fit_and_predict(
         xtrain_path=p['interpolated_obs_full_time_path'],
         ytrain_path=p['obs_full_time_path'],
         xpred_path=p['experiment_predict_fine_full_time_path'],
-        scrf_path=p['scrf_full_time_path'],
         run_parameters=run_parameters,
     )
 
@@ -131,14 +125,16 @@ with Flow(
         # space before passing into pyramid step. we probably want to add a cleanup
         # to this step in particular since otherwise we will have an exact
         # duplicate of the daily, monthly, and annual datasets
-        p['full_space_model_output_path'] = rechunk(p['model_output_path'], pattern='full_space')
+        p['full_space_model_output_path'] = rechunk(
+            p['model_output_path'], pattern='full_space', engine='auto'
+        )
 
         # make temporal summaries
         p['monthly_summary_full_space_path'] = rechunk(
-            p['monthly_summary_path'], pattern='full_space'
+            p['monthly_summary_path'], pattern='full_space', engine='auto'
         )
         p['annual_summary_full_space_path'] = rechunk(
-            p['annual_summary_path'], pattern='full_space'
+            p['annual_summary_path'], pattern='full_space', engine='auto'
         )
 
         # pyramids
@@ -21,6 +21,7 @@ from cmip6_downscaling.methods.maca.tasks import (
     epoch_trend,
     get_region_numbers,
     replace_epoch_trend,
+    replace_epoch_trend_and_bias_correct,
     split_by_region,
 )
 
@@ -65,10 +66,13 @@ with Flow(
 
     # get original resolution observations
     p['obs_path'] = get_obs(run_parameters)
-    p['obs_full_time_path'] = rechunk(path=p['obs_path'], pattern='full_time')
+    p['obs_full_time_path'] = rechunk(path=p['obs_path'], pattern='full_time', engine='auto')
 
-    p['obs_full_space_path'] = rechunk(path=p['obs_path'], pattern='full_space')
-    p['experiment_path'] = get_experiment(run_parameters, time_subset='both')
+    p['obs_full_space_path'] = rechunk(path=p['obs_path'], pattern='full_space', engine='auto')
+    # chunked like epoch_trend reads it
+    p['experiment_path'] = get_experiment(
+        run_parameters, time_subset='both', chunks={'time': -1, 'lat': 48, 'lon': 48}
+    )
 
     # get coarsened resolution observations
     # this coarse obs is going to be used in bias correction next, so rechunk into full time first
@@ -84,7 +88,7 @@ with Flow(
     )
 
     p['coarse_epoch_trend_full_space_path'] = rechunk(
-        p['coarse_epoch_trend_path'], pattern='full_space'
+        p['coarse_epoch_trend_path'], pattern='full_space', engine='auto'
     )
 
     p['fine_epoch_trend_full_space_path'] = regrid(
@@ -95,13 +99,12 @@ with Flow(
     )
 
     p['coarse_obs_full_time_path'] = rechunk(
-        p['coarse_obs_full_space_path'], pattern='full_time', template=p['detrended_data_path']
+        p['coarse_obs_full_space_path'],
+        pattern='full_time',
+        template=p['detrended_data_path'],
+        engine='auto',
     )
 
-    # get gcm
-    # 1981-2100 extent time subset
-    p['experiment_predict_full_time_path'] = rechunk(p['experiment_path'], pattern='full_time')
-
     ## Step 3: Coarse Bias Correction
     # rechunk to make detrended data match the coarse obs
     p['detrend_gcm_full_time'] = rechunk(
@@ -109,6 +112,7 @@ with Flow(
         template=p[
             'coarse_obs_full_time_path'
         ],  # this is not working. time is chunked to match coarse obs
+        engine='auto',
     )
 
     # inputs should be in full-time
@@ -125,26 +129,35 @@ with Flow(
 
     p['region_numbers'] = get_region_numbers()
 
-    p['bias_corrected_gcm_region_paths'] = split_by_region.map(
-        p['region_numbers'], unmapped(p['bias_corrected_gcm_full_time_path'])
-    )
-    p['coarse_obs_region_paths'] = split_by_region.map(
-        p['region_numbers'], unmapped(p['coarse_obs_full_time_path'])
-    )
-    p['obs_region_paths'] = split_by_region.map(
-        p['region_numbers'], unmapped(p['obs_full_time_path'])
-    )
-
     # Step 4: Constructed Analogs
     # Note: This is option was added to allow this step to be run on the local executor while the rest of the steps can be run with
     # The dask executor
     if config.get('run_options.construct_analogs'):
-        p['constructed_analogs_region_paths'] = construct_analogs.map(
-            gcm_path=p['bias_corrected_gcm_region_paths'],
-            coarse_obs_path=p['coarse_obs_region_paths'],
-            fine_obs_path=p['obs_region_paths'],
-            run_parameters=unmapped(run_parameters),
-        )
+        if config.get('run_options.lazy_region_split'):
+            # regions are extracted inside each analog task, no per-region stores are written
+            p['constructed_analogs_region_paths'] = construct_analogs.map(
+                gcm_path=unmapped(p['bias_corrected_gcm_full_time_path']),
+                coarse_obs_path=unmapped(p['coarse_obs_full_time_path']),
+                fine_obs_path=unmapped(p['obs_full_time_path']),
+                run_parameters=unmapped(run_parameters),
+                region=p['region_numbers'],
+            )
+        else:
+            p['bias_corrected_gcm_region_paths'] = split_by_region.map(
+                p['region_numbers'], unmapped(p['bias_corrected_gcm_full_time_path'])
+            )
+            p['coarse_obs_region_paths'] = split_by_region.map(
+                p['region_numbers'], unmapped(p['coarse_obs_full_time_path'])
+            )
+            p['obs_region_paths'] = split_by_region.map(
+                p['region_numbers'], unmapped(p['obs_full_time_path'])
+            )
+            p['constructed_analogs_region_paths'] = construct_analogs.map(
+                gcm_path=p['bias_corrected_gcm_region_paths'],
+                coarse_obs_path=p['coarse_obs_region_paths'],
+                fine_obs_path=p['obs_region_paths'],
+                run_parameters=unmapped(run_parameters),
+            )
 
         if config.get('run_options.combine_regions'):
 
@@ -158,19 +171,30 @@ with Flow(
                 p['fine_epoch_trend_full_space_path'],
                 pattern='full_time',
                 template=p['combined_analogs_full_time_path'],
+                engine='auto',
             )
 
-            # Step 5: Epoch Replacement
-            p['epoch_replaced_full_time_path'] = replace_epoch_trend(
-                p['combined_analogs_full_time_path'], p['fine_epoch_trend_full_time_path']
-            )
+            if config.get('run_options.fuse_epoch_replacement'):
+                # Steps 5 and 6: Epoch Replacement and Fine Bias Correction, only the bias
+                # corrected output is written
+                p['final_bias_corrected_full_time_path'] = replace_epoch_trend_and_bias_correct(
+                    p['combined_analogs_full_time_path'],
+                    p['fine_epoch_trend_full_time_path'],
+                    p['obs_full_time_path'],
+                    run_parameters=run_parameters,
+                )
+            else:
+                # Step 5: Epoch Replacement
+                p['epoch_replaced_full_time_path'] = replace_epoch_trend(
+                    p['combined_analogs_full_time_path'], p['fine_epoch_trend_full_time_path']
+                )
 
-            # Step 6: Fine Bias Correction
-            p['final_bias_corrected_full_time_path'] = bias_correction(
-                p['epoch_replaced_full_time_path'],
-                p['obs_full_time_path'],
-                run_parameters=run_parameters,
-            )
+                # Step 6: Fine Bias Correction
+                p['final_bias_corrected_full_time_path'] = bias_correction(
+                    p['epoch_replaced_full_time_path'],
+                    p['obs_full_time_path'],
+                    run_parameters=run_parameters,
+                )
 
             # temporary aggregations - these come out in full time
             p['monthly_summary_path'] = time_summary(
@@ -187,10 +211,10 @@ with Flow(
 
                 # make temporal summaries
                 p['monthly_summary_full_space_path'] = rechunk(
-                    p['monthly_summary_path'], pattern='full_space'
+                    p['monthly_summary_path'], pattern='full_space', engine='auto'
                 )
                 p['annual_summary_full_space_path'] = rechunk(
-                    p['annual_summary_path'], pattern='full_space'
+                    p['annual_summary_path'], pattern='full_space', engine='auto'
                 )
 
                 # pyramids
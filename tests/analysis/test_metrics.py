@@ -1,6 +1,8 @@
 import numpy as np
+import pandas as pd
+import xarray as xr
 
-from cmip6_downscaling.analysis.metrics import spell_length_stat
+from cmip6_downscaling.analysis.metrics import daily_climatology, spell_length_stat
 
 
 def test_spell_length_stat():
@@ -14,3 +16,17 @@ def test_spell_length_stat():
     assert spell_length_stat(series) == 2.0
     series = np.array([False, True, True, True, True, False, False, True, False, True, False])
     assert spell_length_stat(series) == 2.0
+
+
+def test_daily_climatology():
+    time = pd.date_range('2001-01-01', '2004-12-31')
+    values = np.random.default_rng(0).normal(size=(len(time), 2))
+    ds = xr.Dataset({'tasmax': (('time', 'x'), values)}, coords={'time': time})
+    climatology = daily_climatology(ds.chunk({'x': 1}), window=1).compute()
+    xr.testing.assert_allclose(
+        climatology.tasmax, ds.tasmax.groupby('time.dayofyear').mean().transpose('x', ...)
+    )
+    smoothed = daily_climatology(ds, window=5)
+    assert smoothed.tasmax.dims == ('x', 'dayofyear')
+    expected = climatology.tasmax.isel(dayofyear=[-2, -1, 0, 1, 2]).mean('dayofyear')
+    np.testing.assert_allclose(smoothed.tasmax.isel(dayofyear=0), expected)
@@ -0,0 +1,105 @@
+import json
+
+import pandas as pd
+import pytest
+
+from cmip6_downscaling import config
+from cmip6_downscaling.data import cmip
+from cmip6_downscaling.data.cmip import load_cmip_catalog, search_cmip_catalog
+
+ESMCAT = {
+    'esmcat_version': '0.1.0',
+    'id': 'test-cmip6',
+    'description': 'test catalog',
+    'catalog_file': 'catalog.csv',
+    'attributes': [],
+    'assets': {'column_name': 'zstore', 'format': 'zarr'},
+    'aggregation_control': {
+        'variable_column_name': 'variable_id',
+        'groupby_attrs': [
+            'activity_id',
+            'institution_id',
+            'source_id',
+            'experiment_id',
+            'table_id',
+            'grid_label',
+        ],
+        'aggregations': [
+            {'type': 'union', 'attribute_name': 'variable_id'},
+            {'type': 'join_new', 'attribute_name': 'member_id', 'options': {'coords': 'minimal'}},
+        ],
+    },
+}
+
+
+def _rows(variables):
+    return pd.DataFrame(
+        [
+            {
+                'activity_id': activity,
+                'institution_id': 'MIROC',
+                'source_id': 'MIROC6',
+                'experiment_id': experiment,
+                'member_id': 'r1i1p1f1',
+                'table_id': 'day',
+                'variable_id': variable,
+                'grid_label': 'gn',
+                'zstore': f'gs://cmip6/{experiment}/{variable}/',
+                'dcpp_init_year': None,
+                'version': 20191016,
+            }
+            for activity, experiment in [('CMIP', 'historical'), ('ScenarioMIP', 'ssp370')]
+            for variable in variables
+        ]
+    )
+
+
+@pytest.fixture
+def catalog_url(tmp_path):
+    (tmp_path / 'remote').mkdir()
+    url = tmp_path / 'remote' / 'catalog.json'
+    url.write_text(json.dumps(ESMCAT))
+    _rows(['tasmax', 'pr']).to_csv(tmp_path / 'remote' / 'catalog.csv', index=False)
+    with config.set(
+        {'data_catalog.cmip.cache_dir': str(tmp_path / 'cache'), 'data_catalog.cmip.ttl': 3600}
+    ):
+        cmip._catalogs.clear()
+        yield str(url)
+    cmip._catalogs.clear()
+
+
+def test_load_cmip_catalog_memoized(catalog_url):
+    catalog = load_cmip_catalog(catalog_url)
+    assert len(catalog['df']) == 4
+    assert load_cmip_catalog(catalog_url) is catalog
+
+    col = search_cmip_catalog(
+        catalog,
+        activity_id='CMIP',
+        experiment_id='historical',
+        member_id='r1i1p1f1',
+        source_id='MIROC6',
+        table_id='day',
+        grid_label='gn',
+        variable_id=['tasmax'],
+    )
+    assert list(col.keys()) == ['CMIP.MIROC.MIROC6.historical.day.gn']
+    assert col.df.zstore.tolist() == ['gs://cmip6/historical/tasmax/']
+
+    col = search_cmip_catalog(catalog, variable_id='pr')
+    assert sorted(col.df.experiment_id) == ['historical', 'ssp370']
+
+
+def test_load_cmip_catalog_revalidates(catalog_url, tmp_path):
+    catalog = load_cmip_catalog(catalog_url)
+    with config.set({'data_catalog.cmip.ttl': 0}):
+        # unchanged remote: the parsed catalog is reused
+        assert load_cmip_catalog(catalog_url) is catalog
+
+        _rows(['tasmax', 'pr', 'tasmin']).to_csv(tmp_path / 'remote' / 'catalog.csv', index=False)
+        assert len(load_cmip_catalog(catalog_url)['df']) == 6
+
+        # offline: fall back to the local snapshot
+        (tmp_path / 'remote' / 'catalog.json').unlink()
+        (tmp_path / 'remote' / 'catalog.csv').unlink()
+        assert len(load_cmip_catalog(catalog_url)['df']) == 6
@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from cmip6_downscaling import config
+from cmip6_downscaling.data import observations
+from cmip6_downscaling.data.observations import MetadataCachingFSStore, open_era5
+
+
+def _write_year(path, year, consolidated=True):
+    time = pd.date_range(f'{year}-01-01', f'{year}-12-31', freq='D')
+    ds = xr.Dataset(
+        {
+            name: (('time', 'lat', 'lon'), np.random.rand(len(time), 3, 4).astype('float32'))
+            for name in ['air_temperature_at_2_metres_1hour_Maximum', 'tasmax']
+        },
+        coords={'time': time, 'lat': [30.0, 20.0, 10.0], 'lon': [0.0, 90.0, 180.0, 270.0]},
+    )
+    ds.chunk({'time': 100}).to_zarr(path, mode='w', consolidated=consolidated)
+    return ds
+
+
+@pytest.mark.parametrize('consolidated', [True, False])
+def test_metadata_caching_store(tmp_path, consolidated):
+    ds = _write_year(tmp_path / 'remote.zarr', 1990, consolidated=consolidated)
+    cache_dir = tmp_path / 'cache'
+    store = MetadataCachingFSStore(str(tmp_path / 'remote.zarr'), cache_dir=str(cache_dir))
+    actual = xr.open_dataset(store, engine='zarr', chunks={}, consolidated=True)
+    xr.testing.assert_identical(actual.load(), ds)
+    assert (cache_dir / '.zmetadata').exists()
+    assert (cache_dir / 'time' / '0').exists()
+    assert not (cache_dir / 'tasmax').exists()
+
+    # metadata and coordinates are served from the local cache from now on
+    for key in ['.zgroup', '.zattrs', 'time/.zarray', 'time/0']:
+        (tmp_path / 'remote.zarr' / key).unlink(missing_ok=True)
+    store = MetadataCachingFSStore(str(tmp_path / 'remote.zarr'), cache_dir=str(cache_dir))
+    actual = xr.open_dataset(store, engine='zarr', chunks={}, consolidated=True)
+    xr.testing.assert_identical(actual.load(), ds)
+
+
+def test_metadata_caching_store_revalidates(tmp_path):
+    remote = tmp_path / 'remote.zarr'
+    _write_year(remote, 1990)
+    cache_dir = tmp_path / 'cache'
+    MetadataCachingFSStore(str(remote), cache_dir=str(cache_dir))
+    assert (cache_dir / '.zmetadata').exists()
+
+    # the remote store is rewritten with another year
+    ds = _write_year(remote, 1992)
+    os.utime(remote / '.zmetadata', (0, 0))
+    store = MetadataCachingFSStore(str(remote), cache_dir=str(cache_dir))
+    actual = xr.open_dataset(store, engine='zarr', chunks={}, consolidated=True)
+    xr.testing.assert_identical(actual.load(), ds)
+
+
+class _Source:
+    def __init__(self, urlpath):
+        self.urlpath = urlpath
+        self.storage_options = {}
+
+
+class _Catalog:
+    def __init__(self, root):
+        self.root = root
+
+    def era5(self, year):
+        return _Source(str(self.root / f'{year}'))
+
+
+def test_open_era5(tmp_path, monkeypatch):
+    expected = [_write_year(tmp_path / f'{year}', year) for year in [1990, 1991, 1992]]
+    monkeypatch.setattr(observations, 'cat', _Catalog(tmp_path))
+    with config.set({'data_catalog.era5.metadata_cache': str(tmp_path / 'cache')}):
+        ds = open_era5('tasmax', slice('1990', '1992'))
+    assert ds.tasmax.chunks[0][:5] == (100, 100, 100, 65, 100)
+    assert ds.lat.values.tolist() == [10.0, 20.0, 30.0]
+    assert ds.lon.values.tolist() == [-180.0, -90.0, 0.0, 90.0]
+    expected = xr.concat([e.tasmax for e in expected], dim='time')
+    np.testing.assert_allclose(ds.tasmax.sum().values, expected.sum().values, rtol=1e-6)
+    # metadata is cached per store url
+    assert len(list((tmp_path / 'cache').iterdir())) == 3
@@ -0,0 +1,47 @@
+import pathlib
+
+import numpy as np
+import xarray as xr
+from upath import UPath
+
+from cmip6_downscaling.methods.common.cache import cache_key, cache_target, store_fingerprint
+from cmip6_downscaling.methods.common.containers import BBox
+
+
+def _write_store(path, val=0.0):
+    ds = xr.Dataset({'air': (('time', 'lat'), np.full((4, 3), val))})
+    ds.to_zarr(path, mode='w', consolidated=True)
+    return path
+
+
+def test_store_fingerprint_ignores_path_spelling(tmp_path):
+    path = _write_store(tmp_path / 'store.zarr')
+    assert store_fingerprint(path) == store_fingerprint(UPath(str(path) + '/'))
+
+
+def test_store_fingerprint_changes_on_rewrite(tmp_path):
+    path = _write_store(tmp_path / 'store.zarr')
+    before = store_fingerprint(path)
+    _write_store(path, val=1.0)
+    assert store_fingerprint(path) != before
+
+
+def test_cache_key_normalizes_parameters():
+    a = cache_key('task', bbox=BBox(-2, 2, 14.5, 18.5), kwargs={'a': 1, 'b': '2'})
+    b = cache_key('task', kwargs={'b': 2, 'a': 1.0}, bbox=BBox('-2', '2', '14.5', '18.5'))
+    assert a == b
+
+
+def test_cache_key_depends_on_parameters_and_version():
+    base = cache_key('regrid', regrid_method='bilinear')
+    assert cache_key('regrid', regrid_method='conservative') != base
+    assert cache_key('regrid', code_version=1, regrid_method='bilinear') != base
+
+
+def test_cache_target(tmp_path):
+    path = _write_store(tmp_path / 'store.zarr')
+    target = cache_target(pathlib.Path('/root'), 'rechunk', path=path, pattern='full_time')
+    assert target.parent == pathlib.Path('/root/rechunk')
+    assert target == cache_target(
+        pathlib.Path('/root'), 'rechunk', pattern='full_time', path=UPath(str(path))
+    )
@@ -0,0 +1,155 @@
+import os
+
+import dask
+import dask.array
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from cmip6_downscaling import config
+from cmip6_downscaling.methods.common import utils
+from cmip6_downscaling.methods.common.utils import (
+    apply_land_mask,
+    clear_land_mask_cache,
+    get_land_mask,
+    land_mask_key,
+    ocean_chunk_report,
+    skip_masked_blocks,
+)
+
+
+def _land(ds):
+    # land in the top left corner and along the last column, ocean everywhere else
+    values = np.zeros((len(ds.lat), len(ds.lon)), dtype=bool)
+    values[:3, :4] = True
+    values[:, -1] = True
+    return xr.DataArray(values, dims=('lat', 'lon'), coords={'lat': ds.lat, 'lon': ds.lon})
+
+
+@pytest.fixture
+def land_mask_cache(tmp_path, monkeypatch):
+    calls = []
+
+    def compute_land_mask(ds):
+        calls.append(1)
+        return _land(ds)
+
+    monkeypatch.setattr(utils, 'compute_land_mask', compute_land_mask)
+    clear_land_mask_cache()
+    with config.set(
+        {
+            'land_mask.uri': str(tmp_path / 'static'),
+            'land_mask.cache_dir': str(tmp_path / 'local'),
+        }
+    ):
+        yield calls
+    clear_land_mask_cache()
+
+
+def _dataset(nlat=8, nlon=10):
+    rng = np.random.default_rng(0)
+    return xr.Dataset(
+        {
+            'tasmax': (('time', 'lat', 'lon'), rng.normal(size=(3, nlat, nlon)).astype('float32')),
+            'elevation': (('lon', 'lat'), rng.normal(size=(nlon, nlat))),
+        },
+        coords={
+            'time': pd.date_range('2000-01-01', periods=3),
+            'lat': np.arange(nlat, dtype=float),
+            'lon': np.arange(nlon, dtype=float),
+        },
+    ).chunk({'time': 1, 'lat': 4, 'lon': 3})
+
+
+def test_land_mask_key():
+    ds = _dataset()
+    assert land_mask_key(ds) == land_mask_key(ds.tasmax.isel(time=0))
+    assert land_mask_key(ds) != land_mask_key(_dataset(nlat=6))
+
+
+def test_get_land_mask_is_rasterized_once(land_mask_cache, tmp_path):
+    ds = _dataset()
+    land = get_land_mask(ds)
+    assert land.dtype == bool
+    xr.testing.assert_equal(land, _land(ds).rename('land'))
+    assert get_land_mask(ds.isel(time=0)) is land
+    assert len(land_mask_cache) == 1
+
+    key = land_mask_key(ds)
+    assert os.path.exists(tmp_path / 'local' / f'{key}.npy')
+    assert utils.is_cached(tmp_path / 'static' / f'{key}.zarr')
+
+    # from the local disk cache, then from static storage
+    for cache in [False, True]:
+        clear_land_mask_cache(disk=cache)
+        xr.testing.assert_equal(get_land_mask(ds), land)
+    assert len(land_mask_cache) == 1
+
+
+def test_get_land_mask_never_overwrites_the_store(land_mask_cache, tmp_path):
+    # another task has started writing the mask of the grid, but hasn't completed it yet
+    ds = _dataset()
+    path = tmp_path / 'static' / f'{land_mask_key(ds)}.zarr'
+    xr.Dataset({'partial': ('x', [1])}).to_zarr(path, consolidated=False)
+
+    xr.testing.assert_equal(get_land_mask(ds), _land(ds).rename('land'))
+    assert list(xr.open_zarr(path, consolidated=False).data_vars) == ['partial']
+
+
+def test_apply_land_mask(land_mask_cache):
+    ds = _dataset()
+    expected = ds.where(_land(ds))
+    xr.testing.assert_identical(apply_land_mask(ds), expected)
+
+    actual = apply_land_mask(ds, skip_ocean_chunks=True)
+    assert actual.tasmax.chunks == ds.tasmax.chunks
+    assert actual.attrs == ocean_chunk_report(ds)
+    actual.attrs = {}
+    xr.testing.assert_identical(actual.compute(), expected.compute())
+
+
+def test_ocean_chunk_report(land_mask_cache):
+    assert ocean_chunk_report(_dataset()) == {
+        'pixels_total': 80,
+        'pixels_land': 20,
+        'pixels_computed': 32,
+        'chunks_total': 8,
+        'chunks_skipped': 4,
+    }
+    assert ocean_chunk_report(_dataset().compute())['chunks_skipped'] == 0
+
+
+def test_apply_land_mask_skips_ocean_blocks_upstream(land_mask_cache):
+    ds = _dataset()
+    fit = []
+
+    def _fit_and_predict(block):
+        fit.append((float(block.lat[0]), float(block.lon[0])))
+        return block * 2
+
+    out = xr.map_blocks(_fit_and_predict, ds[['tasmax']], template=ds[['tasmax']])
+    with dask.config.set(scheduler='synchronous'):
+        actual = apply_land_mask(out, skip_ocean_chunks=True).compute()
+    # 4 spatial blocks with land, 3 time steps each
+    assert sorted(set(fit)) == [(0.0, 0.0), (0.0, 3.0), (0.0, 9.0), (4.0, 9.0)]
+    assert len(fit) == 12
+    np.testing.assert_array_equal(actual.tasmax.values, (ds.tasmax * 2).where(_land(ds)).values)
+
+
+def test_skip_masked_blocks_never_reads_masked_blocks():
+    read = []
+
+    def _read(block, block_info=None):
+        read.append(tuple(block_info[0]['chunk-location']))
+        return block
+
+    data = dask.array.ones((4, 6), chunks=2).map_blocks(_read, dtype=float)
+    mask = np.zeros((1, 6), dtype=bool)
+    mask[0, 1] = True
+    mask[0, 4:] = True
+
+    with dask.config.set(scheduler='synchronous'):
+        actual = skip_masked_blocks(data, mask).compute()
+    np.testing.assert_array_equal(actual, np.where(mask, 1.0, np.nan).repeat(4, axis=0))
+    assert sorted(read) == [(0, 0), (0, 2), (1, 0), (1, 2)]
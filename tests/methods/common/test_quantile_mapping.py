@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+import xarray as xr
+from skdownscale.pointwise_models import EquidistantCdfMatcher, QuantileMappingReressor
+from sklearn.linear_model import LinearRegression
+
+from cmip6_downscaling.methods.common.bias_correction import bias_correct_gcm_by_method
+from cmip6_downscaling.methods.common.quantile_mapping import (
+    batched_interp,
+    detrended_quantile_mapping,
+    equidistant_cdf_matching,
+    quantile_mapping,
+)
+
+
+def _data(seed=0):
+    rng = np.random.default_rng(seed)
+    trend = np.linspace(0, 1, 80)[:, np.newaxis, np.newaxis]
+    x = rng.gamma(2, size=(80, 3, 4)) + trend
+    x_train = rng.gamma(2, size=(60, 3, 4))
+    y_train = rng.gamma(3, size=(50, 3, 4))
+    return x, x_train, y_train
+
+
+def _pixelwise(model, x, x_train, y_train):
+    out = np.empty(x.shape)
+    for pixel in np.ndindex(x.shape[1:]):
+        index = (slice(None),) + pixel
+        model.fit(x_train[index].reshape(-1, 1), y_train[index])
+        out[index] = model.predict(x[index].reshape(-1, 1))
+    return out
+
+
+def _trend(values):
+    t = np.arange(len(values)).reshape(-1, 1)
+    return LinearRegression().fit(t, values).predict(t)
+
+
+def test_batched_interp_matches_numpy():
+    rng = np.random.default_rng(0)
+    xp = np.sort(rng.normal(size=(30, 12)), axis=0)
+    fp = rng.normal(size=(30, 12))
+    x = rng.normal(size=(40, 12)) * 2
+    expected = np.stack([np.interp(x[:, i], xp[:, i], fp[:, i]) for i in range(12)], axis=1)
+    np.testing.assert_allclose(batched_interp(x, xp, fp), expected)
+    expected = np.stack([np.interp(x[:, i], xp[:, 0], fp[:, i]) for i in range(12)], axis=1)
+    np.testing.assert_allclose(batched_interp(x, xp[:, 0], fp), expected)
+
+
+@pytest.mark.parametrize('kind', ['difference', 'ratio'])
+def test_equidistant_cdf_matching_matches_pixelwise_fit(kind):
+    x, x_train, y_train = _data()
+    expected = _pixelwise(EquidistantCdfMatcher(kind=kind, extrapolate=None), x, x_train, y_train)
+    np.testing.assert_allclose(equidistant_cdf_matching(x, x_train, y_train, kind=kind), expected)
+    np.testing.assert_allclose(
+        equidistant_cdf_matching(x, x_train, np.sort(y_train, axis=0), kind=kind, y_sorted=True),
+        expected,
+    )
+
+
+def test_quantile_mapping_matches_pixelwise_fit():
+    x, x_train, y_train = _data()
+    expected = _pixelwise(QuantileMappingReressor(extrapolate=None), x, x_train, y_train)
+    np.testing.assert_allclose(quantile_mapping(x, x_train, y_train), expected)
+
+
+def test_detrended_quantile_mapping_matches_pixelwise_fit():
+    x, x_train, y_train = _data()
+    expected = np.empty(x.shape)
+    for pixel in np.ndindex(x.shape[1:]):
+        index = (slice(None),) + pixel
+        a, b, c = x[index], x_train[index], y_train[index]
+        model = QuantileMappingReressor(extrapolate=None)
+        model.fit((b - _trend(b)).reshape(-1, 1), c - _trend(c))
+        trend = _trend(a)
+        expected[index] = (
+            model.predict((a - trend).reshape(-1, 1))
+            + trend
+            - trend.mean()
+            + (a.mean() - b.mean() + c.mean())
+        )
+    np.testing.assert_allclose(detrended_quantile_mapping(x, x_train, y_train), expected)
+
+
+def test_bias_correct_gcm_by_method_gridded():
+    x, x_train, y_train = _data()
+    x_train[:, 0, 0] = np.nan
+
+    def _da(values):
+        time = np.arange(len(values))
+        return xr.DataArray(values, dims=('time', 'lat', 'lon'), coords={'time': time})
+
+    gcm_pred = _da(x).transpose('lat', 'lon', 'time').chunk({'lat': 2})
+    out = bias_correct_gcm_by_method(
+        gcm_pred, 'quantile_map', {}, obs=_da(y_train), gcm_hist=_da(x_train)
+    )
+    assert out.dims == gcm_pred.dims
+    expected = quantile_mapping(x, x_train, y_train)
+    expected[:, 0, 0] = np.nan
+    np.testing.assert_allclose(out.transpose('time', ...).values, expected)
+
+
+def test_bias_correct_gcm_by_method_gridded_options():
+    x, x_train, y_train = _data()
+
+    def _da(values):
+        return xr.DataArray(values, dims=('time', 'lat', 'lon'))
+
+    def _correct(bc_kwargs):
+        return bias_correct_gcm_by_method(
+            _da(x), 'detrended_quantile_map', bc_kwargs, obs=_da(y_train), gcm_hist=_da(x_train)
+        )
+
+    np.testing.assert_allclose(
+        _correct({'extrapolate': None, 'n_endpoints': 2}).values,
+        detrended_quantile_mapping(x, x_train, y_train),
+    )
+    with pytest.raises(ValueError, match='n_endpoints'):
+        _correct({'n_endpoints': len(x_train)})
+    with pytest.raises(NotImplementedError, match='n_quantiles'):
+        _correct({'n_quantiles': 10})
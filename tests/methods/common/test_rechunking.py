@@ -0,0 +1,97 @@
+import json
+
+import fsspec
+import numpy as np
+import pytest
+import xarray as xr
+import zarr
+
+from cmip6_downscaling.methods.common.rechunking import (
+    CHECKPOINT_KEY,
+    in_process_rechunk,
+    resumable_rechunk,
+    select_rechunk_engine,
+)
+
+
+@pytest.fixture
+def source(tmp_path):
+    ds = xr.Dataset(
+        {'air': (('time', 'lat', 'lon'), np.random.rand(40, 6, 8).astype('float32'))},
+        coords={'time': np.arange(40), 'lat': np.arange(6), 'lon': np.arange(8)},
+    ).chunk({'time': 1, 'lat': -1, 'lon': -1})
+    path = tmp_path / 'source.zarr'
+    ds.to_zarr(path)
+    return path
+
+
+def _rechunk(source, tmp_path, max_mem='2000B'):
+    target_chunks = {
+        'air': {'time': 40, 'lat': 3, 'lon': 4},
+        'time': (40,),
+        'lat': (6,),
+        'lon': (8,),
+    }
+    target_store = fsspec.get_mapper(str(tmp_path / 'target.zarr'))
+    temp_store = fsspec.get_mapper(str(tmp_path / 'temp.zarr'))
+    resumable_rechunk(
+        zarr.open_consolidated(str(source)),
+        target_chunks,
+        max_mem,
+        target_store,
+        temp_store,
+        batch_size=2,
+    )
+    zarr.consolidate_metadata(target_store)
+    return target_store, temp_store
+
+
+def test_resumable_rechunk(source, tmp_path):
+    target_store, temp_store = _rechunk(source, tmp_path)
+
+    expected = xr.open_zarr(source)
+    actual = xr.open_zarr(target_store)
+    assert actual.air.encoding['chunks'] == (40, 3, 4)
+    xr.testing.assert_identical(expected.load(), actual.load())
+
+    checkpoint = json.loads(temp_store[CHECKPOINT_KEY])
+    assert 'air/target' in checkpoint
+    assert 'air/intermediate' in checkpoint
+
+
+def test_resumable_rechunk_skips_checkpointed_blocks(source, tmp_path):
+    target_store, temp_store = _rechunk(source, tmp_path)
+
+    # overwrite one block of the target; a resumed run must not touch it again
+    target = zarr.open_group(target_store, mode='a')
+    target['air'][:, :3, :4] = -1.0
+    _rechunk(source, tmp_path)
+    assert (target['air'][:, :3, :4] == -1.0).all()
+
+    # once the checkpoint is lost, the block is rewritten
+    del temp_store[CHECKPOINT_KEY]
+    _rechunk(source, tmp_path)
+    np.testing.assert_array_equal(
+        target['air'][:, :3, :4], xr.open_zarr(source).air.values[:, :3, :4]
+    )
+
+
+@pytest.mark.parametrize('buffer', ['memory', 'memmap'])
+def test_in_process_rechunk(source, tmp_path, buffer):
+    target_chunks = {'air': {'time': 40, 'lat': 3, 'lon': 4}, 'time': (40,)}
+    target_store = fsspec.get_mapper(str(tmp_path / 'target.zarr'))
+    in_process_rechunk(
+        zarr.open_consolidated(str(source)), target_chunks, target_store, buffer=buffer
+    )
+
+    target = zarr.open_group(target_store, mode='r')
+    assert set(target.array_keys()) == {'air', 'time'}
+    assert target['air'].chunks == (40, 3, 4)
+    np.testing.assert_array_equal(target['air'][:], xr.open_zarr(source).air.values)
+
+
+def test_select_rechunk_engine(source):
+    group = zarr.open_consolidated(str(source))
+    target_chunks = {'air': {'time': 40, 'lat': 3, 'lon': 4}}
+    assert select_rechunk_engine(group, target_chunks, '1MB') == 'memory'
+    assert select_rechunk_engine(group, target_chunks, '2000B') == 'rechunker'
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+
+from cmip6_downscaling.methods.common.regression import batched_linear_regression
+
+
+@pytest.mark.parametrize('rank_deficient', [False, True])
+def test_batched_linear_regression_matches_sklearn(rank_deficient):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(6, 40, 5)).astype('float32')
+    if rank_deficient:
+        x[:, :, 4] = x[:, :, 3]
+    y = (x @ rng.normal(size=5) + rng.normal(size=(6, 40)) * 0.1).astype('float32')
+
+    coef, intercept, residual = batched_linear_regression(x, y)
+
+    for i in range(len(x)):
+        model = LinearRegression().fit(x[i].astype('float64'), y[i].astype('float64'))
+        np.testing.assert_allclose(coef[i], model.coef_, rtol=1e-6, atol=1e-8)
+        np.testing.assert_allclose(intercept[i], model.intercept_, rtol=1e-6, atol=1e-8)
+        np.testing.assert_allclose(residual[i], y[i] - model.predict(x[i]), atol=1e-5)
+
+
+def test_batched_linear_regression_shapes():
+    with pytest.raises(ValueError):
+        batched_linear_regression(np.ones((2, 3, 4)), np.ones((2, 4)))
@@ -0,0 +1,163 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from cmip6_downscaling import config
+from cmip6_downscaling.methods.common.regridding import (
+    _catalog_weights,
+    _evict_disk_cache,
+    clear_regridder_cache,
+    gcm_obs_weights_index,
+    get_regridder,
+    grid_fingerprint,
+    lookup_weights,
+    regridder_key,
+    weights_registry,
+)
+
+
+def _grid(step, nt=2):
+    lat = np.arange(20, 50, step)
+    lon = np.arange(-130, -60, step)
+    return xr.Dataset(
+        {'tasmax': (('time', 'lat', 'lon'), np.random.rand(nt, len(lat), len(lon)))},
+        coords={'time': np.arange(nt), 'lat': lat, 'lon': lon},
+    )
+
+
+def test_grid_fingerprint_ignores_data_and_time():
+    ds = _grid(2.0)
+    other = _grid(2.0, nt=5).rename({'tasmax': 'pr'})
+    assert grid_fingerprint(ds) == grid_fingerprint(other)
+    assert grid_fingerprint(ds) != grid_fingerprint(_grid(1.0))
+
+    masked = ds.isel(time=0)
+    masked['mask'] = masked.tasmax > 0.5
+    assert grid_fingerprint(masked) != grid_fingerprint(ds)
+
+
+def test_regridder_key():
+    coarse, fine = _grid(2.0), _grid(1.0)
+    key = regridder_key(coarse, fine, 'bilinear', extrap_method='nearest_s2d')
+    assert key == regridder_key(_grid(2.0, nt=4), fine, 'bilinear', extrap_method='nearest_s2d')
+    assert key != regridder_key(fine, coarse, 'bilinear', extrap_method='nearest_s2d')
+    assert key != regridder_key(coarse, fine, 'bilinear')
+    assert key != regridder_key(coarse, fine, 'conservative', extrap_method='nearest_s2d')
+
+
+def test_evict_disk_cache(tmp_path):
+    for i, name in enumerate(['old', 'mid', 'new']):
+        path = tmp_path / f'{name}.nc'
+        path.write_bytes(b'0' * 100)
+        os.utime(path, (i, i))
+    _evict_disk_cache(str(tmp_path), 250)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['mid.nc', 'new.nc']
+    _evict_disk_cache(str(tmp_path), 0)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_get_regridder_reuses_weights(tmp_path):
+    pytest.importorskip('xesmf')
+    coarse, fine = _grid(2.0), _grid(1.0)
+    with config.set({'regridding.cache_dir': str(tmp_path)}):
+        clear_regridder_cache()
+        regridder = get_regridder(coarse, fine, 'bilinear', extrap_method='nearest_s2d')
+        assert get_regridder(_grid(2.0, nt=3), fine, 'bilinear', extrap_method='nearest_s2d') is (
+            regridder
+        )
+        assert len(list(tmp_path.glob('*.nc'))) == 1
+
+        # a new process only has the weights on disk
+        clear_regridder_cache()
+        from_disk = get_regridder(coarse, fine, 'bilinear', extrap_method='nearest_s2d')
+        assert from_disk is not regridder
+        xr.testing.assert_allclose(from_disk(coarse), regridder(coarse))
+
+
+@pytest.fixture
+def weights_catalog(tmp_path):
+    uri = tmp_path / 'weights.csv'
+    pd.DataFrame(
+        {
+            'source_id': ['MIROC6', 'MIROC6', 'CanESM5'],
+            'table_id': ['day', 'day', 'day'],
+            'grid_label': ['gn', 'gn', 'gn'],
+            'regrid_method': ['bilinear', 'bilinear', 'bilinear'],
+            'direction': ['gcm_to_obs', 'obs_to_gcm', 'gcm_to_obs'],
+            'path': ['az://miroc6/g2o', 'az://miroc6/o2g', 'az://canesm5/g2o'],
+        }
+    ).to_csv(uri, index=False)
+    mirror = tmp_path / 'mirror' / 'gcm_obs_weights.csv'
+    with config.set(
+        {'weights.gcm_obs_weights': {'uri': str(uri), 'mirror': str(mirror)}, 'weights.ttl': 3600}
+    ):
+        clear_regridder_cache()
+        yield uri, mirror
+    clear_regridder_cache()
+
+
+def test_lookup_weights(weights_catalog):
+    index = dict(source_id='MIROC6', table_id='day', grid_label='gn', regrid_method='bilinear')
+    assert lookup_weights('gcm_obs_weights', direction='obs_to_gcm', **index) == 'az://miroc6/o2g'
+    with pytest.raises(KeyError, match='no pre-generated weights'):
+        lookup_weights('gcm_obs_weights', direction='sideways', **index)
+    with pytest.raises(ValueError):
+        lookup_weights('gcm_obs_weights', **index)
+
+
+def test_weights_registry_loads_once_and_uses_mirror(weights_catalog):
+    uri, mirror = weights_catalog
+    registry = weights_registry('gcm_obs_weights')
+    assert mirror.exists()
+    assert weights_registry('gcm_obs_weights') is registry
+
+    # no network: the remote is gone, the in-memory registry expired, the mirror still works
+    uri.unlink()
+    with config.set({'weights.ttl': 0}):
+        assert weights_registry('gcm_obs_weights') == registry
+
+
+
+def _gcm_grid():
+    gcm = _grid(2.0)
+    gcm.attrs.update(source_id='MIROC6', table_id='day', grid_label='gn')
+    return gcm
+
+
+def test_gcm_obs_weights_index():
+    obs, gcm = _grid(1.0), _gcm_grid()
+    assert gcm_obs_weights_index(obs, gcm) == dict(
+        source_id='MIROC6', table_id='day', grid_label='gn', direction='obs_to_gcm'
+    )
+    assert gcm_obs_weights_index(gcm, obs)['direction'] == 'gcm_to_obs'
+    assert gcm_obs_weights_index(obs, obs) is None
+    assert gcm_obs_weights_index(gcm, gcm) is None
+
+
+def test_catalog_weights(weights_catalog, tmp_path):
+    obs, gcm = _grid(1.0), _gcm_grid()
+    source = _grid(2.0)
+
+    # identity weights from the gcm grid to itself, registered as the MIROC6 obs_to_gcm weights
+    n = gcm.sizes['lat'] * gcm.sizes['lon']
+    index = np.arange(1, n + 1)
+    ds_w = xr.Dataset({'row': ('n_s', index), 'col': ('n_s', index), 'S': ('n_s', np.ones(n))})
+    ds_w.attrs.update(n_in=n, n_out=n)
+    ds_w.to_zarr(tmp_path / 'o2g.zarr')
+    uri, _ = weights_catalog
+    catalog = pd.read_csv(uri)
+    catalog.loc[catalog.direction == 'obs_to_gcm', 'path'] = str(tmp_path / 'o2g.zarr')
+    catalog.to_csv(uri, index=False)
+
+    # not in the catalog, grids of a different size, masked grids
+    assert _catalog_weights(source, gcm, 'conservative') is None
+    assert _catalog_weights(obs, gcm, 'bilinear') is None
+    masked = gcm.isel(time=0)
+    masked['mask'] = masked.tasmax > 0.5
+    assert _catalog_weights(source, masked, 'bilinear') is None
+
+    pytest.importorskip('sparse')
+    assert _catalog_weights(source, gcm, 'bilinear').shape == (n, n)
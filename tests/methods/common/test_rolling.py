@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cmip6_downscaling.methods.common.rolling import (
+    group_mean,
+    grouped_rolling_mean,
+    rolling_mean,
+)
+
+
+def _padded_rolling_mean(values, window, mode):
+    half = (window - 1) // 2
+    padded = np.pad(values, [(half, half)] + [(0, 0)] * (values.ndim - 1), mode=mode)
+    return np.stack([padded[i : i + window].mean(axis=0) for i in range(len(values))])
+
+
+@pytest.mark.parametrize('pad,mode', [('wrap', 'wrap'), ('edge', 'edge')])
+@pytest.mark.parametrize('window', [1, 5, 11])
+def test_rolling_mean_matches_padding(pad, mode, window):
+    values = np.random.default_rng(0).normal(size=(40, 3))
+    expected = _padded_rolling_mean(values, window, mode)
+    np.testing.assert_allclose(rolling_mean(values, window, pad=pad), expected)
+
+
+def test_rolling_mean_window_pad():
+    values = np.random.default_rng(0).normal(size=(10, 2))
+    actual = rolling_mean(values, 5, pad='window')
+    full = pd.DataFrame(values).rolling(5, center=True).mean().values
+    np.testing.assert_allclose(actual[2:-2], full[2:-2])
+    np.testing.assert_allclose(actual[:2], full[[2, 2]])
+    np.testing.assert_allclose(actual[-2:], full[[-3, -3]])
+    # shorter series are averaged as a whole
+    expected = np.broadcast_to(values[:3].mean(axis=0), (3, 2))
+    np.testing.assert_allclose(rolling_mean(values[:3], 5, pad='window'), expected)
+
+
+def test_rolling_mean_propagates_missing_values():
+    values = np.arange(10.0)
+    values[4] = np.nan
+    actual = rolling_mean(values, 3, pad='edge')
+    assert np.isnan(actual[3:6]).all()
+    assert np.isfinite(np.delete(actual, [3, 4, 5])).all()
+
+
+def test_rolling_mean_validates_arguments():
+    with pytest.raises(ValueError, match='odd'):
+        rolling_mean(np.zeros(10), 4)
+    with pytest.raises(ValueError, match='pad'):
+        rolling_mean(np.zeros(10), 3, pad='reflect')
+    with pytest.raises(ValueError, match='longer'):
+        rolling_mean(np.zeros(3), 5, pad='wrap')
+
+
+def test_grouped_rolling_mean_matches_groupby():
+    rng = np.random.default_rng(0)
+    labels = np.tile(np.arange(4), 6)[:-1]
+    values = rng.normal(size=(len(labels), 2))
+    actual = grouped_rolling_mean(values, labels, 3, pad='edge')
+    for label in range(4):
+        group = labels == label
+        np.testing.assert_allclose(actual[group], _padded_rolling_mean(values[group], 3, 'edge'))
+
+    groups, mean = group_mean(values, labels)
+    expected = pd.DataFrame(values).groupby(labels).mean()
+    np.testing.assert_array_equal(groups, expected.index)
+    np.testing.assert_allclose(mean, expected.values)
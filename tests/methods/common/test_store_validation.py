@@ -0,0 +1,133 @@
+import json
+import os
+
+import dask
+import numpy as np
+import pytest
+import xarray as xr
+
+from cmip6_downscaling.methods.common.utils import (
+    COMPLETION_MANIFEST,
+    blocking_to_zarr,
+    is_cached,
+    region_writes_to_zarr,
+    validate_zarr_store,
+    write_zarr_once,
+)
+
+
+@pytest.fixture
+def ds():
+    return xr.Dataset(
+        {'air': (('time', 'lat', 'lon'), np.random.rand(10, 4, 6).astype('float32'))},
+        coords={'time': np.arange(10), 'lat': np.arange(4), 'lon': np.arange(6)},
+    ).chunk({'time': 5, 'lat': 2, 'lon': 3})
+
+
+def test_blocking_to_zarr_writes_completion_manifest(ds, tmp_path):
+    target = tmp_path / 'store.zarr'
+    blocking_to_zarr(ds, target)
+
+    manifest = json.loads((target / COMPLETION_MANIFEST).read_text())
+    assert manifest['arrays']['air']['nchunks'] == 8
+    assert manifest['arrays']['air']['nbytes'] > 0
+    assert is_cached(target)
+
+
+def test_is_cached_trusts_manifest_full_scan_does_not(ds, tmp_path):
+    target = tmp_path / 'store.zarr'
+    blocking_to_zarr(ds, target)
+    (target / 'air' / '0.0.0').unlink()
+
+    assert is_cached(target)
+    assert not validate_zarr_store(target, raise_on_error=False, full_scan=True)
+    with pytest.raises(ValueError):
+        validate_zarr_store(target, full_scan=True)
+
+
+def test_blocking_to_zarr_skips_empty_chunks(ds, tmp_path):
+    target = tmp_path / 'store.zarr'
+    masked = ds.where(ds.lat < 2)
+    blocking_to_zarr(masked, target, write_empty_chunks=False)
+
+    manifest = json.loads((target / COMPLETION_MANIFEST).read_text())
+    assert manifest['arrays']['air']['nchunks'] == 8
+    assert manifest['arrays']['air']['nchunks_initialized'] == 4
+    assert is_cached(target)
+    assert validate_zarr_store(target, full_scan=True)
+    xr.testing.assert_identical(xr.open_zarr(target).compute(), masked.compute())
+
+    (target / 'air' / '0.0.0').unlink()
+    assert not validate_zarr_store(target, raise_on_error=False, full_scan=True)
+
+
+def test_blocking_to_zarr_computes_metrics_with_the_write(ds, tmp_path):
+    calls = []
+
+    def _compute(block):
+        calls.append(1)
+        return block.where(block.lat < 2)
+
+    target = tmp_path / 'store.zarr'
+    out = xr.map_blocks(_compute, ds, template=ds)
+    metrics = {'pixels': out.air.isel(time=0).notnull().sum().data}
+    with dask.config.set(scheduler='synchronous'):
+        assert blocking_to_zarr(out, target, metrics=metrics) == {'pixels': 12}
+    assert len(calls) == 8
+    assert xr.open_zarr(target).attrs['pixels'] == 12
+
+
+def test_write_zarr_once(ds, tmp_path):
+    target = tmp_path / 'store.zarr'
+    assert write_zarr_once(ds, target)
+    assert is_cached(target)
+
+    assert not write_zarr_once(ds.rename({'air': 'other'}), target)
+    assert list(xr.open_zarr(target).data_vars) == ['air']
+
+
+def test_write_zarr_once_rewrites_abandoned_store(ds, tmp_path):
+    target = tmp_path / 'store.zarr'
+    # a writer died before writing the completion manifest
+    ds.to_zarr(target)
+    assert not write_zarr_once(ds.rename({'air': 'other'}), target, grace_period=3600)
+    assert list(xr.open_zarr(target).data_vars) == ['air']
+
+    for path in target.rglob('*'):
+        os.utime(path, (0, 0))
+    assert write_zarr_once(ds.rename({'air': 'other'}), target, grace_period=3600)
+    assert list(xr.open_zarr(target).data_vars) == ['other']
+    assert (target / COMPLETION_MANIFEST).exists()
+
+
+def test_is_cached_rejects_edited_manifest(ds, tmp_path):
+    target = tmp_path / 'store.zarr'
+    blocking_to_zarr(ds, target)
+    path = target / COMPLETION_MANIFEST
+    manifest = json.loads(path.read_text())
+    manifest['arrays']['air']['nchunks'] = 4
+    path.write_text(json.dumps(manifest))
+
+    assert not is_cached(target)
+
+
+def test_is_cached_without_manifest_falls_back_to_scan(ds, tmp_path):
+    target = tmp_path / 'store.zarr'
+    ds.to_zarr(target)
+    assert is_cached(target)
+
+    (target / 'air' / '0.0.0').unlink()
+    assert not is_cached(target)
+    assert not is_cached(tmp_path / 'missing.zarr')
+
+
+def test_region_writes_to_zarr(ds, tmp_path):
+    ds = ds.assign(pr=ds.air * 2, elev=ds.air.isel(time=0)).chunk({'time': 4})
+    ds = ds.assign_coords(time_bnds=('time', np.arange(10) + 0.5)).chunk({'time': 4})
+    target = tmp_path / 'store.zarr'
+    region_writes_to_zarr(ds, target)
+
+    actual = xr.open_zarr(target)
+    xr.testing.assert_identical(actual.load(), ds.load())
+    assert actual.air.encoding['chunks'] == (4, 2, 3)
+    assert is_cached(target)
@@ -19,6 +19,7 @@ config.set(
 
 from cmip6_downscaling.methods.common.containers import RunParameters
 from cmip6_downscaling.methods.common.tasks import (
+    _chunk_def,
     get_experiment,
     get_obs,
     make_run_parameters,
@@ -186,3 +187,43 @@ def test_rechunk(rechunk_params, tmp_path):
     )
 
     schema.validate(actual_ds)
+
+
+@pytest.mark.parametrize('engine', ['memory', 'rechunker'])
+def test_rechunk_engines(engine, tmp_path):
+    ds = xr.Dataset(
+        {'air': (('time', 'lat', 'lon'), np.random.rand(50, 10, 12).astype('float32'))},
+        coords={'time': np.arange(50), 'lat': np.arange(10), 'lon': np.arange(12)},
+    ).chunk({'time': 5, 'lat': -1, 'lon': -1})
+    source_path = UPath(tmp_path) / f'rechunk_{engine}.zarr'
+    ds.to_zarr(source_path)
+
+    actual_path = rechunk.run(source_path, pattern='full_time', engine=engine)
+    actual_ds = xr.open_zarr(actual_path)
+
+    assert actual_ds.air.encoding['chunks'] == (50, 10, 12)
+    xr.testing.assert_equal(ds.load(), actual_ds.load())
+
+
+@pytest.mark.parametrize('engine', ['memory', 'memmap'])
+def test_rechunk_in_process_engines_cannot_resume(engine, tmp_path):
+    source_path = UPath(tmp_path) / 'missing.zarr'
+    with pytest.raises(ValueError, match='resume'):
+        rechunk.run(source_path, pattern='full_time', resume=True, engine=engine)
+
+
+@pytest.mark.parametrize('pattern', ['full_space', 'full_time'])
+def test_chunk_def_needs_no_rechunk(pattern, tmp_path):
+    # get_experiment chunks its output like this, so that the next rechunk is a no-op
+    ds = xr.Dataset(
+        {'air': (('time', 'lat', 'lon'), np.random.rand(50, 10, 12).astype('float32'))},
+        coords={'time': np.arange(50), 'lat': np.arange(10), 'lon': np.arange(12)},
+    )
+    template_path = UPath(tmp_path) / 'template.zarr'
+    ds.isel(time=slice(20)).chunk({'time': 4, 'lat': 5, 'lon': 6}).to_zarr(template_path)
+
+    source_path = UPath(tmp_path) / 'source.zarr'
+    ds.chunk(_chunk_def(ds, pattern=pattern, template=template_path)).to_zarr(source_path)
+
+    actual_path = rechunk.run(source_path, pattern=pattern, template=template_path)
+    assert actual_path == source_path
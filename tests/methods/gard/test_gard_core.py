@@ -0,0 +1,275 @@
+import numpy as np
+import pytest
+import xarray as xr
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.neighbors import KDTree
+
+from cmip6_downscaling.methods.gard.core import (
+    analog_regression,
+    fit_and_predict,
+    gridded_fit_and_predict,
+    nearest_analogs,
+    pure_analog,
+    pure_regression,
+    unsupported_params,
+)
+
+
+def _data(n_pixels=3, n_train=120, n_pred=15, n_features=2, seed=0):
+    rng = np.random.default_rng(seed)
+    x_train = rng.normal(size=(n_pixels, n_train, n_features))
+    y_train = x_train @ rng.normal(size=n_features) + rng.normal(size=(n_pixels, n_train))
+    x_pred = rng.normal(size=(n_pixels, n_pred, n_features))
+    return x_train, y_train, x_pred
+
+
+def _fit_linear(x, y):
+    model = LinearRegression().fit(x, y)
+    error = np.sqrt(np.mean((y - model.predict(x)) ** 2))
+    return model, error
+
+
+@pytest.mark.parametrize('thresh', [None, 0.0])
+def test_pure_regression_matches_sklearn(thresh):
+    x_train, y_train, x_pred = _data()
+    actual = pure_regression(x_train, y_train, x_pred, thresh=thresh)
+
+    for i in range(len(x_train)):
+        exceed = y_train[i] > thresh if thresh is not None else np.ones(len(y_train[i]), bool)
+        model, error = _fit_linear(x_train[i][exceed], y_train[i][exceed])
+        np.testing.assert_allclose(actual['pred'][i], model.predict(x_pred[i]), rtol=1e-10)
+        np.testing.assert_allclose(actual['prediction_error'][i], error, rtol=1e-10)
+        if thresh is None:
+            np.testing.assert_array_equal(actual['exceedance_prob'][i], 1)
+        else:
+            logistic = LogisticRegression(tol=1e-12, max_iter=10000).fit(x_train[i], exceed)
+            np.testing.assert_allclose(
+                actual['exceedance_prob'][i], logistic.predict_proba(x_pred[i])[:, 1], atol=1e-6
+            )
+
+
+def test_pure_regression_single_class():
+    x_train, y_train, x_pred = _data()
+    y_train[0] = np.abs(y_train[0]) + 1
+    y_train[1] = -np.abs(y_train[1])
+    actual = pure_regression(x_train, y_train, x_pred, thresh=0.0)
+    np.testing.assert_array_equal(actual['exceedance_prob'][0], 1)
+    np.testing.assert_array_equal(actual['exceedance_prob'][1], 0)
+    model, _ = _fit_linear(x_train[1], y_train[1])
+    np.testing.assert_allclose(actual['pred'][1], model.predict(x_pred[1]), rtol=1e-10)
+
+
+def test_nearest_analogs_matches_kdtree():
+    x_train, _, x_pred = _data()
+    distances, inds = nearest_analogs(x_train, x_pred, k=7, max_elements=500)
+    for i in range(len(x_train)):
+        expected_distances, expected_inds = KDTree(x_train[i]).query(x_pred[i], k=7)
+        np.testing.assert_allclose(distances[i], expected_distances, rtol=1e-10)
+        np.testing.assert_array_equal(inds[i], expected_inds)
+
+
+@pytest.mark.parametrize('kind', ['best_analog', 'weight_analogs', 'mean_analogs'])
+@pytest.mark.parametrize('thresh', [None, 0.0])
+def test_pure_analog_matches_reference(kind, thresh):
+    x_train, y_train, x_pred = _data()
+    actual = pure_analog(x_train, y_train, x_pred, n_analogs=10, kind=kind, thresh=thresh)
+
+    k = 1 if kind == 'best_analog' else 10
+    for i in range(len(x_train)):
+        dist, inds = KDTree(x_train[i]).query(x_pred[i], k=k)
+        analogs = y_train[i][inds]
+        masked = analogs
+        if thresh is not None:
+            masked = np.where(analogs > thresh, analogs, np.nan)
+        # skdownscale.pointwise_models.PureAnalog
+        if kind == 'best_analog':
+            expected = analogs[:, 0]
+        elif kind == 'weight_analogs':
+            expected = np.average(masked, weights=1.0 / dist, axis=1)
+        else:
+            expected = masked.mean(axis=1)
+        np.testing.assert_allclose(actual['pred'][i], np.nan_to_num(expected), rtol=1e-10)
+        np.testing.assert_allclose(actual['prediction_error'][i], masked.std(axis=1), atol=1e-12)
+        expected_prob = (analogs > thresh).mean(axis=1) if thresh is not None else 1.0
+        np.testing.assert_allclose(actual['exceedance_prob'][i], expected_prob)
+
+
+@pytest.mark.parametrize('kind', ['best_analog', 'weight_analogs', 'mean_analogs'])
+def test_pure_analog_thresh_fixes(kind):
+    x_train, y_train, x_pred = _data()
+    actual = pure_analog(
+        x_train, y_train, x_pred, n_analogs=10, kind=kind, thresh=0.0, thresh_fixes=True
+    )
+
+    k = 1 if kind == 'best_analog' else 10
+    for i in range(len(x_train)):
+        dist, inds = KDTree(x_train[i]).query(x_pred[i], k=k)
+        analogs = y_train[i][inds]
+        analogs = np.where(analogs > 0.0, analogs, np.nan)
+        weights = 1.0 / dist if kind == 'weight_analogs' else np.ones(dist.shape)
+        valid = np.isfinite(analogs)
+        with np.errstate(invalid='ignore'):
+            expected = (np.nan_to_num(analogs) * weights).sum(axis=1) / (valid * weights).sum(
+                axis=1
+            )
+        if kind == 'best_analog':
+            expected = analogs[:, 0]
+        np.testing.assert_allclose(actual['pred'][i], np.nan_to_num(expected), rtol=1e-10)
+        with np.errstate(invalid='ignore'):
+            expected_error = np.nan_to_num(np.nanstd(analogs, axis=1))
+        np.testing.assert_allclose(actual['prediction_error'][i], expected_error, atol=1e-12)
+        np.testing.assert_allclose(actual['exceedance_prob'][i], valid.mean(axis=1))
+
+
+def test_pure_analog_sample_analogs():
+    x_train, y_train, x_pred = _data()
+    actual = pure_analog(x_train, y_train, x_pred, n_analogs=5, kind='sample_analogs')
+    for i in range(len(x_train)):
+        _, inds = KDTree(x_train[i]).query(x_pred[i], k=5)
+        assert all(p in y_train[i][row] for p, row in zip(actual['pred'][i], inds))
+
+
+@pytest.mark.parametrize('thresh_fixes', [False, True])
+@pytest.mark.parametrize('thresh', [None, 0.0])
+def test_analog_regression_matches_sklearn(thresh, thresh_fixes):
+    x_train, y_train, x_pred = _data(n_pred=6)
+    actual = analog_regression(
+        x_train,
+        y_train,
+        x_pred,
+        n_analogs=40,
+        thresh=thresh,
+        batch_size=5,
+        thresh_fixes=thresh_fixes,
+    )
+
+    for i in range(len(x_train)):
+        _, inds = KDTree(x_train[i]).query(x_pred[i], k=40)
+        for t in range(len(x_pred[i])):
+            x, y = x_train[i][inds[t]], y_train[i][inds[t]]
+            exceed = y > thresh if thresh is not None else np.ones(len(y), bool)
+            model, error = _fit_linear(x[exceed], y[exceed])
+            np.testing.assert_allclose(actual['pred'][i, t], model.predict(x_pred[i, t : t + 1]))
+            np.testing.assert_allclose(actual['prediction_error'][i, t], error)
+            if thresh is not None:
+                logistic = LogisticRegression(tol=1e-12, max_iter=10000).fit(x, exceed)
+                np.testing.assert_allclose(
+                    actual['exceedance_prob'][i, t],
+                    # skdownscale reports the probability of the first class (not exceeding)
+                    logistic.predict_proba(x_pred[i, t : t + 1])[0, int(thresh_fixes)],
+                    atol=1e-6,
+                )
+
+
+def test_fit_and_predict_params():
+    x_train, y_train, x_pred = _data()
+    out = fit_and_predict(
+        x_train,
+        y_train,
+        x_pred,
+        'PureAnalog',
+        {'n_analogs': 3, 'kind': 'mean_analogs', 'kdtree_kwargs': {'leaf_size': 10}},
+    )
+    assert out['pred'].shape == x_pred.shape[:2]
+    params = {'logistic_kwargs': {'C': 0.5, 'penalty': 'none'}, 'lr_kwargs': {}}
+    assert unsupported_params(params) == ['logistic_kwargs.penalty']
+    assert unsupported_params({'linear_kwargs': {'fit_intercept': False}}) == ['linear_kwargs']
+    with pytest.raises(NotImplementedError):
+        fit_and_predict(x_train, y_train, x_pred, 'PureRegression', {'linear_kwargs': {'a': 1}})
+    with pytest.raises(NotImplementedError):
+        fit_and_predict(x_train, y_train, x_pred, 'Unknown', {})
+
+
+def test_gridded_fit_and_predict():
+    x_train, y_train, x_pred = _data(n_pixels=6)
+    # pixel 4 is ocean
+    x_train[4] = np.nan
+
+    def _dataset(values, time):
+        values = values.reshape(2, 3, len(time), -1).transpose(2, 0, 1, 3)
+        coords = {'time': time, 'lat': [0.0, 1.0], 'lon': [0.0, 1.0, 2.0]}
+        dims = ('time', 'lat', 'lon')
+        data_vars = {f'f{f}': (dims, values[..., f]) for f in range(values.shape[-1])}
+        return xr.Dataset(data_vars, coords=coords)
+
+    xtrain = _dataset(x_train, np.arange(120))
+    ytrain = _dataset(y_train[..., np.newaxis], np.arange(120))['f0']
+    xpred = _dataset(x_pred, np.arange(15))
+    out = gridded_fit_and_predict(xtrain, ytrain, xpred, ['f0', 'f1'], 'PureRegression', {})
+
+    land = [0, 1, 2, 3, 5]
+    expected = pure_regression(x_train[land], y_train[land], x_pred[land])
+    assert out['pred'].dims == ('time', 'lat', 'lon')
+    actual = out['pred'].values.reshape(15, 6).T
+    np.testing.assert_allclose(actual[land], expected['pred'])
+    assert np.isnan(actual[4]).all()
+
+
+def _reference_add_random_effects(model_output, scrf, thresh, variable):
+    # add_random_effects before it was fused into random_effects
+    from scipy.special import cbrt
+    from scipy.stats import norm
+
+    if thresh is None:
+        return model_output['pred'] + scrf * model_output['prediction_error']
+    scrf_uniform = xr.apply_ufunc(norm.cdf, scrf)
+    mask = scrf_uniform > (1 - model_output['exceedance_prob'])
+    new_uniform = (scrf_uniform - (1 - model_output['exceedance_prob'])) / model_output[
+        'exceedance_prob'
+    ]
+    r_normal = xr.apply_ufunc(norm.ppf, new_uniform)
+    if variable == 'pr':
+        error = model_output['prediction_error'] * r_normal
+        downscaled = (cbrt(model_output['pred']) + error) ** 3
+    else:
+        downscaled = model_output['pred'] + r_normal * model_output['prediction_error']
+    valids = np.logical_or(mask, downscaled >= 0)
+    downscaled = downscaled.where(valids, 0)
+    return downscaled.where(downscaled >= 0, 0)
+
+
+@pytest.mark.parametrize('thresh', [None, 0.0])
+@pytest.mark.parametrize('variable', ['pr', 'tasmax'])
+def test_add_random_effects_matches_reference(thresh, variable):
+    from cmip6_downscaling.methods.common.containers import RunParameters
+    from cmip6_downscaling.methods.gard.utils import add_random_effects
+
+    rng = np.random.default_rng(0)
+    shape = (50, 3, 4)
+    dims = ('time', 'lat', 'lon')
+    model_output = xr.Dataset(
+        {
+            'pred': (dims, rng.gamma(2, size=shape)),
+            'prediction_error': (dims, rng.gamma(1, size=shape)),
+            'exceedance_prob': (dims, rng.uniform(size=shape)),
+        }
+    )
+    model_output['pred'][0, 0, 0] = np.nan
+    model_output['exceedance_prob'][1, 0, 0] = 0
+    model_output['exceedance_prob'][2, 0, 0] = 1
+    scrf = xr.DataArray(rng.normal(size=shape).astype('float32'), dims=dims)
+    run_parameters = RunParameters(
+        method='gard',
+        obs='ERA5',
+        model='MIROC6',
+        member='r1i1p1f1',
+        grid_label='gn',
+        table_id='day',
+        scenario='ssp370',
+        variable=variable,
+        latmin=0,
+        latmax=2,
+        lonmin=0,
+        lonmax=3,
+        train_dates=['1981', '2010'],
+        predict_dates=['2011', '2020'],
+        model_params={'thresh': thresh},
+    )
+
+    expected = _reference_add_random_effects(model_output, scrf, thresh, variable)
+    for chunks in [None, {'time': 10}]:
+        inputs = model_output if chunks is None else model_output.chunk(chunks)
+        actual = add_random_effects(inputs, scrf, run_parameters)[variable]
+        xr.testing.assert_allclose(actual.compute(), expected, rtol=1e-12)
+    approximate = add_random_effects(model_output, scrf, run_parameters, approximate=True)
+    xr.testing.assert_allclose(approximate[variable], expected, rtol=1e-7)
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from cmip6_downscaling import config
+from cmip6_downscaling.methods.common.containers import RunParameters
+from cmip6_downscaling.methods.gard.scrf import (
+    open_scrf,
+    scrf_library_path,
+    scrf_time_positions,
+    virtual_scrf,
+)
+
+
+def _library():
+    rng = np.random.default_rng(0)
+    return xr.Dataset(
+        {'scrf': (('time', 'lat', 'lon'), rng.normal(size=(40, 6, 8)))},
+        coords={
+            'time': pd.date_range('1981-01-01', periods=40),
+            'lat': np.arange(6.0),
+            'lon': np.arange(8.0),
+            'spatial_ref': 0,
+        },
+    ).chunk({'time': 10})
+
+
+def _template(start='2001-01-01', periods=100):
+    return xr.Dataset(
+        {'tasmax': (('time', 'lat', 'lon'), np.zeros((periods, 3, 4)))},
+        coords={
+            'time': pd.date_range(start, periods=periods),
+            'lat': np.arange(1.0, 4.0),
+            'lon': np.arange(2.0, 6.0),
+        },
+    ).chunk({'time': -1, 'lat': 2, 'lon': 2})
+
+
+def _concatenated(library, template, start):
+    # the random fields are repeated from the start of the period until they cover the template
+    n_copies = -(-len(pd.date_range(f'{start}-01-01', template.time.values[-1])) // 40)
+    scrf = xr.concat([library.drop_vars(['time', 'spatial_ref'])] * n_copies, dim='time')
+    scrf['time'] = pd.date_range(start=f'{start}-01-01', periods=scrf.sizes['time'])
+    scrf = scrf.sel(lat=template.lat.values, lon=template.lon.values, time=template.time.values)
+    return scrf.astype('float32')
+
+
+@pytest.mark.parametrize('template_start', ['2001-01-01', '2001-03-05'])
+def test_virtual_scrf_matches_concatenated_copies(template_start):
+    library, template = _library(), _template(template_start)
+    actual = virtual_scrf(library, template, '2001')
+    expected = _concatenated(library, template, '2001')
+    xr.testing.assert_identical(actual.compute(), expected.compute())
+    assert actual.scrf.chunks == template.tasmax.chunks
+    assert 'spatial_ref' not in actual.coords
+
+
+def test_virtual_scrf_missing_pixels():
+    template = _template().assign_coords(lat=np.arange(1.5, 4.5))
+    with pytest.raises(KeyError):
+        virtual_scrf(_library(), template, '2001')
+
+
+def test_scrf_time_positions():
+    time = pd.date_range('2000-12-30', periods=5).values
+    np.testing.assert_array_equal(scrf_time_positions(time, '2000', 366), [364, 365, 0, 1, 2])
+
+
+def test_open_scrf(tmp_path):
+    path = tmp_path / 'ERA5_tasmax.zarr'
+    _library().to_zarr(path)
+
+    run_parameters = RunParameters(
+        method='gard',
+        obs='ERA5',
+        model='MIROC6',
+        member='r1i1p1f1',
+        grid_label='gn',
+        table_id='day',
+        scenario='ssp370',
+        variable='tasmax',
+        latmin=1,
+        latmax=3,
+        lonmin=2,
+        lonmax=5,
+        train_dates=['1981', '1990'],
+        predict_dates=['2001', '2001'],
+    )
+    with config.set({'scrf.uri': str(tmp_path / 'ERA5_{variable}.zarr')}):
+        assert str(scrf_library_path('tasmax')) == str(path)
+        actual = open_scrf(_template(), run_parameters)
+    expected = _concatenated(_library(), _template(), '2001')
+    xr.testing.assert_identical(actual.compute(), expected.compute())
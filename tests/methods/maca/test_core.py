@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from sklearn.linear_model import LinearRegression
+
+from cmip6_downscaling.methods.maca import core
+from cmip6_downscaling.methods.maca.utils import add_circular_temporal_pad, pad_with_edge_year
+
+
+class _IdentityRegridder:
+    def __call__(self, da):
+        return da
+
+
+def _dataset(time, seed):
+    rng = np.random.default_rng(seed)
+    return xr.Dataset(
+        {'tasmax': (('time', 'lat', 'lon'), rng.normal(size=(len(time), 4, 5)))},
+        coords={'time': time, 'lat': np.arange(4.0), 'lon': np.arange(5.0)},
+    )
+
+
+def _dense_doy_mask(source_doy, target_doy, doy_range):
+    distance = np.abs(target_doy[:, None] - source_doy[None, :])
+    return np.minimum(distance, 365 - distance) <= doy_range
+
+
+def _reference(ds_gcm, ds_obs, n_analogs, doy_range):
+    """Per-day loop the batched solver replaced"""
+    X = ds_obs.tasmax.stack(pixel=['lat', 'lon'])
+    y = ds_gcm.tasmax.stack(pixel=['lat', 'lon'])
+    rmse = np.sqrt(((X.values[None] - y.values[:, None]) ** 2).sum(-1)) / X.shape[1]
+    mask = _dense_doy_mask(
+        core.noleap_dayofyear(ds_obs.time), core.noleap_dayofyear(ds_gcm.time), doy_range
+    )
+    out = []
+    for i in range(len(y)):
+        ind = np.argsort(np.where(mask[i], rmse[i], np.nan))[:n_analogs]
+        model = LinearRegression().fit(X.values[ind].T, y.values[i])
+        residual = y.values[i] - model.predict(X.values[ind].T)
+        fine = np.tensordot(model.coef_, X.values[ind], axes=1) + model.intercept_ + residual
+        out.append(fine.reshape(4, 5))
+    return np.stack(out)
+
+
+def test_construct_analogs_matches_reference(monkeypatch):
+    monkeypatch.setattr(core, 'get_regridder', lambda *args, **kwargs: _IdentityRegridder())
+    ds_obs = _dataset(pd.date_range('2000-01-01', periods=730), seed=0)
+    ds_gcm = _dataset(pd.date_range('2050-01-01', periods=40), seed=1)
+
+    downscaled = core.construct_analogs(
+        ds_gcm, ds_obs, ds_obs, 'tasmax', n_analogs=6, doy_range=10, batch_size=16
+    )
+
+    assert downscaled.tasmax.dims == ('time', 'lat', 'lon')
+    np.testing.assert_array_equal(downscaled.time, ds_gcm.time)
+    np.testing.assert_allclose(
+        downscaled.tasmax.values, _reference(ds_gcm, ds_obs, 6, 10), rtol=1e-6, atol=1e-8
+    )
+
+
+def test_find_analogs_matches_dense_search():
+    rng = np.random.default_rng(2)
+    x = rng.normal(size=(400, 12))
+    y = rng.normal(size=(50, 12))
+    x[:, 0] = np.nan
+    y[:, 0] = np.nan
+    source_doy = np.arange(400) % 365 + 1
+    target_doy = rng.integers(1, 366, size=50)
+    target_doy[:3] = [1, 365, 1]
+
+    inds = core.find_analogs(x, y, source_doy, target_doy, n_analogs=5, doy_range=20, block_size=1)
+
+    rmse = np.sqrt(np.nansum((x[None] - y[:, None]) ** 2, axis=-1))
+    mask = _dense_doy_mask(source_doy, target_doy, 20)
+    expected = np.argsort(np.where(mask, rmse, np.nan), axis=1)[:, :5]
+    np.testing.assert_array_equal(inds, expected)
+
+
+def test_noleap_dayofyear():
+    time = xr.DataArray(
+        pd.to_datetime(['2000-02-28', '2000-02-29', '2000-03-01', '2000-12-31', '2001-03-01']),
+        dims='time',
+    )
+    np.testing.assert_array_equal(core.noleap_dayofyear(time), [59, 59, 60, 365, 60])
+
+
+def test_doy_window_wraps():
+    np.testing.assert_array_equal(core.doy_window(2, 3), [1, 2, 3, 4, 5, 364, 365])
+    assert len(core.doy_window(100, 400)) == 365
+
+
+def test_build_doy_index():
+    index = core.build_doy_index(np.array([3, 1, 3, 2, 1]))
+    assert list(index) == [1, 2, 3]
+    np.testing.assert_array_equal(index[1], [1, 4])
+    np.testing.assert_array_equal(index[3], [0, 2])
+
+
+def test_bias_correction_matches_pixelwise_fit():
+    from skdownscale.pointwise_models import EquidistantCdfMatcher
+
+    from cmip6_downscaling.methods.maca.utils import generate_batches
+
+    rng = np.random.default_rng(3)
+    ds_obs = _dataset(pd.date_range('2000-01-01', '2002-12-31'), seed=4)
+    ds_gcm = _dataset(pd.date_range('2000-01-01', '2004-12-31'), seed=5) * 1.5 + 2
+    ds_gcm['tasmax'][:, 0, 0] = np.nan
+    ds_gcm['pr'] = np.exp(ds_gcm.tasmax)
+    ds_obs['pr'] = np.exp(ds_obs.tasmax) * rng.uniform(0.5, 1, size=ds_obs.tasmax.shape)
+
+    actual = core.bias_correction(ds_gcm, ds_obs, ['tasmax', 'pr'], n_workers=4)
+
+    doy_gcm = ds_gcm.time.dt.dayofyear
+    doy_obs = ds_obs.time.dt.dayofyear
+    batches, cores = generate_batches(366, batch_size=15, buffer_size=15, one_indexed=True)
+    for var, kind in [('tasmax', 'difference'), ('pr', 'ratio')]:
+        expected = np.full(ds_gcm[var].shape, np.nan)
+        for b, c in zip(batches, cores):
+            gcm_batch = ds_gcm[var].sel(time=doy_gcm.isin(b))
+            train_x, train_y = xr.align(
+                gcm_batch, ds_obs[var].sel(time=doy_obs.isin(b)), join='inner'
+            )
+            keep = gcm_batch.time.dt.dayofyear.isin(c).values
+            positions = np.flatnonzero(doy_gcm.isin(b).values)[keep]
+            for i in range(4):
+                for j in range(5):
+                    if np.isnan(train_x.values[0, i, j]):
+                        continue
+                    model = EquidistantCdfMatcher(kind=kind, extrapolate=None)
+                    model.fit(train_x.values[:, i, j, None], train_y.values[:, i, j])
+                    pred = model.predict(gcm_batch.values[:, i, j, None])
+                    expected[positions, i, j] = pred[keep]
+        np.testing.assert_allclose(actual[var].values, expected)
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_bias_correction_matches_sequential(n_workers):
+    ds_obs = _dataset(pd.date_range('2000-01-01', '2002-12-31'), seed=6)
+    ds_gcm = _dataset(pd.date_range('2000-01-01', '2004-12-31'), seed=7) * 1.5 + 2
+
+    actual = core.bias_correction(ds_gcm, ds_obs, ['tasmax'], n_workers=n_workers)
+    expected = core.bias_correction_sequential(ds_gcm, ds_obs, ['tasmax'])
+    xr.testing.assert_allclose(actual, expected)
+
+
+def _reference_epoch_trend(data, historical_period, day_rolling_window, year_rolling_window):
+    """Padding and rolling implementation the cumulative sums replaced"""
+    d_offset = (day_rolling_window - 1) // 2
+    padded = add_circular_temporal_pad(data=data.sel(time=historical_period), offset=d_offset)
+    hist_mean = (
+        padded.rolling(time=day_rolling_window, center=True)
+        .mean()
+        .dropna('time')
+        .groupby('time.dayofyear')
+        .mean()
+    )
+    padded = add_circular_temporal_pad(data=data, offset=d_offset)
+    rolling_doy_mean = (
+        padded.rolling(time=day_rolling_window, center=True)
+        .mean()
+        .dropna('time')
+        .groupby('time.dayofyear')
+        .apply(lambda x: x.rolling(time=year_rolling_window, center=True).mean())
+        .dropna('time')
+    )
+    for _ in range((year_rolling_window - 1) // 2):
+        rolling_doy_mean = pad_with_edge_year(rolling_doy_mean)
+    return rolling_doy_mean.groupby('time.dayofyear') - hist_mean
+
+
+def test_epoch_trend_matches_reference():
+    time = pd.date_range('1990-01-01', '2001-12-31')
+    ds = _dataset(time, 0) + xr.DataArray(np.linspace(0, 2, len(time)), dims='time')
+    historical_period = slice('1993', '1997')
+    trend = core.epoch_trend(ds, historical_period, day_rolling_window=5, year_rolling_window=3)
+    assert trend.tasmax.dims == ds.tasmax.dims
+    xr.testing.assert_equal(trend.time, ds.time)
+
+    # the reference shifts the repeated last year by a day when the year before it is a leap year
+    expected = _reference_epoch_trend(ds, historical_period, 5, 3)
+    expected = expected.sel(time=slice(None, '2000-12-30'))
+    actual = trend.sel(time=expected.time)
+    np.testing.assert_allclose(actual.tasmax.values, expected.tasmax.values)
+
+
+def test_epoch_trend_blockwise():
+    time = pd.date_range('1990-01-01', '1995-12-31')
+    ds = _dataset(time, 1)
+    ds['tasmax'][:10, 0, 0] = np.nan
+    kwargs = dict(historical_period=slice('1991', '1993'), year_rolling_window=3)
+    expected = core.epoch_trend(ds, **kwargs)
+    chunked = ds.chunk({'time': -1, 'lat': 2, 'lon': 2})
+    actual = xr.map_blocks(core.epoch_trend, chunked, kwargs=kwargs, template=chunked)
+    xr.testing.assert_allclose(actual.compute(), expected)
+    assert expected.tasmax[:30, 0, 0].isnull().sum() == 10 + 10
+    assert expected.tasmax[:, 1:, 1:].notnull().all()
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from cmip6_downscaling import config
+
+config.set(
+    {
+        'storage.intermediate.uri': '/tmp/cmip6_downscaling_tests/intermediate',
+        'storage.results.uri': '/tmp/cmip6_downscaling_tests/results',
+    }
+)
+
+from cmip6_downscaling.methods.common.containers import RunParameters
+from cmip6_downscaling.methods.maca.tasks import (
+    bias_correction,
+    replace_epoch_trend,
+    replace_epoch_trend_and_bias_correct,
+)
+
+
+def _dataset(seed, time):
+    rng = np.random.default_rng(seed)
+    return xr.Dataset(
+        {'tasmax': (('time', 'lat', 'lon'), rng.normal(size=(len(time), 4, 6)))},
+        coords={'time': time, 'lat': np.arange(4.0), 'lon': np.arange(6.0)},
+    ).chunk({'time': -1, 'lat': 2, 'lon': 3})
+
+
+def test_replace_epoch_trend_and_bias_correct(tmp_path):
+    time = pd.date_range('2000-01-01', '2001-12-31', freq='D')
+    paths = {}
+    for seed, name in enumerate(['analogs', 'trend', 'obs']):
+        paths[name] = tmp_path / f'{name}.zarr'
+        _dataset(seed, time).to_zarr(paths[name])
+    run_parameters = RunParameters(
+        method='maca',
+        obs='ERA5',
+        model='MIROC6',
+        member='r1i1p1f1',
+        grid_label='gn',
+        table_id='day',
+        scenario='ssp370',
+        variable='tasmax',
+        latmin=0,
+        latmax=3,
+        lonmin=0,
+        lonmax=5,
+        train_dates=['2000', '2001'],
+        predict_dates=['2000', '2001'],
+    )
+
+    expected = bias_correction.run(
+        replace_epoch_trend.run(paths['analogs'], paths['trend']), paths['obs'], run_parameters
+    )
+    actual = replace_epoch_trend_and_bias_correct.run(
+        paths['analogs'], paths['trend'], paths['obs'], run_parameters
+    )
+    xr.testing.assert_allclose(xr.open_zarr(actual).compute(), xr.open_zarr(expected).compute())
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import zarr
+
+from cmip6_downscaling import config
+from cmip6_downscaling.methods.common.utils import is_cached
+from cmip6_downscaling.methods.maca import regions
+
+
+def _mask(ds):
+    # region 1 has two parts, so it skips rows and columns within its bounding box
+    values = np.full((len(ds.lat), len(ds.lon)), np.nan)
+    values[1:3, 2:5] = 1
+    values[4, 0] = 1
+    values[3:6, 6:8] = 7
+    return xr.DataArray(values, dims=('lat', 'lon'), coords={'lat': ds.lat, 'lon': ds.lon})
+
+
+class _Regions:
+    """Stands in for a regionmask region definition with a fixed mask"""
+
+    def mask(self, ds):
+        return _mask(ds)
+
+
+@pytest.fixture
+def region_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(regions, 'get_regions', lambda region_def: _Regions())
+    regions._region_indexes.clear()
+    with config.set({'region_masks.uri': str(tmp_path / 'region_masks')}):
+        yield tmp_path / 'region_masks'
+    regions._region_indexes.clear()
+
+
+def _dataset(nlon=8):
+    lat, lon = np.arange(6.0), np.arange(float(nlon))
+    return xr.Dataset(
+        {'tasmax': (('time', 'lat', 'lon'), np.random.default_rng(0).normal(size=(3, 6, nlon)))},
+        coords={'time': pd.date_range('2000-01-01', periods=3), 'lat': lat, 'lon': lon},
+    ).chunk({'time': 1})
+
+
+def test_compute_region_index(region_cache):
+    index = regions.compute_region_index(_dataset(), 'test')
+    assert index.regions == [1, 7]
+    assert index.bboxes[7] == {'lat': slice(3, 6), 'lon': slice(6, 8)}
+    assert index.pixel_counts == {1: 7, 7: 6}
+    indexers = index.indexers(1)
+    np.testing.assert_array_equal(indexers['lat'], [1, 2, 4])
+    np.testing.assert_array_equal(indexers['lon'], [0, 2, 3, 4])
+    assert index.indexers(7) == index.bboxes[7]
+
+
+@pytest.mark.parametrize('region', [1, 7])
+def test_extract_region_matches_where(region_cache, region):
+    ds = _dataset()
+    actual = regions.extract_region(ds, region, 'test')
+    assert actual.tasmax.chunks is not None
+    expected = ds.where(_mask(ds) == region, drop=True)
+    xr.testing.assert_identical(actual.compute(), expected.compute())
+
+
+def test_extract_region_missing_region(region_cache):
+    with pytest.raises(ValueError, match='no pixels'):
+        regions.extract_region(_dataset(), 3, 'test')
+
+
+def test_get_region_index_is_cached(region_cache, monkeypatch):
+    ds = _dataset()
+    index = regions.get_region_index(ds, 'test')
+    assert regions.get_region_index(ds, 'test') is index
+    assert len(list(region_cache.glob('test/*.zarr'))) == 1
+
+    # a new process reads the index back from the store instead of rasterizing the regions again
+    regions._region_indexes.clear()
+    monkeypatch.setattr(regions, 'compute_region_index', None)
+    cached = regions.get_region_index(ds, 'test')
+    assert cached.bboxes == index.bboxes
+    assert cached.pixel_counts == index.pixel_counts
+    xr.testing.assert_equal(cached.mask.compute(), index.mask)
+
+    # other grids get their own index
+    with pytest.raises(TypeError):
+        regions.get_region_index(ds.isel(lat=slice(1, None)), 'test')
+
+
+def test_get_region_index_never_overwrites_the_store(region_cache):
+    # another task has started writing the index of the grid, but hasn't completed it yet
+    ds = _dataset()
+    path = regions.region_index_path(ds, 'test')
+    xr.Dataset({'partial': ('x', [1])}).to_zarr(path, consolidated=False)
+
+    index = regions.get_region_index(ds, 'test')
+    assert index.pixel_counts == {1: 7, 7: 6}
+    xr.testing.assert_equal(index.mask, _mask(ds))
+    assert list(xr.open_zarr(path, consolidated=False).data_vars) == ['partial']
+
+
+@pytest.mark.parametrize('write_empty_chunks', [True, False])
+def test_combine_regions(region_cache, tmp_path, write_empty_chunks):
+    from cmip6_downscaling.methods.maca.tasks import combine_regions
+
+    # 9 chunks of 48 longitudes, merged in blocks of 4 chunks: all regions are in the first chunk,
+    # so the last two blocks have no region at all
+    ds = _dataset(nlon=400).chunk({'time': -1})
+    template_path = tmp_path / 'template.zarr'
+    ds.to_zarr(template_path)
+    region_paths = []
+    for region in [1, 7]:
+        region_paths.append(tmp_path / f'region_{region}.zarr')
+        regions.extract_region(ds, region, 'test').to_zarr(region_paths[-1])
+
+    with config.set({'combine_regions.write_empty_chunks': write_empty_chunks}):
+        target = combine_regions.run([1, 7], region_paths, template_path)
+
+    expected = ds.where(_mask(ds).notnull())
+    xr.testing.assert_allclose(xr.open_zarr(target).compute(), expected.compute())
+    assert is_cached(target)
+    nchunks = zarr.open_group(str(target), mode='r')['tasmax'].nchunks_initialized
+    assert nchunks == (9 if write_empty_chunks else 1)